@@ -0,0 +1,38 @@
+"""
+Compare JSON decoders on /analytics/posts and /referrers sized payloads
+
+    python -m benchmarks.bench_json [repeat]
+"""
+
+from __future__ import absolute_import, print_function
+
+import sys
+import timeit
+
+from parsely.codec import available_codecs, get_codec
+
+from benchmarks import payloads
+
+PAYLOADS = {
+    "analytics_posts_100": payloads.encoded(payloads.analytics_posts(limit=100)),
+    "analytics_posts_2000": payloads.encoded(payloads.analytics_posts(limit=2000)),
+    "referrers_500": payloads.encoded(payloads.referrers(limit=500)),
+}
+
+
+def main(repeat=20):
+    results = {}
+    for name, body in sorted(PAYLOADS.items()):
+        for codec_name in available_codecs():
+            loads = get_codec(codec_name).loads
+            best = min(timeit.repeat(lambda: loads(body), number=1, repeat=repeat))
+            results[(name, codec_name)] = best
+            print(
+                "%-22s %-7s %8.2f ms  %7.1f MB/s"
+                % (name, codec_name, best * 1000, len(body) / best / 2**20)
+            )
+    return results
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
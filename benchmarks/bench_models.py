@@ -0,0 +1,107 @@
+"""
+Compare memory use and construction time of parsely.models.Post against the
+previous __dict__-based implementation
+
+    python -m benchmarks.bench_models [count]
+"""
+
+from __future__ import absolute_import, print_function
+
+import gc
+import sys
+import time
+import tracemalloc
+
+from parsely.models import Post
+
+
+class DictPost(object):
+    """Post as it was before __slots__: one attribute per metric via setattr"""
+
+    def __init__(self, **fields):
+        for name in (
+            "url",
+            "title",
+            "section",
+            "author",
+            "pub_date",
+            "tags",
+            "hits",
+            "shares",
+            "image_url",
+            "thumb_url_medium",
+            "metadata",
+            "visitors",
+        ):
+            setattr(self, name, fields.get(name))
+
+    @staticmethod
+    def new_from_json_dict(data):
+        post = DictPost(
+            url=data.get("url", None),
+            title=data.get("title", None),
+            section=data.get("section", None),
+            author=data.get("author", None),
+            pub_date=data.get("pub_date", None),
+            tags=data.get("tags", None),
+            hits=data.get("_hits", None),
+            shares=data.get("_shares", None),
+            visitors=data.get("visitors", None),
+            thumb_url_medium=data.get("thumb_url_medium", None),
+            image_url=data.get("image_url", None),
+            metadata=data.get("metadata", None),
+        )
+        if data.get("metrics"):
+            for metric, value in data["metrics"].items():
+                setattr(post, metric, value)
+        return post
+
+
+def rows(count):
+    return [
+        {
+            "url": "http://example.com/%d" % i,
+            "title": "Post %d" % i,
+            "section": "Tech",
+            "author": "Ars Staff",
+            "pub_date": "2017-09-04T12:00:00",
+            "tags": ["a", "b"],
+            "_hits": i,
+            "metrics": {"views": i, "visitors": i // 2, "engaged_minutes": i // 3},
+        }
+        for i in range(count)
+    ]
+
+
+def measure(cls, data):
+    gc.collect()
+    started = time.perf_counter()
+    posts = [cls.new_from_json_dict(row) for row in data]
+    elapsed = time.perf_counter() - started
+    del posts
+    gc.collect()
+    # build a second time under tracemalloc, which is too slow to time
+    tracemalloc.start()
+    posts = [cls.new_from_json_dict(row) for row in data]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # read every metric back, which costs nothing extra for plain slots
+    started = time.perf_counter()
+    total = sum(p.views + p.visitors + p.engaged_minutes for p in posts)
+    read = time.perf_counter() - started
+    return {"build_s": elapsed, "read_s": read, "bytes": size, "total": total}
+
+
+def main(count=100000):
+    data = rows(count)
+    results = {cls.__name__: measure(cls, data) for cls in (DictPost, Post)}
+    for name, res in results.items():
+        print(
+            "%-9s build %.3fs  read %.3fs  %7.1f bytes/post"
+            % (name, res["build_s"], res["read_s"], res["bytes"] / float(count))
+        )
+    return results
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,152 @@
+"""
+Load-test server.py against a local MockAPI, before and after it became a
+caching proxy, and write requests per second as JSON
+
+    python -m benchmarks.bench_server [--requests 400] [--concurrency 20] [--latency 0.01]
+
+"before" is the old demo handler: a new Parsely per request, checking its
+credentials and then blocking the IOLoop on `analytics`. "after" is
+server.get_app over one AsyncParsely, asked for `--distinct` different
+urls; "after_uncached" asks for a different url every time, so neither
+the cache nor coalescing can help.
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+
+import tornado.httpclient
+import tornado.web
+
+import server
+from parsely.aio import AsyncParsely
+from parsely.parsely import Parsely
+from parsely.testing import ServerThread
+
+from benchmarks.mockapi import MockAPI
+
+
+class LegacyHandler(tornado.web.RequestHandler):
+    def initialize(self, root):
+        self.root = root
+
+    def get(self, aspect):
+        # the old server built a client per request, which checked the
+        # credentials before answering
+        p = Parsely("example.com", "secret", root=self.root, authenticate=False)
+        p.authenticated()
+        res = p.analytics(aspect=aspect, page=int(self.get_query_argument("page")))
+        self.write({"data": [server.jsonable(item) for item in res]})
+
+
+def legacy_app(root):
+    return tornado.web.Application(
+        [(r"/analytics/(posts|authors)", LegacyHandler, {"root": root})]
+    )
+
+
+def proxy_app(root):
+    return server.get_app(AsyncParsely("example.com", "secret", root=root))
+
+
+async def load(urls, concurrency):
+    """
+    Fetch every url, `concurrency` at a time, returning the latencies
+    """
+    client = tornado.httpclient.AsyncHTTPClient(
+        force_instance=True, max_clients=concurrency
+    )
+    latencies = []
+    pending = iter(urls)
+
+    async def worker():
+        for url in pending:
+            started = time.perf_counter()
+            await client.fetch(url, headers={"Accept-Encoding": "gzip"})
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    client.close()
+    return latencies
+
+
+def run_case(api, make_app, requests, concurrency, distinct):
+    srv = ServerThread(lambda: make_app(api.root)).start()
+    aspects = ("posts", "authors")
+    urls = [
+        "%s/analytics/%s?page=%d" % (srv.url, aspects[i % 2], i % distinct + 1)
+        for i in range(requests)
+    ]
+    upstream = api.requests
+    try:
+        started = time.perf_counter()
+        latencies = asyncio.run(load(urls, concurrency))
+        elapsed = time.perf_counter() - started
+    finally:
+        srv.stop()
+    latencies.sort()
+    return {
+        "requests": requests,
+        "seconds": elapsed,
+        "per_second": requests / elapsed,
+        "p50": latencies[len(latencies) // 2],
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "upstream_requests": api.requests - upstream,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_server")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--distinct", type=int, default=10)
+    parser.add_argument("--output", default=None, help="write JSON results here")
+    args = parser.parse_args(argv)
+
+    # one access log line per request would be measured too
+    logging.getLogger("tornado.access").setLevel(logging.WARNING)
+    api = MockAPI(latency=args.latency, jitter=0.2, pages=10**6).start()
+    cases = [
+        ("before", legacy_app, args.distinct),
+        ("after", proxy_app, args.distinct),
+        ("after_uncached", proxy_app, args.requests),
+    ]
+    results = {}
+    try:
+        for name, make_app, distinct in cases:
+            results[name] = run_case(
+                api, make_app, args.requests, args.concurrency, distinct
+            )
+            print(
+                "%-16s %8.1f req/s  p50 %6.1fms  p99 %6.1fms  upstream %d"
+                % (
+                    name,
+                    results[name]["per_second"],
+                    results[name]["p50"] * 1000,
+                    results[name]["p99"] * 1000,
+                    results[name]["upstream_requests"],
+                ),
+                file=sys.stderr,
+            )
+    finally:
+        api.stop()
+
+    output = json.dumps(
+        {"meta": vars(args), "results": results}, indent=2, sort_keys=True
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Time importing the parsely package and constructing a client, each in a
+fresh interpreter, and list the heavy modules the import pulled in
+
+    python -m benchmarks.bench_startup [repeat]
+"""
+
+from __future__ import absolute_import, print_function
+
+import json
+import subprocess
+import sys
+
+# modules the plain client shouldn't need until they're used
+HEAVY = ("asyncio", "tornado")
+
+SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import parsely.parsely
+imported = time.perf_counter()
+parsely.parsely.Parsely("example.com", "secret", authenticate=%r)
+built = time.perf_counter()
+print(json.dumps({
+    "import_s": imported - started,
+    "construct_s": built - imported,
+    "loaded": [m for m in %r if m in sys.modules],
+}))
+"""
+
+
+def measure(authenticate):
+    script = SCRIPT % (authenticate, HEAVY)
+    output = subprocess.check_output([sys.executable, "-c", script])
+    return json.loads(output.decode("utf-8"))
+
+
+def main(repeat=5):
+    results = {}
+    for authenticate in (False, "lazy"):
+        runs = [measure(authenticate) for _ in range(repeat)]
+        res = results[authenticate] = {
+            "import_s": min(r["import_s"] for r in runs),
+            "construct_s": min(r["construct_s"] for r in runs),
+            "loaded": runs[-1]["loaded"],
+        }
+        print(
+            "authenticate=%-7r import %.1fms  construct %.3fms  loaded: %s"
+            % (
+                authenticate,
+                res["import_s"] * 1000,
+                res["construct_s"] * 1000,
+                ", ".join(res["loaded"]) or "-",
+            )
+        )
+    return results
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,202 @@
+"""
+Local stand-in for the Parse.ly API, serving the synthetic payloads in
+benchmarks.payloads for every endpoint Parsely and User call
+
+    python -m benchmarks.mockapi [--port 8765] [--latency 0.02] [--error-rate 0.01]
+
+or, from a benchmark,
+
+    >>> api = MockAPI(latency=0.01, rows=100).start()
+    >>> p = Parsely("example.com", "secret", root=api.root)
+    >>> api.stop()
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import threading
+
+import tornado.web
+
+from benchmarks import payloads
+from parsely.testing import ServerThread
+
+META_ASPECTS = ("authors", "sections", "tags")
+
+
+class MockHandler(tornado.web.RequestHandler):
+    def initialize(self, api):
+        self.api = api
+
+    async def get(self, path):
+        path = "/" + path
+        args = {k: self.get_argument(k) for k in self.request.arguments}
+        status, body, delay = self.api.respond(path, args)
+        if delay:
+            await asyncio.sleep(delay)
+        self.set_status(status)
+        self.set_header("Content-Type", "application/json")
+        self.finish(body)
+
+
+class MockAPI(ServerThread):
+    """
+    Tornado server answering requests the way the Parse.ly API would, from
+    a thread of its own
+
+    `latency` is the mean seconds each response is held back, spread by
+    `jitter` (a fraction of it). `rows` fixes the items per page, overriding
+    the request's `limit`, and pages past `pages` come back empty so
+    pagination ends. `error_rate` is the fraction of requests answered with
+    `error_status` instead.
+
+    `recordings` maps paths to recorded responses, replayed in place of
+    the synthetic ones: a dict, or a directory of JSON files named after the
+    path with "/" replaced by "_" (e.g. "analytics_posts.json"). Encoded
+    bodies are memoized, so serving them costs little next to the client
+    being measured.
+    """
+
+    def __init__(
+        self,
+        latency=0,
+        jitter=0.0,
+        rows=None,
+        pages=10,
+        error_rate=0.0,
+        error_status=503,
+        seed=0,
+        recordings=None,
+    ):
+        super(MockAPI, self).__init__()
+        self.latency = latency
+        self.jitter = jitter
+        self.rows = rows
+        self.pages = pages
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.seed = seed
+        self.recordings = _load_recordings(recordings)
+        self.requests = 0
+        self.errors = 0
+        self._rng = random.Random(seed)
+        self._bodies = {}
+        self._lock = threading.Lock()
+
+    @property
+    def root(self):
+        return self.url + "/v2"
+
+    def start(self, port=0):
+        self.port = port
+        return super(MockAPI, self).start()
+
+    def make_app(self):
+        return tornado.web.Application(
+            [(r"/v2/(.*)", MockHandler, {"api": self})],
+            # injected errors would otherwise be logged one by one
+            log_function=lambda handler: None,
+        )
+
+    def respond(self, path, args):
+        """
+        Return the status, encoded body and delay for a request
+        """
+        with self._lock:
+            self.requests += 1
+            failed = self.error_rate and self._rng.random() < self.error_rate
+            self.errors += bool(failed)
+            delay = self.latency
+            if delay and self.jitter:
+                delay = max(0, self._rng.gauss(delay, delay * self.jitter))
+        if failed:
+            body = {"code": self.error_status, "message": "injected error"}
+            return self.error_status, payloads.encoded(body), delay
+        key = (path, tuple(sorted(args.items())))
+        body = self._bodies.get(key)
+        if body is None:
+            body = self._bodies[key] = payloads.encoded(self.payload(path, args))
+        return 200, body, delay
+
+    def payload(self, path, args):
+        if path in self.recordings:
+            return self.recordings[path]
+        page = int(args.get("page") or 1)
+        limit = self.rows if self.rows else int(args.get("limit") or 10)
+        if page > self.pages:
+            return {"data": []}
+        parts = path.strip("/").split("/")
+        if parts[0] == "profile":
+            return {"success": True}
+        if parts[0] == "history":
+            urls = [p["url"] for p in payloads.analytics_posts(10)["data"]]
+            return {"data": {"uuid": args.get("uuid"), "urls": urls}}
+        if path == "/shares/post/detail":
+            return payloads.shares_detail(args.get("url", ""), seed=self.seed)
+        if path == "/referrers/post/detail" or (
+            parts[0] == "referrers" and len(parts) == 2
+        ):
+            ref_type = parts[1] if parts[1] != "post" else "social"
+            return payloads.referrers(limit, page, self.seed, ref_type)
+        if path == "/analytics/post/detail":
+            return payloads.analytics_posts(1, 1, self.seed)
+        aspect = parts[-1] if parts[-1] != "detail" else "posts"
+        if aspect in META_ASPECTS:
+            return payloads.meta(aspect, limit, page, self.seed)
+        posts = payloads.analytics_posts(limit, page, self.seed)
+        if parts[0] == "shares":
+            for post in posts["data"]:
+                post["_shares"] = post["_hits"] // 10
+        return posts
+
+
+def _load_recordings(recordings):
+    if not recordings:
+        return {}
+    if isinstance(recordings, dict):
+        return dict(recordings)
+    loaded = {}
+    for name in os.listdir(recordings):
+        if name.endswith(".json"):
+            with open(os.path.join(recordings, name)) as f:
+                loaded["/" + name[:-5].replace("_", "/")] = json.load(f)
+    return loaded
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.mockapi",
+        description="Serve synthetic Parse.ly API responses locally",
+    )
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--jitter", type=float, default=0)
+    parser.add_argument("--rows", type=int, default=None)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--recordings", default=None)
+    args = parser.parse_args(argv)
+
+    api = MockAPI(
+        latency=args.latency,
+        jitter=args.jitter,
+        rows=args.rows,
+        pages=args.pages,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        recordings=args.recordings,
+    ).start(args.port)
+    print("serving on %s" % api.root)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        api.stop()
+
+
+if __name__ == "__main__":
+    main()
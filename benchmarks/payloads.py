@@ -0,0 +1,81 @@
+"""
+Synthetic API responses shaped like the Parse.ly endpoints the client uses
+
+The generators are deterministic, so benchmark runs stay comparable.
+"""
+
+from __future__ import absolute_import
+
+import json
+import random
+import zlib
+
+from parsely.models import METRICS
+
+SECTIONS = ["Tech", "Science", "Policy", "Gaming", "Cars"]
+AUTHORS = ["Ars Staff", "Jon Brodkin", "Dan Goodin", "Beth Mole", "Eric Berger"]
+
+
+def post(i, rng, metrics=("views", "visitors", "engaged_minutes")):
+    return {
+        "url": "https://example.com/2017/09/post-%d/" % i,
+        "title": "Synthetic post number %d with a realistic title length" % i,
+        "section": rng.choice(SECTIONS),
+        "author": rng.choice(AUTHORS),
+        "authors": [rng.choice(AUTHORS)],
+        "pub_date": "2017-09-%02dT%02d:00:00" % (1 + i % 28, i % 24),
+        "tags": rng.sample(["security", "android", "space", "policy", "ai"], 2),
+        "thumb_url_medium": "https://images.example.com/thumb/%d.jpg" % i,
+        "image_url": "https://images.example.com/full/%d.jpg" % i,
+        "metadata": "",
+        "_hits": rng.randint(1, 100000),
+        "metrics": {name: rng.randint(0, 50000) for name in metrics},
+    }
+
+
+def analytics_posts(limit=100, page=1, seed=0, metrics=METRICS[:3]):
+    rng = random.Random(seed * 100003 + page)
+    start = (page - 1) * limit
+    return {
+        "data": [post(start + i, rng, metrics) for i in range(limit)],
+        "links": {"next": "/analytics/posts?page=%d" % (page + 1)},
+    }
+
+
+def meta(aspect, limit=100, page=1, seed=0):
+    rng = random.Random(seed * 100003 + page)
+    key = aspect[:-1]
+    return {
+        "data": [
+            {
+                key: "%s %d" % (key, (page - 1) * limit + i),
+                "_hits": rng.randint(1, 9999),
+            }
+            for i in range(limit)
+        ]
+    }
+
+
+def referrers(limit=100, page=1, seed=0, ref_type="social"):
+    rng = random.Random(seed * 100003 + page)
+    return {
+        "data": [
+            {
+                "name": "referrer-%d.example.com" % ((page - 1) * limit + i),
+                "type": ref_type,
+                "_hits": rng.randint(1, 9999),
+            }
+            for i in range(limit)
+        ]
+    }
+
+
+def shares_detail(url, seed=0):
+    rng = random.Random(zlib.crc32(url.encode("utf-8")) ^ seed)
+    counts = {k: rng.randint(0, 500) for k in ("fb", "tw", "pi", "li")}
+    counts["total"] = sum(counts.values())
+    return {"data": [counts]}
+
+
+def encoded(payload):
+    return json.dumps(payload).encode("utf-8")
@@ -0,0 +1,213 @@
+"""
+Measure the client end to end against a local MockAPI and write the results
+as JSON, for tracking over time
+
+    python -m benchmarks.suite [--output results.json] [--calls 200] [--latency 0.005]
+
+Covers the blocking, callback and asyncio paths, pagination with and
+without prefetching, model construction and JSON decoding. Each case
+reports throughput, latency percentiles (from parsely.instrument.Recorder)
+and the peak memory traced while it ran.
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import asyncio
+import contextlib
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import warnings
+
+from parsely.aio import AsyncParsely
+from parsely.instrument import Recorder
+from parsely.parsely import Parsely
+from parsely.recommendations import User
+
+from benchmarks import bench_json, bench_models
+from benchmarks.mockapi import MockAPI
+
+
+def client(api, recorder, cls=Parsely, **kwargs):
+    if cls is Parsely:
+        kwargs["authenticate"] = False
+    return cls("example.com", "secret", root=api.root, instrument=recorder, **kwargs)
+
+
+def measure(run, recorder):
+    """
+    Run one case, returning its wall time, the latency stats of the endpoint
+    it called most and the peak memory traced during a second run
+    """
+    recorder.reset()
+    started = time.perf_counter()
+    items = run()
+    elapsed = time.perf_counter() - started
+    stats = recorder.stats()
+    # tracemalloc slows allocation down too much to time the same run
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    calls = sum(s["count"] for s in stats.values())
+    result = {
+        "seconds": elapsed,
+        "calls": calls,
+        "calls_per_s": calls / elapsed,
+        "items": items,
+        "items_per_s": items / elapsed,
+        "peak_bytes": peak,
+        "errors": sum(s["errors"] for s in stats.values()),
+    }
+    busiest = max(stats.values(), key=lambda s: s["count"])
+    for key in ("p50", "p95", "p99", "phases"):
+        result[key] = busiest[key]
+    return result
+
+
+def sync_case(api, recorder, calls):
+    p = client(api, recorder)
+
+    def run():
+        return sum(len(p.analytics(limit=100)) for _ in range(calls))
+
+    return run
+
+
+def callback_case(api, recorder, calls):
+    p = client(api, recorder)
+
+    def run():
+        received = []
+        for _ in range(calls):
+            p.analytics(limit=100, _callback=received.append)
+        return sum(len(posts) for posts in received)
+
+    return run
+
+
+def async_case(api, recorder, calls, concurrency=10):
+    def run():
+        async def go():
+            p = client(api, recorder, cls=AsyncParsely, coalesce=False)
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def one():
+                async with semaphore:
+                    return len(await p.analytics(limit=100))
+
+            return sum(await asyncio.gather(*[one() for _ in range(calls)]))
+
+        return asyncio.run(go())
+
+    return run
+
+
+def pagination_case(api, recorder, prefetch, items):
+    p = client(api, recorder)
+
+    def run():
+        pages = p.paginate("analytics", limit=100, prefetch=prefetch, max_items=items)
+        return sum(1 for _ in pages)
+
+    return run
+
+
+def user_case(api, recorder, calls):
+    user = User(client(api, recorder), "benchmark-uuid")
+
+    def run():
+        return sum(len(user.related(limit=50)) for _ in range(calls))
+
+    return run
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.suite")
+    parser.add_argument("--output", default=None, help="write JSON results here")
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--error-rate", type=float, default=0)
+    args = parser.parse_args(argv)
+
+    api = MockAPI(
+        latency=args.latency, jitter=0.2, pages=50, error_rate=args.error_rate
+    ).start()
+    recorder = Recorder(size=10000)
+    cases = [
+        ("sync", sync_case(api, recorder, args.calls)),
+        ("callback", callback_case(api, recorder, args.calls)),
+        ("async", async_case(api, recorder, args.calls)),
+        ("user_related", user_case(api, recorder, args.calls)),
+        ("paginate_prefetch_0", pagination_case(api, recorder, 0, 2000)),
+        ("paginate_prefetch_4", pagination_case(api, recorder, 4, 2000)),
+    ]
+    results = {}
+    try:
+        for name, run in cases:
+            try:
+                results[name] = measure(run, recorder)
+            except Exception as e:
+                results[name] = {"error": repr(e)}
+            print("%-22s %s" % (name, _summary(results[name])), file=sys.stderr)
+    finally:
+        api.stop()
+
+    # keep stdout for the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        models = bench_models.main(20000)
+        decode = bench_json.main(5)
+    results["models"] = {
+        name: {k: v for k, v in res.items() if k != "total"}
+        for name, res in models.items()
+    }
+    results["json_decode"] = {"%s/%s" % key: seconds for key, seconds in decode.items()}
+
+    report = {"meta": _meta(args), "results": results}
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return report
+
+
+def _summary(result):
+    if "error" in result:
+        return "failed: %s" % result["error"]
+    return "%8.1f calls/s  p50 %6.2fms  p99 %6.2fms  peak %6.1f MB" % (
+        result["calls_per_s"],
+        result["p50"] * 1000,
+        result["p99"] * 1000,
+        result["peak_bytes"] / 2.0**20,
+    )
+
+
+def _meta(args):
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL
+        )
+        commit = commit.decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": time.time(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "calls": args.calls,
+        "latency": args.latency,
+        "error_rate": args.error_rate,
+    }
+
+
+if __name__ == "__main__":
+    # the callback path uses tornado's deprecated global IOLoop
+    warnings.simplefilter("ignore", DeprecationWarning)
+    main()
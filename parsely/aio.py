@@ -0,0 +1,309 @@
+from __future__ import absolute_import
+
+import asyncio
+import time
+
+from .batch import batch_async, iter_batch_async
+from .errors import AuthenticationError
+from .pagination import paginate_async
+from .parsely import Parsely
+from .pool import ParselyPool, SiteResult
+from .recommendations import User
+from .sharding import query_shards_async
+from .transport import AsyncTransport
+from .jsonstream import ArrayItemParser
+from .utils import (
+    ParselyAPIConnection,
+    _build_item,
+    _healthy,
+    _stream_read,
+    _stream_started,
+)
+
+
+class AsyncParselyAPIConnection(ParselyAPIConnection):
+    """
+    Connection whose `_request_endpoint` is a coroutine
+
+    One connection can be shared by any number of AsyncParsely and AsyncUser
+    objects, and used from whichever asyncio loop is running.
+    """
+
+    def __init__(self, apikey, secret=None, root=None, transport=None, **kwargs):
+        super(AsyncParselyAPIConnection, self).__init__(
+            apikey,
+            secret=secret,
+            root=root,
+            transport=transport if transport else AsyncTransport(),
+            **kwargs
+        )
+
+    async def _request_endpoint(self, endpoint, options={}, record=None):
+        key, ttl = self._cache_key(endpoint, options)
+        entry, stale = self._cache_lookup(key, ttl)
+        if stale:
+            self.refresher.revalidate_async(key, lambda: self._load(endpoint, options))
+        if record is not None and key is not None:
+            record.cache = "miss" if entry is None else "stale" if stale else "hit"
+        if entry is not None:
+            return self._decode_cached(entry, record)
+        return await self._load(endpoint, options, record)
+
+    async def _load(self, endpoint, options, record=None):
+        key, ttl = self._cache_key(endpoint, options)
+        url = self._build_url(endpoint, options)
+        if self.flights is None:
+            return await self._fetch(endpoint, url, key, ttl, record)
+        js = await self.flights.do_async(
+            self._flight_key(endpoint, options),
+            lambda: self._fetch(endpoint, url, key, ttl, record),
+        )
+        if record is not None and not record.attempts:
+            record.coalesced = True
+        return js
+
+    async def _stream_endpoint(self, endpoint, options={}):
+        record = self._begin(endpoint)
+        url = self._build_url(endpoint, options)
+        try:
+            if self.retry is None:
+                response = await self._open_stream(endpoint, url, record=record)
+            else:
+                response = await self.retry.run_async(
+                    endpoint,
+                    lambda connect_timeout, read_timeout: self._open_stream(
+                        endpoint, url, connect_timeout, read_timeout, record
+                    ),
+                    hedge=False,
+                )
+            if not 200 <= response.code < 300:
+                self._decode(response, record)
+            _stream_started(response, record)
+            parser = ArrayItemParser("data")
+            try:
+                async for chunk in response.body:
+                    _stream_read(chunk, record)
+                    for item in parser.feed(chunk):
+                        yield item
+            finally:
+                await response.body.aclose()
+            for item in parser.close():
+                yield item
+            self._check_stream(parser)
+        except Exception as e:
+            self._end(record, e)
+            raise
+        finally:
+            self._end(record)
+
+    async def _open_stream(
+        self, endpoint, url, connect_timeout=None, read_timeout=None, record=None
+    ):
+        if record is not None:
+            record.attempts += 1
+        if self.limiter is not None:
+            await self.limiter.acquire_async(self.apikey, endpoint)
+        chunks = self.transport.stream(
+            url, connect_timeout=connect_timeout, read_timeout=read_timeout
+        )
+        if self.concurrency is None:
+            return await _open_async(chunks)
+        await self.concurrency.acquire_async()
+        started, ok = time.time(), False
+        try:
+            ret = await _open_async(chunks)
+            ok = _healthy(ret)
+        finally:
+            self.concurrency.release(time.time() - started, ok)
+        return ret
+
+    def pin(self, endpoint, options, interval=60):
+        """
+        Like ParselyAPIConnection.pin, refetching from a task on the running
+        event loop, so it must be called from a coroutine
+        """
+        if self.cache is None:
+            raise ValueError("pinning queries requires a cache")
+        return self.refresher.pin_async(endpoint, options, interval)
+
+    async def _fetch(self, endpoint, url, key, ttl, record=None):
+        if self.retry is None:
+            ret = await self._attempt(endpoint, url, record=record)
+        else:
+            ret = await self.retry.run_async(
+                endpoint,
+                lambda connect_timeout, read_timeout, hedge=False: self._attempt(
+                    endpoint, url, connect_timeout, read_timeout, record, hedge
+                ),
+            )
+        js = self._decode(ret, record)
+        self._cache_store(key, ttl, ret)
+        return js
+
+    async def _attempt(
+        self,
+        endpoint,
+        url,
+        connect_timeout=None,
+        read_timeout=None,
+        record=None,
+        hedge=False,
+    ):
+        if record is not None:
+            if hedge:
+                record.hedged += 1
+            else:
+                record.attempts += 1
+        if self.limiter is not None:
+            await self.limiter.acquire_async(self.apikey, endpoint)
+        if self.concurrency is None:
+            return await self.transport.fetch(url, connect_timeout, read_timeout)
+        await self.concurrency.acquire_async()
+        started, ok = time.time(), False
+        try:
+            ret = await self.transport.fetch(url, connect_timeout, read_timeout)
+            ok = _healthy(ret)
+        finally:
+            self.concurrency.release(time.time() - started, ok)
+        return ret
+
+
+async def _open_async(chunks):
+    # like utils._open, for an asynchronous transport
+    response = await chunks.__anext__()
+    if 200 <= response.code < 300:
+        response.body = chunks
+    else:
+        response.body = b"".join([chunk async for chunk in chunks])
+    return response
+
+
+class AsyncClientMixin(object):
+    def batch(self, calls, max_concurrency=10):
+        return batch_async(self, calls, max_concurrency=max_concurrency)
+
+    def iter_batch(self, calls, max_concurrency=10, ordered=False):
+        return iter_batch_async(
+            self, calls, max_concurrency=max_concurrency, ordered=ordered
+        )
+
+    def paginate(self, method, *args, prefetch=2, max_items=None, **kwargs):
+        return paginate_async(
+            self, method, *args, prefetch=prefetch, max_items=max_items, **kwargs
+        )
+
+    def sharded(self, method, start, end, shard="day", max_concurrency=8, **kwargs):
+        return query_shards_async(
+            self,
+            method,
+            start,
+            end,
+            shard=shard,
+            max_concurrency=max_concurrency,
+            **kwargs
+        )
+
+    async def stream(self, method, *args, **kwargs):
+        endpoint, options, datafunc = self._describe_call(method, *args, **kwargs)
+        async for item in self.conn._stream_endpoint(endpoint, options):
+            yield _build_item(datafunc, item)
+
+    def _call(self, endpoint, options, datafunc, _callback=None):
+        return self._call_async(endpoint, options, datafunc, _callback)
+
+    async def _call_async(self, endpoint, options, datafunc, _callback=None):
+        cached = self._from_cache(endpoint, options)
+        if cached is not None:
+            if _callback:
+                _callback(cached)
+            return cached
+        record = self.conn._begin(endpoint)
+        try:
+            res = await self.conn._request_endpoint(endpoint, options, record=record)
+            res = self.conn._construct(record, datafunc, res)
+        except Exception as e:
+            self.conn._end(record, e)
+            raise
+        self.conn._end(record)
+        if _callback:
+            _callback(res)
+        return res
+
+
+class AsyncParsely(AsyncClientMixin, Parsely):
+    """
+    Parsely client whose methods return awaitables
+
+    Construction does not touch the network; await `authenticated()` to check
+    the credentials. Extra keyword arguments are passed on to
+    AsyncParselyAPIConnection.
+
+        >>> p = AsyncParsely("mysite.com", secret="...")
+        >>> posts, authors = await asyncio.gather(
+        ...     p.analytics(), p.analytics(aspect="authors")
+        ... )
+    """
+
+    def __init__(self, apikey, secret=None, root=None, **kwargs):
+        self.conn = AsyncParselyAPIConnection(
+            apikey, secret=secret, root=root, **kwargs
+        )
+
+    async def authenticated(self, _callback=None):
+        try:
+            return await Parsely.authenticated(self, _callback)
+        except AuthenticationError:
+            if _callback:
+                _callback(False)
+            return False
+
+
+class AsyncUser(AsyncClientMixin, User):
+    pass
+
+
+class AsyncParselyPool(ParselyPool):
+    """
+    ParselyPool of AsyncParsely clients sharing one AsyncTransport
+
+    `client` and `fan_out` are coroutines.
+    """
+
+    client_class = AsyncParsely
+
+    def _default_transport(self):
+        return AsyncTransport()
+
+    def _build(self, apikey, secret):
+        return self.client_class(
+            apikey,
+            secret=secret,
+            root=self.root,
+            transport=self.transport,
+            **self.shared
+        )
+
+    async def client(self, apikey, verify=True):
+        client = self._client(apikey)
+        ok = client.conn.credentials_ok()
+        if verify and ok is None:
+            ok = await client.authenticated()
+        if ok is False:
+            raise AuthenticationError("Authentication failed for %s" % apikey)
+        return client
+
+    async def fan_out(self, method, *args, sites=None, max_concurrency=10, **kwargs):
+        sites = list(sites) if sites else list(self.sites)
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def run(site):
+            async with semaphore:
+                try:
+                    client = await self.client(site)
+                    return SiteResult(
+                        site, await getattr(client, method)(*args, **kwargs), None
+                    )
+                except Exception as e:
+                    return SiteResult(site, None, e)
+
+        return await asyncio.gather(*[run(site) for site in sites])
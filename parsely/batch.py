@@ -0,0 +1,111 @@
+from __future__ import absolute_import
+
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+Call = namedtuple("Call", ["method", "args", "kwargs"])
+
+
+class BatchResult(namedtuple("BatchResult", ["index", "call", "result", "error"])):
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def call(method, *args, **kwargs):
+    """
+    Describe one client call for `batch`, e.g. call("shares", post=url)
+    """
+    return Call(method, args, kwargs)
+
+
+def _as_call(spec):
+    if isinstance(spec, Call):
+        return spec
+    method, args, kwargs = (tuple(spec) + ((), {}))[:3]
+    return Call(method, tuple(args), dict(kwargs))
+
+
+def _invoke(client, index, spec):
+    try:
+        return BatchResult(
+            index, spec, getattr(client, spec.method)(*spec.args, **spec.kwargs), None
+        )
+    except Exception as e:
+        return BatchResult(index, spec, None, e)
+
+
+def iter_batch(client, calls, max_concurrency=10, ordered=True):
+    """
+    Run `calls` against `client` from a pool of `max_concurrency` threads
+
+    Yields a BatchResult per call, in input order if `ordered` or as soon as
+    each finishes otherwise. A failing call is reported through the result's
+    `error` rather than raised. `calls` may be a generator; it is read at most
+    `2 * max_concurrency` calls ahead of the results handed back.
+    """
+    calls = enumerate(calls)
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        pending = deque()
+
+        def fill():
+            for index, spec in calls:
+                pending.append(executor.submit(_invoke, client, index, _as_call(spec)))
+                if len(pending) >= 2 * max_concurrency:
+                    return
+
+        fill()
+        while pending:
+            if ordered:
+                yield pending.popleft().result()
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+                    yield future.result()
+            fill()
+
+
+async def _invoke_async(client, index, spec, slots):
+    async with slots:
+        try:
+            res = await getattr(client, spec.method)(*spec.args, **spec.kwargs)
+            return BatchResult(index, spec, res, None)
+        except Exception as e:
+            return BatchResult(index, spec, None, e)
+
+
+def _async_tasks(client, calls, max_concurrency):
+    import asyncio
+
+    slots = asyncio.Semaphore(max_concurrency)
+    return [
+        _invoke_async(client, index, _as_call(spec), slots)
+        for index, spec in enumerate(calls)
+    ]
+
+
+async def batch_async(client, calls, max_concurrency=10):
+    import asyncio
+
+    return await asyncio.gather(*_async_tasks(client, calls, max_concurrency))
+
+
+async def iter_batch_async(client, calls, max_concurrency=10, ordered=False):
+    import asyncio
+
+    if not ordered:
+        for task in asyncio.as_completed(_async_tasks(client, calls, max_concurrency)):
+            yield await task
+        return
+    tasks = [
+        asyncio.ensure_future(coro)
+        for coro in _async_tasks(client, calls, max_concurrency)
+    ]
+    try:
+        for task in tasks:
+            yield await task
+    finally:
+        # only left unfinished if the caller stopped early
+        for task in tasks:
+            task.cancel()
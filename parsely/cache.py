@@ -0,0 +1,165 @@
+from __future__ import absolute_import
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import date
+
+from six.moves.urllib.parse import urlencode
+
+CacheEntry = namedtuple("CacheEntry", ["value", "created", "expires"])
+
+
+def request_key(rooturl, apikey, endpoint, options, secret=None):
+    """
+    Build the cache key for a request
+
+    Options are sorted and empty values dropped, as `_request_endpoint` does
+    when building the query string, so equivalent calls share one key. The
+    key holds a digest of the secret rather than the secret itself, so a
+    client with the wrong secret never reads what a shared cache holds for
+    the right one.
+    """
+    query = urlencode(sorted((k, str(v)) for k, v in options.items() if v))
+    digest = hashlib.sha256((secret or "").encode("utf-8")).hexdigest()[:16]
+    return "%s%s?apikey=%s&%s#%s" % (rooturl, endpoint, apikey, query, digest)
+
+
+class TTLPolicy(object):
+    """
+    Decide how long a response may be cached, in seconds
+
+    `endpoints` maps endpoint prefixes to a fixed TTL and is checked first; a
+    TTL of 0 disables caching. Otherwise queries whose date range ended before
+    today get `historical`, queries over a `days` window get `window`, and
+    everything else (realtime queries, lookups by url or uuid) gets `realtime`.
+
+    With `stale` set, entries are kept that many seconds past their TTL. A
+    stale entry is still served, while a background fetch refreshes it; only
+    once it is past TTL + `stale` does a caller wait on the network.
+    """
+
+    default_endpoints = {"/profile": 0, "/history": 0}
+
+    def __init__(
+        self, realtime=30, window=300, historical=86400, endpoints=None, stale=0
+    ):
+        self.realtime = realtime
+        self.window = window
+        self.historical = historical
+        self.stale = stale
+        self.endpoints = dict(self.default_endpoints)
+        self.endpoints.update(endpoints if endpoints else {})
+
+    def ttl(self, endpoint, options):
+        for prefix in sorted(self.endpoints, key=len, reverse=True):
+            if endpoint.startswith(prefix):
+                return self.endpoints[prefix]
+        today = date.today().strftime("%Y-%m-%d")
+        ends = [
+            options.get(name)
+            for name in ("period_end", "pub_date_end")
+            if options.get(name)
+        ]
+        if ends and max(ends) < today:
+            return self.historical
+        if options.get("time"):
+            return self.realtime
+        if options.get("days") or options.get("pub_days") or ends:
+            return self.window
+        return self.realtime
+
+
+class CacheBackend(object):
+    """
+    Interface for response caches
+
+    Values are raw response bodies. `get` returns a CacheEntry, or None if the
+    key is missing or expired.
+    """
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+
+class MemoryCache(CacheBackend):
+    """
+    In-process LRU cache bounded by number of entries and total bytes
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires <= time.time():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, value, ttl):
+        size = len(key) + len(value)
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = CacheEntry(value, now, now + ttl)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= len(key) + len(entry.value)
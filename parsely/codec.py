@@ -0,0 +1,69 @@
+from __future__ import absolute_import
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+class JSONCodec(object):
+    """
+    Decodes API response bodies; the default uses the stdlib json module
+    """
+
+    name = "json"
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonCodec(JSONCodec):
+    name = "orjson"
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError("orjson is not installed")
+        self.loads = orjson.loads
+
+
+class UjsonCodec(JSONCodec):
+    name = "ujson"
+
+    def __init__(self):
+        if ujson is None:
+            raise ImportError("ujson is not installed")
+        self.loads = ujson.loads
+
+
+CODECS = {"json": JSONCodec, "orjson": OrjsonCodec, "ujson": UjsonCodec}
+
+
+def available_codecs():
+    return [
+        name
+        for name, module in (("orjson", orjson), ("ujson", ujson), ("json", json))
+        if module is not None
+    ]
+
+
+def get_codec(codec=None):
+    """
+    Return a codec instance from a name, an instance, or None for the fastest
+    installed decoder
+    """
+    if isinstance(codec, JSONCodec):
+        return codec
+    if codec is None:
+        codec = available_codecs()[0]
+    if codec not in CODECS:
+        raise ValueError(
+            "Unknown codec: %s. Choose from %s" % (codec, ", ".join(sorted(CODECS)))
+        )
+    return CODECS[codec]()
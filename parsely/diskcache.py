@@ -0,0 +1,250 @@
+from __future__ import absolute_import, print_function
+
+import argparse
+import json
+import mmap
+import os
+import sys
+import threading
+import time
+
+from .cache import CacheBackend, CacheEntry
+
+SEGMENT = "responses.seg"
+INDEX = "responses.idx"
+
+
+class DiskCache(CacheBackend):
+    """
+    Persistent cache of response bodies in a directory
+
+    Bodies are appended to a segment file and read back through `mmap`; an
+    append-only index file records each key's offset, length, creation and
+    expiry time, and is replayed when the cache is opened, so entries survive
+    process restarts. Keys are the same request keys MemoryCache uses.
+
+    Overwritten, deleted and expired entries leave dead bytes behind. Once
+    the segment grows past `max_bytes`, `compact` rewrites it with only live
+    entries, dropping the oldest ones until they take at most three quarters
+    of it. One process at a time should write to a directory.
+    """
+
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024):
+        self.directory = directory = os.path.expanduser(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.compactions = 0
+        self._lock = threading.RLock()
+        self._index = {}
+        self._map = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._open()
+
+    @property
+    def segment_path(self):
+        return os.path.join(self.directory, SEGMENT)
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, INDEX)
+
+    def get(self, key):
+        with self._lock:
+            record = self._index.get(key)
+            if record is not None and record[3] <= time.time():
+                self._delete(key)
+                self.expirations += 1
+                record = None
+            if record is None:
+                self.misses += 1
+                return None
+            offset, length, created, expires = record
+            if self._map is None or len(self._map) < offset + length:
+                self._remap()
+            self.hits += 1
+            return CacheEntry(self._map[offset : offset + length], created, expires)
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self._lock:
+            offset = self._segment.seek(0, os.SEEK_END)
+            self._segment.write(value)
+            self._segment.flush()
+            record = (offset, len(value), now, now + ttl)
+            self._journal({"k": key, "r": record})
+            self._index[key] = record
+            if offset + len(value) > self.max_bytes:
+                self.compact()
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._index:
+                self._delete(key)
+
+    def clear(self):
+        with self._lock:
+            self._close()
+            for path in (self.segment_path, self.index_path):
+                if os.path.exists(path):
+                    os.unlink(path)
+            self._index = {}
+            self._open()
+
+    def items(self):
+        """
+        Return (key, offset, length, created, expires) for every entry
+        """
+        with self._lock:
+            return [(key,) + tuple(record) for key, record in self._index.items()]
+
+    def prune(self, max_bytes=None):
+        """
+        Drop expired entries, and the oldest ones until the live entries take
+        at most `max_bytes`; then compact
+        """
+        with self._lock:
+            now = time.time()
+            for key, record in list(self._index.items()):
+                if record[3] <= now:
+                    self._delete(key)
+                    self.expirations += 1
+            if max_bytes is not None:
+                live = sum(record[1] for record in self._index.values())
+                oldest = sorted(self._index.items(), key=lambda item: item[1][2])
+                for key, record in oldest:
+                    if live <= max_bytes:
+                        break
+                    self._delete(key)
+                    live -= record[1]
+            self._rewrite()
+
+    def compact(self):
+        # leave headroom so the next few writes don't compact again
+        with self._lock:
+            self.prune(int(self.max_bytes * 0.75))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "expirations": self.expirations,
+                "compactions": self.compactions,
+                "entries": len(self._index),
+                "bytes": sum(record[1] for record in self._index.values()),
+                "segment_bytes": os.path.getsize(self.segment_path),
+            }
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _open(self):
+        self._segment = open(self.segment_path, "ab+")
+        size = self._segment.seek(0, os.SEEK_END)
+        self._index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line.decode("utf-8"))
+                    except ValueError:
+                        # a write cut short by a crash; nothing follows it
+                        break
+                    record = entry.get("r")
+                    if record is None:
+                        self._index.pop(entry["k"], None)
+                    elif record[0] + record[1] <= size:
+                        self._index[entry["k"]] = tuple(record)
+        self._index_file = open(self.index_path, "ab")
+        self._map = None
+
+    def _close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._segment.close()
+        self._index_file.close()
+
+    def _remap(self):
+        if self._map is not None:
+            self._map.close()
+        self._map = mmap.mmap(self._segment.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _journal(self, entry):
+        self._index_file.write(json.dumps(entry).encode("utf-8") + b"\n")
+        self._index_file.flush()
+
+    def _delete(self, key):
+        del self._index[key]
+        self._journal({"k": key})
+
+    def _rewrite(self):
+        # copy live entries into fresh files, then swap them in
+        if self._index:
+            self._remap()
+        segment_tmp = self.segment_path + ".tmp"
+        index_tmp = self.index_path + ".tmp"
+        with open(segment_tmp, "wb") as segment, open(index_tmp, "wb") as journal:
+            for key, (offset, length, created, expires) in self._index.items():
+                record = (segment.tell(), length, created, expires)
+                segment.write(self._map[offset : offset + length])
+                journal.write(json.dumps({"k": key, "r": record}).encode("utf-8"))
+                journal.write(b"\n")
+        self._close()
+        os.replace(segment_tmp, self.segment_path)
+        os.replace(index_tmp, self.index_path)
+        self._open()
+        self.compactions += 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m parsely.diskcache",
+        description="Inspect or prune a parsely DiskCache directory",
+    )
+    parser.add_argument("directory")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+    commands.add_parser("stats", help="print entry counts and sizes")
+    commands.add_parser("list", help="list keys with their size and expiry")
+    get = commands.add_parser("get", help="print the cached body for a key")
+    get.add_argument("key")
+    prune = commands.add_parser(
+        "prune", help="drop expired entries, then the oldest past --max-bytes"
+    )
+    prune.add_argument("--max-bytes", type=int, default=None)
+    commands.add_parser("clear", help="delete every entry")
+    args = parser.parse_args(argv)
+
+    cache = DiskCache(args.directory, max_bytes=sys.maxsize)
+    try:
+        if args.command == "stats":
+            print(json.dumps(cache.stats(), indent=2, sort_keys=True))
+        elif args.command == "list":
+            now = time.time()
+            for key, _, length, _, expires in sorted(cache.items()):
+                state = "expired" if expires <= now else "%ds" % (expires - now)
+                print("%10d  %-10s %s" % (length, state, key))
+        elif args.command == "get":
+            entry = cache.get(args.key)
+            if entry is None:
+                print("not cached: %s" % args.key, file=sys.stderr)
+                return 1
+            sys.stdout.write(entry.value.decode("utf-8") + "\n")
+        elif args.command == "prune":
+            before = cache.stats()["segment_bytes"]
+            cache.prune(args.max_bytes)
+            print("%d -> %d bytes" % (before, cache.stats()["segment_bytes"]))
+        elif args.command == "clear":
+            cache.clear()
+    finally:
+        cache.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,35 @@
+from __future__ import absolute_import
+
+
+class ParselyError(Exception):
+    """
+    Base class for errors raised by python-parsely
+    """
+
+
+class DeadlineExceeded(ParselyError, TimeoutError):
+    """
+    A request, including its retries, ran past its RetryPolicy deadline
+    """
+
+
+class AuthenticationError(ParselyError, ValueError):
+    """
+    The API rejected the API key and secret (HTTP 403)
+    """
+
+
+class HTTPError(ParselyError):
+    """
+    The API answered with an error status, after any retries
+
+    `code` is the HTTP status, or the error code in the body of a response
+    that came back as 200, and `message` the API's explanation if it gave one.
+    """
+
+    def __init__(self, code, message=None):
+        super(HTTPError, self).__init__(
+            "HTTP %d%s" % (code, ": %s" % message if message else "")
+        )
+        self.code = code
+        self.message = message
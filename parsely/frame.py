@@ -0,0 +1,157 @@
+from __future__ import absolute_import
+
+import heapq
+from array import array
+
+NAN = float("nan")
+
+# string columns per aspect, as (column, keys to read it from)
+ASPECT_FIELDS = {
+    "posts": (
+        ("url", ("url",)),
+        ("title", ("title",)),
+        ("section", ("section",)),
+        ("author", ("author",)),
+        ("pub_date", ("pub_date",)),
+    ),
+    "authors": (("name", ("author",)),),
+    "sections": (("name", ("section",)),),
+    "tags": (("name", ("tag",)),),
+    "referrers": (
+        ("name", ("name", "title")),
+        ("ref_type", ("ref_type", "type", "category")),
+    ),
+}
+
+
+def _number(value):
+    return NAN if value is None else float(value)
+
+
+def _sort_key(column):
+    # NaNs (missing values) sort below every number
+    return lambda i: column[i] if column[i] == column[i] else float("-inf")
+
+
+class ResultFrame(object):
+    """
+    Column-oriented result set
+
+    String columns are lists; `hits` and every metric are typed arrays of
+    floats, with NaN where a row has no value. Rows are never materialized as
+    objects. Operations return new frames and leave this one untouched.
+    """
+
+    def __init__(self, columns, length):
+        self.columns = columns
+        self.length = length
+
+    @classmethod
+    def from_rows(cls, rows, aspect="posts"):
+        fields = ASPECT_FIELDS[aspect]
+        columns = {name: [] for name, _ in fields}
+        columns["hits"] = hits = array("d")
+        metrics = {}
+        length = 0
+        for row in rows:
+            for name, keys in fields:
+                value = None
+                for key in keys:
+                    value = row.get(key)
+                    if value is not None:
+                        break
+                columns[name].append(value)
+            hits.append(_number(row.get("_hits")))
+            for metric, value in (row.get("metrics") or {}).items():
+                if metric not in metrics:
+                    metrics[metric] = array("d", [NAN]) * length
+                metrics[metric].append(_number(value))
+            length += 1
+            for column in metrics.values():
+                if len(column) < length:
+                    column.append(NAN)
+        columns.update(metrics)
+        return cls(columns, length)
+
+    @classmethod
+    def concat(cls, frames):
+        """
+        Stack frames, e.g. successive pages, into one. Columns missing from a
+        frame are filled with None or NaN.
+        """
+        frames = list(frames)
+        columns = {}
+        length = 0
+        for frame in frames:
+            for name, column in frame.columns.items():
+                if name not in columns:
+                    columns[name] = (
+                        array("d", [NAN]) * length
+                        if isinstance(column, array)
+                        else [None] * length
+                    )
+            length += len(frame)
+            for name, column in columns.items():
+                if name in frame.columns:
+                    column.extend(frame.columns[name])
+                elif isinstance(column, array):
+                    column.extend(array("d", [NAN]) * len(frame))
+                else:
+                    column.extend([None] * len(frame))
+        return cls(columns, length)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __iter__(self):
+        return self.rows()
+
+    def rows(self):
+        names = list(self.columns)
+        for i in range(self.length):
+            yield {name: self.columns[name][i] for name in names}
+
+    def take(self, indices):
+        indices = list(indices)
+        columns = {}
+        for name, column in self.columns.items():
+            if isinstance(column, array):
+                columns[name] = array("d", [column[i] for i in indices])
+            else:
+                columns[name] = [column[i] for i in indices]
+        return ResultFrame(columns, len(indices))
+
+    def filter(self, name, predicate):
+        column = self.columns[name]
+        return self.take(i for i in range(self.length) if predicate(column[i]))
+
+    def sort(self, name, reverse=True):
+        return self.take(
+            sorted(
+                range(self.length), key=_sort_key(self.columns[name]), reverse=reverse
+            )
+        )
+
+    def top(self, name, k=10):
+        return self.take(
+            heapq.nlargest(k, range(self.length), key=_sort_key(self.columns[name]))
+        )
+
+    def to_numpy(self):
+        """
+        Return the columns as NumPy arrays; numeric columns share memory with
+        this frame. Requires numpy.
+        """
+        import numpy
+
+        return {
+            name: (
+                numpy.frombuffer(column, dtype=numpy.float64)
+                if isinstance(column, array)
+                else numpy.array(column, dtype=object)
+            )
+            for name, column in self.columns.items()
+        }
@@ -0,0 +1,203 @@
+from __future__ import absolute_import
+
+import inspect
+import json
+import os
+import tempfile
+from datetime import date, datetime, timedelta
+
+DATE_FORMAT = "%Y-%m-%d"
+
+
+def _parse_date(value):
+    return datetime.strptime(value, DATE_FORMAT).date()
+
+
+class SyncState(object):
+    """
+    Watermark and fetch log of an IncrementalSync, persisted as JSON
+
+    `windows` maps the date of each window to the date it was last fetched
+    on. The file is replaced atomically on every save, so a crash never
+    leaves it half written.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.watermark = None
+        self.windows = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.watermark = data.get("watermark")
+            self.windows = data.get("windows", {})
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".sync-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(
+                    {"watermark": self.watermark, "windows": self.windows},
+                    f,
+                    sort_keys=True,
+                )
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+
+class WindowStore(object):
+    """
+    In-memory sink keeping the latest items of each window
+
+    Storing a window replaces whatever was stored for it before, so fetching
+    a window twice never double counts it.
+    """
+
+    def __init__(self):
+        self.windows = {}
+
+    def __call__(self, window, items):
+        self.windows[window] = list(items)
+
+    def items(self):
+        for window in sorted(self.windows):
+            for item in self.windows[window]:
+                yield window, item
+
+    def totals(self):
+        """
+        Sum hits per url (or name, for authors, sections and tags) over every
+        stored window
+        """
+        totals = {}
+        for _, item in self.items():
+            key = getattr(item, "url", None) or getattr(item, "name", None)
+            totals[key] = totals.get(key, 0) + (item.hits or 0)
+        return totals
+
+
+class IncrementalSync(object):
+    """
+    Mirror a paged, date-filtered client method one day-long window at a time
+
+    Each run covers the last `days` days up to today, but only fetches the
+    windows that are new or may still change: a window is final once it has
+    been fetched more than `settle` days after it ended. Every fetched window
+    is handed to `sink(window, items)`, which must replace anything it stored
+    for that window before, and is then recorded in `state`, a SyncState or
+    the path of its file. A run that crashes resumes with the windows it had
+    not finished.
+
+    Windows filter on the period (`by="period"`, i.e. start/end) or on the
+    publication date (`by="pub_date"`, i.e. pub_start/pub_end). Other
+    arguments are passed on to the method, except those the sync sets itself
+    (the window's dates, `limit` and `page`), e.g.
+
+        >>> sync = IncrementalSync(p, "posts.sync", "analytics", aspect="posts")
+        >>> sync.run()
+    """
+
+    def __init__(
+        self,
+        client,
+        state,
+        method="analytics",
+        *args,
+        days=14,
+        settle=1,
+        by="period",
+        sink=None,
+        limit=100,
+        prefetch=2,
+        **kwargs
+    ):
+        if by not in ("period", "pub_date"):
+            raise ValueError("by must be 'period' or 'pub_date'")
+        self.client = client
+        self.state = state if isinstance(state, SyncState) else SyncState(state)
+        self.method = method
+        self.args = args
+        self.days = days
+        self.settle = settle
+        self.by = by
+        self.sink = sink if sink is not None else WindowStore()
+        self.limit = limit
+        self.prefetch = prefetch
+        self.kwargs = kwargs
+        try:
+            # the arguments of every page request, with a sample window
+            inspect.signature(getattr(client, method)).bind_partial(
+                *args, page=1, limit=limit, **self._window_args(date.today()), **kwargs
+            )
+        except TypeError as e:
+            raise ValueError(
+                "IncrementalSync sets the window's dates, limit and page of "
+                "%s itself: %s" % (method, e)
+            )
+
+    def plan(self, today=None):
+        """
+        Return the windows the next run would fetch, oldest first
+        """
+        today = today if today else date.today()
+        first = today - timedelta(days=self.days - 1)
+        windows = [first + timedelta(days=n) for n in range(self.days)]
+        return [window for window in windows if not self._final(window)]
+
+    def run(self, today=None):
+        """
+        Fetch every window in the plan and return them
+        """
+        today = today if today else date.today()
+        fetched = []
+        for window in self.plan(today):
+            items = self.client.paginate(
+                self.method,
+                *self.args,
+                prefetch=self.prefetch,
+                limit=self.limit,
+                **self._window_args(window),
+                **self.kwargs
+            )
+            self.sink(window, list(items))
+            self.state.windows[window.strftime(DATE_FORMAT)] = today.strftime(
+                DATE_FORMAT
+            )
+            self._advance(today)
+            self.state.save()
+            fetched.append(window)
+        self._advance(today)
+        self.state.save()
+        return fetched
+
+    def _final(self, window):
+        fetched_on = self.state.windows.get(window.strftime(DATE_FORMAT))
+        if fetched_on is None:
+            return False
+        return _parse_date(fetched_on) > window + timedelta(days=self.settle)
+
+    def _window_args(self, window):
+        if self.by == "period":
+            return {"start": window, "end": window}
+        return {"pub_start": window, "pub_end": window}
+
+    def _advance(self, today):
+        # forget windows that have left the range; the watermark is the last
+        # day up to which every window is final
+        first = today - timedelta(days=self.days - 1)
+        self.state.windows = {
+            window: fetched_on
+            for window, fetched_on in self.state.windows.items()
+            if _parse_date(window) >= first
+        }
+        watermark = None
+        for n in range(self.days):
+            window = first + timedelta(days=n)
+            if not self._final(window):
+                break
+            watermark = window.strftime(DATE_FORMAT)
+        if watermark is not None:
+            self.state.watermark = watermark
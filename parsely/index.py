@@ -0,0 +1,197 @@
+from __future__ import absolute_import
+
+import heapq
+import threading
+
+from .batch import call
+from .models import Shares
+
+
+class PostRecord(object):
+    """
+    Everything PostIndex knows about one url
+
+    `post` comes from analytics, `shares` is a Shares from shares(post=url),
+    or one with only the total from shares(aspect="posts"), `referrals` maps
+    referrer types to the hits they sent
+    (from referrers_meta) and `referrers` holds the post's own top referrers
+    once they have been fetched.
+    """
+
+    __slots__ = ("url", "post", "shares", "referrals", "referrers")
+
+    def __init__(self, url):
+        self.url = url
+        self.post = None
+        self.shares = None
+        self.referrals = {}
+        self.referrers = None
+
+    @property
+    def hits(self):
+        return self.post.hits if self.post is not None else None
+
+    def top_referrers(self, k=5):
+        if not self.referrers:
+            return []
+        return heapq.nlargest(k, self.referrers, key=lambda r: r.hits or 0)
+
+
+class PostIndex(object):
+    """
+    Posts, their shares and their referrers joined in memory, keyed by url
+
+    Pages from analytics, shares and referrers_meta are ingested in bulk as
+    they arrive, from `load_*` or by handing items to `add_*`; re-ingesting a
+    url updates its record in place. Lookups by url, author, section and tag
+    are dictionary lookups, and `fill` fetches only the per-post details that
+    are still missing.
+
+        >>> index = PostIndex(p)
+        >>> index.load_analytics(days=7, limit=100, max_items=1000)
+        >>> index.load_shares(days=7, limit=100, max_items=1000)
+        >>> index.load_referrals("social", days=7)
+        >>> top = index.top(10)
+        >>> index.fill(top)
+    """
+
+    def __init__(self, client=None):
+        self.client = client
+        self._records = {}
+        self._by = {"author": {}, "section": {}, "tag": {}}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, url):
+        return url in self._records
+
+    def get(self, url):
+        return self._records.get(url)
+
+    def by_author(self, author):
+        return self._lookup("author", author)
+
+    def by_section(self, section):
+        return self._lookup("section", section)
+
+    def by_tag(self, tag):
+        return self._lookup("tag", tag)
+
+    def top(self, k=10, by="hits"):
+        """
+        Return the `k` records whose post ranks highest on `hits` or a metric
+        """
+        with self._lock:
+            records = [r for r in self._records.values() if r.post is not None]
+        return heapq.nlargest(k, records, key=lambda r: _value(r.post, by))
+
+    def add_posts(self, posts):
+        # `posts` may be a lazy pager, so don't hold the lock across fetches
+        for post in posts:
+            with self._lock:
+                record = self._record(post.url)
+                self._unindex(record)
+                record.post = post
+                self._index(record)
+
+    def add_shares(self, posts):
+        for post in posts:
+            with self._lock:
+                # listings only carry the total, as the post's `shares`
+                self._record(post.url).shares = Shares(total=post.shares)
+
+    def add_referrals(self, posts, ref_type):
+        for post in posts:
+            with self._lock:
+                self._record(post.url).referrals[ref_type] = post.hits
+
+    def load_analytics(self, **kwargs):
+        self.add_posts(self.client.paginate("analytics", aspect="posts", **kwargs))
+
+    def load_shares(self, **kwargs):
+        self.add_shares(self.client.paginate("shares", aspect="posts", **kwargs))
+
+    def load_referrals(self, ref_type="social", **kwargs):
+        self.add_referrals(
+            self.client.referrers_meta(ref_type=ref_type, meta="posts", **kwargs),
+            ref_type,
+        )
+
+    def fill(self, records, shares=True, referrers=True, max_concurrency=10):
+        """
+        Fetch the post, shares and top referrers of the given records (or
+        urls) that don't have them yet, in one concurrent batch
+        """
+        with self._lock:
+            records = [
+                self._record(r) if not isinstance(r, PostRecord) else r for r in records
+            ]
+        calls = []
+        targets = []
+        for record in records:
+            if record.post is None:
+                calls.append(call("post_detail", record.url))
+                targets.append((record, "post"))
+            if shares and record.shares is None:
+                calls.append(call("shares", post=record.url))
+                targets.append((record, "shares"))
+            if referrers and record.referrers is None:
+                calls.append(call("referrers_post_detail", record.url))
+                targets.append((record, "referrers"))
+        results = self.client.batch(calls, max_concurrency=max_concurrency)
+        with self._lock:
+            for result in results:
+                if not result.ok:
+                    continue
+                record, field = targets[result.index]
+                if field == "post":
+                    self._unindex(record)
+                    record.post = result.result
+                    self._index(record)
+                else:
+                    setattr(record, field, result.result)
+        return records
+
+    def _record(self, url):
+        record = self._records.get(url)
+        if record is None:
+            record = self._records[url] = PostRecord(url)
+        return record
+
+    def _keys(self, record):
+        post = record.post
+        if post is None:
+            return []
+        keys = []
+        for field, values in (
+            ("author", post.author),
+            ("section", post.section),
+            ("tag", post.tags),
+        ):
+            if not isinstance(values, (list, tuple)):
+                values = [values]
+            keys.extend((field, value) for value in values if value)
+        return keys
+
+    def _index(self, record):
+        for field, value in self._keys(record):
+            self._by[field].setdefault(value, set()).add(record.url)
+
+    def _unindex(self, record):
+        for field, value in self._keys(record):
+            urls = self._by[field].get(value)
+            if urls is not None:
+                urls.discard(record.url)
+                if not urls:
+                    del self._by[field][value]
+
+    def _lookup(self, field, value):
+        with self._lock:
+            return [self._records[url] for url in self._by[field].get(value, ())]
+
+
+def _value(post, name):
+    value = getattr(post, name, None)
+    return value if isinstance(value, (int, float)) else float("-inf")
@@ -0,0 +1,302 @@
+from __future__ import absolute_import
+
+import re
+import threading
+import time
+
+from .retry import LatencyTracker
+
+# where the time of one call goes, in the order it is spent; "connect"
+# includes the DNS lookup and is 0 on a reused socket
+PHASES = ("connect", "ttfb", "transfer", "decode", "build")
+
+# endpoints naming an entity, reported by template so that stats, labels and
+# span names stay few however many authors or sections are looked up
+_TEMPLATES = (
+    (re.compile(r"^/analytics/[^/]+/.+/detail$"), "/analytics/{aspect}/{value}/detail"),
+    (
+        re.compile(r"^/referrers/[^/]+/[^/]+/.+/detail$"),
+        "/referrers/{ref_type}/{meta}/{value}/detail",
+    ),
+)
+
+
+def endpoint_template(path):
+    """
+    Return the template of an API path, or the path itself if it names no
+    entity
+
+        >>> endpoint_template("/analytics/author/Ars Staff/detail")
+        '/analytics/{aspect}/{value}/detail'
+    """
+    for pattern, template in _TEMPLATES:
+        if pattern.match(path):
+            return template
+    return path
+
+
+class CallRecord(object):
+    """
+    Timings and outcome of one client call, filled in as it progresses
+
+    `path` is the endpoint called and `endpoint` its template, which is what
+    calls are grouped by.
+    Phases are in seconds, or None where they didn't happen (a cache hit has
+    no network phases) or the transport can't tell them apart. `cache` is
+    "hit", "stale" (served while being refreshed), "miss" or None for
+    uncached requests; `coalesced` is set when the call waited on an
+    identical request already in flight instead of making its own.
+    `hedged` counts duplicate attempts sent by a hedging RetryPolicy, which
+    are not retries.
+    """
+
+    __slots__ = PHASES + (
+        "endpoint",
+        "path",
+        "started",
+        "total",
+        "bytes",
+        "status",
+        "cache",
+        "coalesced",
+        "attempts",
+        "hedged",
+        "error",
+        "token",
+    )
+
+    def __init__(self, path):
+        self.endpoint = endpoint_template(path)
+        self.path = path
+        self.started = time.perf_counter()
+        self.total = None
+        self.bytes = None
+        self.status = None
+        self.cache = None
+        self.coalesced = False
+        self.attempts = 0
+        self.hedged = 0
+        self.error = None
+        self.token = None
+        for phase in PHASES:
+            setattr(self, phase, None)
+
+    @property
+    def retries(self):
+        return max(0, self.attempts - 1)
+
+    def phases(self):
+        return {
+            phase: getattr(self, phase)
+            for phase in PHASES
+            if getattr(self, phase) is not None
+        }
+
+
+class Instrument(object):
+    """
+    Hooks around every call a client makes through its connection
+
+    `start` is called as a call begins and may return a token, which is
+    handed back to `finish` once the call's CallRecord is complete. Both run
+    on the calling thread (or event loop), so they should be quick. Pass
+    instruments to a connection as `instrument=`, alone or in a list.
+    """
+
+    def start(self, record):
+        return None
+
+    def finish(self, record, token):
+        pass
+
+
+class Instruments(Instrument):
+    """
+    Several instruments called in turn
+    """
+
+    def __init__(self, instruments):
+        self.instruments = list(instruments)
+
+    def start(self, record):
+        return [instrument.start(record) for instrument in self.instruments]
+
+    def finish(self, record, token):
+        for instrument, t in zip(self.instruments, token):
+            instrument.finish(record, t)
+
+
+def combine(instrument):
+    if isinstance(instrument, (list, tuple)):
+        return Instruments(instrument)
+    return instrument
+
+
+class Recorder(Instrument):
+    """
+    Keep latency samples of the last `size` calls per endpoint template, and
+    counts of their outcomes, for `stats`
+    """
+
+    def __init__(self, size=1000):
+        self.size = size
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+            self.since = time.time()
+
+    def finish(self, record, token):
+        with self._lock:
+            stats = self._endpoints.get(record.endpoint)
+            if stats is None:
+                stats = self._endpoints[record.endpoint] = _EndpointStats(self.size)
+        stats.add(record)
+
+    def stats(self):
+        """
+        Return, per endpoint, the call count, errors, retries, hedged
+        attempts, bytes read, cache outcomes, calls per second since the last
+        reset, and the p50/p95/p99 of the total time and of each phase, in
+        seconds
+        """
+        with self._lock:
+            endpoints = dict(self._endpoints)
+        elapsed = max(time.time() - self.since, 1e-9)
+        return {
+            endpoint: stats.snapshot(elapsed) for endpoint, stats in endpoints.items()
+        }
+
+
+class _EndpointStats(object):
+    def __init__(self, size):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.hedged = 0
+        self.bytes = 0
+        self.coalesced = 0
+        self.cache = {}
+        self.latency = {
+            name: LatencyTracker(size, min_samples=1) for name in PHASES + ("total",)
+        }
+
+    def add(self, record):
+        with self._lock:
+            self.count += 1
+            self.errors += record.error is not None
+            self.retries += record.retries
+            self.hedged += record.hedged
+            self.bytes += record.bytes or 0
+            self.coalesced += record.coalesced
+            if record.cache is not None:
+                self.cache[record.cache] = self.cache.get(record.cache, 0) + 1
+        self.latency["total"].add(record.total)
+        for phase, seconds in record.phases().items():
+            self.latency[phase].add(seconds)
+
+    def snapshot(self, elapsed):
+        with self._lock:
+            snapshot = {
+                "count": self.count,
+                "errors": self.errors,
+                "retries": self.retries,
+                "hedged": self.hedged,
+                "bytes": self.bytes,
+                "coalesced": self.coalesced,
+                "cache": dict(self.cache),
+                "per_second": self.count / elapsed,
+            }
+        snapshot.update(_percentiles(self.latency["total"]))
+        snapshot["phases"] = {
+            phase: _percentiles(self.latency[phase])
+            for phase in PHASES
+            if self.latency[phase].percentile(50) is not None
+        }
+        return snapshot
+
+
+def _percentiles(tracker):
+    return {"p%d" % q: tracker.percentile(q) for q in (50, 95, 99)}
+
+
+class PrometheusInstrument(Instrument):
+    """
+    Export calls to Prometheus-style metrics
+
+    `latency` is a histogram labelled ("endpoint", "phase"), observed once
+    per phase and once with phase "total"; `size` is an optional histogram
+    of response bytes labelled ("endpoint",), and `calls` an optional
+    counter labelled ("endpoint", "cache", "outcome"). Anything with
+    prometheus_client's `labels(...).observe()` / `.inc()` will do.
+
+        >>> from prometheus_client import Counter, Histogram
+        >>> latency = Histogram("parsely_seconds", "...", ["endpoint", "phase"])
+        >>> p = Parsely(..., instrument=PrometheusInstrument(latency))
+    """
+
+    def __init__(self, latency, size=None, calls=None):
+        self.latency = latency
+        self.size = size
+        self.calls = calls
+
+    def finish(self, record, token):
+        endpoint = record.endpoint
+        for phase, seconds in record.phases().items():
+            self.latency.labels(endpoint=endpoint, phase=phase).observe(seconds)
+        self.latency.labels(endpoint=endpoint, phase="total").observe(record.total)
+        if self.size is not None and record.bytes is not None:
+            self.size.labels(endpoint=endpoint).observe(record.bytes)
+        if self.calls is not None:
+            self.calls.labels(
+                endpoint=endpoint,
+                cache=record.cache or "none",
+                outcome="error" if record.error is not None else "ok",
+            ).inc()
+
+
+class SpanInstrument(Instrument):
+    """
+    Wrap every call in an OpenTelemetry-style span
+
+    `tracer` needs `start_span(name, attributes=...)` returning a span with
+    `set_attribute`, `record_exception` and `end`, as OpenTelemetry's
+    tracers do. Spans are named after the endpoint template, with the path
+    called as the "parsely.path" attribute. Phase timings are set as
+    "parsely.<phase>_ms" attributes.
+    """
+
+    def __init__(self, tracer, prefix="parsely"):
+        self.tracer = tracer
+        self.prefix = prefix
+
+    def start(self, record):
+        return self.tracer.start_span(
+            self.prefix + " " + record.endpoint,
+            attributes={
+                self.prefix + ".endpoint": record.endpoint,
+                self.prefix + ".path": record.path,
+            },
+        )
+
+    def finish(self, record, span):
+        prefix = self.prefix + "."
+        for phase, seconds in record.phases().items():
+            span.set_attribute(prefix + phase + "_ms", seconds * 1000.0)
+        span.set_attribute(prefix + "total_ms", record.total * 1000.0)
+        span.set_attribute(prefix + "cache", record.cache or "none")
+        span.set_attribute(prefix + "retries", record.retries)
+        if record.hedged:
+            span.set_attribute(prefix + "hedged", record.hedged)
+        if record.coalesced:
+            span.set_attribute(prefix + "coalesced", True)
+        if record.bytes is not None:
+            span.set_attribute(prefix + "bytes", record.bytes)
+        if record.status is not None:
+            span.set_attribute("http.status_code", record.status)
+        if record.error is not None:
+            span.record_exception(record.error)
+        span.end()
@@ -0,0 +1,113 @@
+from __future__ import absolute_import
+
+import codecs
+import json
+import re
+
+# whitespace and separators between tokens
+_SEPARATORS = re.compile(r"[ \t\r\n,:]*")
+_START, _FIELDS, _ARRAY = range(3)
+_CLOSERS = {"{": "}", "[": "]", '"': '"'}
+
+
+class ArrayItemParser(object):
+    """
+    Incremental parser for a JSON object holding one large array
+
+    Feed it the response body chunk by chunk; `feed` returns the elements of
+    the array under `key` that were completed by that chunk, each decoded on
+    its own, so only one element and one chunk are buffered at a time. The
+    object's other fields are decoded as they complete and collected in
+    `fields`. `close` returns any elements only the end of the body completed.
+
+    Each element is decoded straight out of the buffer by `raw_decode`, which
+    also finds where it ends. An object, array or string cut off at the end
+    of the buffer is retried only once a chunk brings a delimiter that could
+    close it, so partial elements are not decoded over and over.
+    """
+
+    def __init__(self, key="data", decoder=None):
+        self.key = key
+        self.fields = {}
+        self.found = False
+        self._decode = (decoder if decoder else json.JSONDecoder()).raw_decode
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        # the delimiter that can complete the pending token, if it has one
+        self._closer = None
+        self._state = _START
+        self._field = None
+        self._done = False
+
+    def feed(self, chunk):
+        text = self._text.decode(chunk)
+        self._buf += text
+        if self._done or (self._closer is not None and self._closer not in text):
+            return []
+        self._closer = None
+        items = []
+        buf, i = self._buf, 0
+        while not self._done:
+            i = _SEPARATORS.match(buf, i).end()
+            if i == len(buf):
+                break
+            c = buf[i]
+            if self._state == _START:
+                if c != "{":
+                    raise ValueError("expected a JSON object")
+                self._state = _FIELDS
+                i += 1
+            elif self._state == _ARRAY and c == "]":
+                self._state = _FIELDS
+                i += 1
+            elif self._state == _FIELDS and c == "}":
+                self._done = True
+                i += 1
+            elif self._state == _FIELDS and self._field == self.key and c == "[":
+                self.found = True
+                self._state = _ARRAY
+                self._field = None
+                i += 1
+            else:
+                end = self._token(buf, i, items)
+                if end is None:
+                    # wait for the rest of the token
+                    self._closer = _CLOSERS.get(c)
+                    break
+                i = end
+        self._buf = buf[i:]
+        return items
+
+    def close(self):
+        items = []
+        if not self._done:
+            self._buf += self._text.decode(b"", True)
+            self._closer = None
+            items = self.feed(b"")
+        if not self._done:
+            if self._buf.strip():
+                # report why the remainder doesn't decode, if it doesn't
+                self._decode(self._buf.strip())
+            raise ValueError("truncated JSON document")
+        return items
+
+    def _token(self, buf, i, items):
+        """
+        Decode the value at `buf[i]`, returning where it ends, or None if it
+        may not have arrived in full
+        """
+        try:
+            value, end = self._decode(buf, i)
+        except ValueError:
+            return None
+        if end == len(buf) and buf[end - 1].isdigit():
+            # a number at the end of the buffer may continue in the next chunk
+            return None
+        if self._state == _ARRAY:
+            items.append(value)
+        elif self._field is None:
+            self._field = value
+        else:
+            self.fields[self._field] = value
+            self._field = None
+        return end
@@ -0,0 +1,321 @@
+from __future__ import absolute_import
+
+import asyncio
+import heapq
+import logging
+import threading
+import time
+from collections import namedtuple
+
+log = logging.getLogger(__name__)
+
+ASPECTS = ("posts", "authors", "sections", "tags", "referrers")
+
+
+class Change(
+    namedtuple(
+        "Change",
+        [
+            "aspect",
+            "key",
+            "item",
+            "rank",
+            "previous_rank",
+            "value",
+            "delta",
+            "velocity",
+        ],
+    )
+):
+    """
+    One top-K entry that changed between two polls
+
+    `rank` is 1-based, or None once the entry has left the top K;
+    `previous_rank` is None for a newcomer. `delta` is the change of the
+    metric since the last poll and `velocity` that change per second.
+    """
+
+    @property
+    def dropped(self):
+        return self.rank is None
+
+    @property
+    def new(self):
+        return self.previous_rank is None
+
+
+class TopK(object):
+    """
+    The `k` keys with the highest values, kept up to date as values change
+
+    Keys outside the top K wait in a max-heap whose stale entries are skipped
+    when they surface, so `update` costs O((k + changed) log n) rather than a
+    sort of every key.
+    """
+
+    def __init__(self, k):
+        self.k = k
+        self.values = {}
+        self.top = []
+        self._rest = []
+
+    def update(self, changed, removed=()):
+        """
+        Apply new values (a dict) and removed keys, returning the new top K,
+        highest first
+        """
+        for key in removed:
+            self.values.pop(key, None)
+        self.values.update(changed)
+        candidates = set(key for key in self.top if key in self.values)
+        candidates.update(changed)
+        # the best k keys outside the candidates could still make the cut
+        runners_up = 0
+        while self._rest and runners_up < self.k:
+            value, key = heapq.heappop(self._rest)
+            if self.values.get(key) == -value and key not in candidates:
+                candidates.add(key)
+                runners_up += 1
+        self.top = heapq.nlargest(self.k, candidates, key=self.values.__getitem__)
+        chosen = set(self.top)
+        for key in candidates - chosen:
+            heapq.heappush(self._rest, (-self.values[key], key))
+        if len(self._rest) > 4 * len(self.values) + self.k:
+            self._compact(chosen)
+        return self.top
+
+    def _compact(self, chosen):
+        self._rest = [(-v, key) for key, v in self.values.items() if key not in chosen]
+        heapq.heapify(self._rest)
+
+
+class Leaderboard(object):
+    """
+    Realtime top-K lists for a site, refreshed by polling
+
+    Every `interval` seconds (from `start`'s thread, or from `updates` on
+    an event loop) each aspect in `aspects` is fetched: posts, authors,
+    sections and tags with `method` ("analytics" or "realtime") and the
+    other keyword arguments, referrers of `ref_type` with `referrers`.
+    Entries are ranked on `metric`. Only entries whose
+    value or rank changed, and those that left the top `k`, are handed to
+    subscribers, as a list of Change per aspect. A subscriber that raises is
+    logged and skipped.
+
+        >>> board = Leaderboard(p, aspects=("posts", "authors"), k=10,
+        ...                     method="realtime", interval=15)
+        >>> board.subscribe(lambda aspect, changes: push(aspect, changes))
+        >>> board.start()
+
+    or, with an AsyncParsely client,
+
+        >>> async for aspect, changes in board.updates():
+        ...     push(aspect, changes)
+    """
+
+    def __init__(
+        self,
+        client,
+        aspects=("posts",),
+        k=10,
+        interval=10,
+        method="analytics",
+        metric="hits",
+        limit=100,
+        ref_type="social",
+        **kwargs
+    ):
+        for aspect in aspects:
+            if aspect not in ASPECTS:
+                raise ValueError("Invalid aspect: %s" % aspect)
+        self.client = client
+        self.aspects = tuple(aspects)
+        self.k = k
+        self.interval = interval
+        self.method = method
+        self.metric = metric
+        self.limit = limit
+        self.ref_type = ref_type
+        self.kwargs = kwargs
+        self.polls = 0
+        self.errors = 0
+        self._boards = {aspect: TopK(k) for aspect in self.aspects}
+        self._items = {aspect: {} for aspect in self.aspects}
+        self._polled = {}
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def top(self, aspect="posts"):
+        """
+        Return the current top K items of an aspect, highest first
+        """
+        with self._lock:
+            items = self._items[aspect]
+            return [items[key] for key in self._boards[aspect].top]
+
+    def subscribe(self, callback):
+        """
+        Call `callback(aspect, changes)` after every poll that changed an
+        aspect's top K. Returns the callback, for `unsubscribe`.
+        """
+        with self._lock:
+            self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers.remove(callback)
+
+    def poll(self):
+        """
+        Fetch every aspect once and return {aspect: [Change, ...]}
+        """
+        return self._apply({aspect: self._fetch(aspect) for aspect in self.aspects})
+
+    async def poll_async(self):
+        """
+        Like `poll`, fetching every aspect concurrently
+        """
+        results = await asyncio.gather(
+            *[_result(self._fetch(aspect)) for aspect in self.aspects]
+        )
+        return self._apply(dict(zip(self.aspects, results)))
+
+    async def updates(self):
+        """
+        Poll every `interval` seconds, yielding (aspect, changes) for every
+        aspect whose top K changed
+        """
+        while True:
+            try:
+                changes = await self.poll_async()
+            except Exception as e:
+                self._failed(e)
+                changes = {}
+            for aspect in self.aspects:
+                if changes.get(aspect):
+                    yield aspect, changes[aspect]
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._stopped.clear()
+                self._thread = threading.Thread(target=self._loop)
+                self._thread.daemon = True
+                self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def _loop(self):
+        while not self._stopped.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                self._failed(e)
+            self._stopped.wait(self.interval)
+
+    def _failed(self, error):
+        with self._lock:
+            self.errors += 1
+        log.warning("Leaderboard poll failed: %r", error)
+
+    def _fetch(self, aspect):
+        if aspect == "referrers":
+            return self.client.referrers(ref_type=self.ref_type)
+        return getattr(self.client, self.method)(
+            aspect=aspect, limit=self.limit, **self.kwargs
+        )
+
+    def _apply(self, results):
+        now = time.time()
+        with self._lock:
+            self.polls += 1
+            changes = {
+                aspect: self._diff(aspect, items, now)
+                for aspect, items in results.items()
+            }
+            subscribers = list(self._subscribers)
+        for aspect, aspect_changes in changes.items():
+            if aspect_changes:
+                for callback in subscribers:
+                    try:
+                        callback(aspect, aspect_changes)
+                    except Exception:
+                        # the poll itself succeeded, and the other
+                        # subscribers still get their changes
+                        log.exception("Leaderboard subscriber %r failed", callback)
+        return changes
+
+    def _diff(self, aspect, items, now):
+        board = self._boards[aspect]
+        known = self._items[aspect]
+        elapsed = now - self._polled.get(aspect, now)
+        self._polled[aspect] = now
+
+        fresh = {}
+        changed = {}
+        for item in items:
+            key = _key(item)
+            value = getattr(item, self.metric, None) or 0
+            fresh[key] = item
+            if board.values.get(key) != value:
+                changed[key] = value
+        removed = [key for key in known if key not in fresh]
+        before = {key: rank for rank, key in enumerate(board.top, 1)}
+        previous = {key: board.values.get(key) for key in changed}
+        self._items[aspect] = fresh
+        top = board.update(changed, removed)
+        ranked = set(top)
+
+        out = []
+        for rank, key in enumerate(top, 1):
+            if key in changed or before.get(key) != rank:
+                value = board.values[key]
+                old = previous.get(key)
+                delta = value - old if old is not None else 0
+                out.append(
+                    Change(
+                        aspect,
+                        key,
+                        fresh[key],
+                        rank,
+                        before.get(key),
+                        value,
+                        delta,
+                        delta / elapsed if elapsed else 0.0,
+                    )
+                )
+        for key, rank in before.items():
+            if key not in ranked:
+                out.append(
+                    Change(
+                        aspect,
+                        key,
+                        fresh.get(key, known.get(key)),
+                        None,
+                        rank,
+                        board.values.get(key),
+                        0,
+                        0.0,
+                    )
+                )
+        return out
+
+
+async def _result(res):
+    # AsyncParsely methods return coroutines, Parsely ones their results
+    return await res if asyncio.iscoroutine(res) else res
+
+
+def _key(item):
+    url = getattr(item, "url", None)
+    return url if url is not None else item.name
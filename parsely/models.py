@@ -1,4 +1,71 @@
+import keyword
+
+METRICS = (
+    "views",
+    "mobile_views",
+    "tablet_views",
+    "desktop_views",
+    "visitors",
+    "visitors_new",
+    "visitors_returning",
+    "engaged_minutes",
+    "avg_engaged",
+    "avg_engaged_new",
+    "avg_engaged_returning",
+    "social_interactions",
+    "fb_interactions",
+    "tw_interactions",
+    "li_interactions",
+    "pi_interactions",
+    "social_referrals",
+    "fb_referrals",
+    "tw_referrals",
+    "li_referrals",
+    "pi_referrals",
+)
+# distinct sets of metric names whose Post layouts are kept
+MAX_LAYOUTS = 256
+
+
+def _slot_name(name):
+    # metric names that can be a slot without hiding a Post attribute
+    return (
+        name.isidentifier()
+        and not keyword.iskeyword(name)
+        and not name.startswith("_")
+        and not hasattr(Post, name)
+    )
+
+
 class Post(object):
+    """
+    A post, with its metrics
+
+    Posts with metrics are instances of a subclass with one extra slot per
+    metric, made once for each set of metric names a response carries, so
+    a metric costs a pointer per post and reads like any other attribute.
+    """
+
+    __slots__ = (
+        "url",
+        "title",
+        "section",
+        "author",
+        "pub_date",
+        "tags",
+        "hits",
+        "shares",
+        "image_url",
+        "thumb_url_medium",
+        "metadata",
+        "visitors",
+    )
+    # metric names held by this class, in the order first seen, and those of
+    # them that can't be slots so live in the instance __dict__
+    _metric_names = ()
+    _in_dict = frozenset()
+    _layouts = {}
+
     def __init__(
         self,
         url=None,
@@ -27,10 +94,50 @@ class Post(object):
         self.metadata = metadata
         self.visitors = visitors
 
+    @property
+    def metrics(self):
+        in_dict = self._in_dict
+        return {
+            name: self.__dict__[name] if name in in_dict else getattr(self, name)
+            for name in self._metric_names
+        }
+
+    def __reduce__(self):
+        # layouts are made at runtime, so pickle by value
+        fields = {name: getattr(self, name) for name in Post.__slots__}
+        return _restore, (fields, self.metrics)
+
+    @staticmethod
+    def layout(names):
+        """
+        Return the Post subclass holding the metrics `names`, a tuple
+
+        Layouts are shared by every ordering of the same names. Past
+        MAX_LAYOUTS distinct sets of names, new layouts are no longer cached.
+        """
+        key = tuple(sorted(names))
+        cls = Post._layouts.get(key)
+        if cls is None:
+            extra = [name for name in names if name not in Post.__slots__]
+            slots = tuple(name for name in extra if _slot_name(name))
+            in_dict = frozenset(extra).difference(slots)
+            if in_dict:
+                slots += ("__dict__",)
+            cls = type(
+                "Post",
+                (Post,),
+                {"__slots__": slots, "_metric_names": names, "_in_dict": in_dict},
+            )
+            if len(Post._layouts) < MAX_LAYOUTS:
+                cls = Post._layouts.setdefault(key, cls)
+        return cls
+
     @staticmethod
     def new_from_json_dict(data):
+        metrics = data.get("metrics")
+        cls = Post.layout(tuple(metrics)) if metrics else Post
 
-        post = Post(
+        post = cls(
             url=data.get("url", None),
             title=data.get("title", None),
             section=data.get("section", None),
@@ -45,38 +152,63 @@ class Post(object):
             metadata=data.get("metadata", None),
         )
 
-        if data.get("metrics"):
-            for metric, value in data["metrics"].items():
-                setattr(post, metric, value)
+        if metrics:
+            _set_metrics(post, metrics)
 
         return post
 
 
+def _set_metrics(post, metrics):
+    in_dict = post._in_dict
+    for name, value in metrics.items():
+        if name in in_dict:
+            post.__dict__[name] = value
+        else:
+            setattr(post, name, value)
+
+
+def _restore(fields, metrics):
+    cls = Post.layout(tuple(metrics)) if metrics else Post
+    post = cls(**fields)
+    _set_metrics(post, metrics)
+    return post
+
+
 class Meta(object):
+    __slots__ = ("name", "hits")
+
     def __init__(self, name=None, hits=None):
         self.name = name
         self.hits = hits
 
 
 class Author(Meta):
+    __slots__ = ()
+
     @staticmethod
     def new_from_json_dict(data):
         return Author(name=data.get("author", None), hits=data.get("_hits", None))
 
 
 class Section(Meta):
+    __slots__ = ()
+
     @staticmethod
     def new_from_json_dict(data):
         return Section(name=data.get("section", None), hits=data.get("_hits", None))
 
 
 class Tag(Meta):
+    __slots__ = ()
+
     @staticmethod
     def new_from_json_dict(data):
         return Tag(name=data.get("tag", None), hits=data.get("_hits", None))
 
 
 class Referrer(Meta):
+    __slots__ = ("ref_type",)
+
     def __init__(self, name=None, hits=None, ref_type=None):
         super(Referrer, self).__init__(name=name, hits=hits)
         self.ref_type = ref_type
@@ -91,6 +223,8 @@ class Referrer(Meta):
 
 
 class Shares(object):
+    __slots__ = ("facebook", "twitter", "pinterest", "linkedin", "total")
+
     def __init__(self, tw=None, fb=None, pi=None, li=None, total=None):
         self.facebook = fb
         self.twitter = tw
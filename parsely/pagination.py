@@ -0,0 +1,84 @@
+from __future__ import absolute_import
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .frame import ResultFrame
+
+
+def paginate(client, method, *args, prefetch=2, max_items=None, **kwargs):
+    """
+    Yield the items of successive pages of a paged client method
+
+    While the caller consumes one page, the next `prefetch` pages are fetched
+    in the background. Iteration stops at the first empty page or after
+    `max_items` items. Methods called with `as_columns=True` have each page
+    yielded whole, as a ResultFrame, which `ResultFrame.concat` can join.
+    """
+    if max_items is not None and max_items <= 0:
+        return
+    page = kwargs.pop("page", 1)
+    fetch = getattr(client, method)
+    executor = ThreadPoolExecutor(max_workers=max(prefetch, 1))
+    pending = []
+    seen = 0
+    try:
+        while True:
+            while len(pending) <= prefetch:
+                pending.append(executor.submit(fetch, *args, page=page, **kwargs))
+                page += 1
+            items = pending.pop(0).result()
+            if not items:
+                return
+            if max_items is not None:
+                items = _head(items, max_items - seen)
+                seen += len(items)
+            if isinstance(items, ResultFrame):
+                yield items
+            else:
+                for item in items:
+                    yield item
+            if max_items is not None and seen >= max_items:
+                return
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def paginate_async(client, method, *args, prefetch=2, max_items=None, **kwargs):
+    import asyncio
+
+    if max_items is not None and max_items <= 0:
+        return
+    page = kwargs.pop("page", 1)
+    fetch = getattr(client, method)
+    pending = []
+    seen = 0
+    try:
+        while True:
+            while len(pending) <= prefetch:
+                pending.append(asyncio.ensure_future(fetch(*args, page=page, **kwargs)))
+                page += 1
+            items = await pending.pop(0)
+            if not items:
+                return
+            if max_items is not None:
+                items = _head(items, max_items - seen)
+                seen += len(items)
+            if isinstance(items, ResultFrame):
+                yield items
+            else:
+                for item in items:
+                    yield item
+            if max_items is not None and seen >= max_items:
+                return
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def _head(items, n):
+    # the first n items of a page, a list or a ResultFrame
+    if len(items) <= n:
+        return items
+    if isinstance(items, ResultFrame):
+        return items.take(range(n))
+    return items[:n]
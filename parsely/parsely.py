@@ -2,7 +2,9 @@ from __future__ import absolute_import
 
 import logging
 
-from .models import Post, Author, Section, Tag, Referrer, Shares
+from .errors import AuthenticationError
+from .frame import ResultFrame
+from .models import METRICS, Post, Author, Section, Tag, Referrer, Shares
 from .utils import ParselyAPIConnection, valid_kwarg, BaseParselyClient
 
 
@@ -15,82 +17,83 @@ class Parsely(BaseParselyClient):
         "tags": Tag,
         "referrers": Referrer,
     }
-    allowed_metrics = [
-        "views",
-        "mobile_views",
-        "tablet_views",
-        "desktop_views",
-        "visitors",
-        "visitors_new",
-        "visitors_returning",
-        "engaged_minutes",
-        "avg_engaged",
-        "avg_engaged_new",
-        "avg_engaged_returning",
-        "social_interactions",
-        "fb_interactions",
-        "tw_interactions",
-        "li_interactions",
-        "pi_interactions",
-        "social_referrals",
-        "fb_referrals",
-        "tw_referrals",
-        "li_referrals",
-        "pi_referrals",
-    ]
-
-    def __init__(self, apikey, secret=None, root=None):
-        self.conn = ParselyAPIConnection(apikey, secret=secret, root=root)
-        if not self.authenticated():
-            raise ValueError("Authentication failed")
-
-    def authenticated(self):
-        res = self.conn._request_endpoint("/analytics/posts", {})
-        if "code" in res and res["code"] == 403:
+    allowed_metrics = list(METRICS)
+
+    def __init__(self, apikey, secret=None, root=None, authenticate=True, **kwargs):
+        """
+        With `authenticate` true the credentials are checked before this
+        returns; "lazy" leaves that to the first real request, and False
+        skips it. The outcome is remembered per (apikey, secret) for the life
+        of the process, so later clients skip the check. Rejected credentials
+        raise AuthenticationError.
+        """
+        # transport, cache etc. are passed through to the connection
+        self.conn = ParselyAPIConnection(apikey, secret=secret, root=root, **kwargs)
+        ok = self.conn.credentials_ok()
+        if ok is None and authenticate is True:
+            ok = self.authenticated()
+        if ok is False and authenticate:
+            raise AuthenticationError("Authentication failed")
+
+    def authenticated(self, _callback=None):
+        def check(res):
+            ok = not ("code" in res and res["code"] == 403)
+            self.conn.remember_credentials(ok)
+            return ok
+
+        def answer(res):
+            # rejected credentials are an answer, as they are without a callback
+            _callback(False if isinstance(res, AuthenticationError) else res)
+
+        try:
+            return self._call(
+                "/analytics/posts", {}, check, answer if _callback else None
+            )
+        except AuthenticationError:
             return False
-        return True
 
     @valid_kwarg(aspect_map.keys())
     @valid_kwarg(allowed_metrics, arg_name="sort")
-    def analytics(self, aspect="posts", _callback=None, **kwargs):
-        handler = self._build_callback(
-            lambda res: [
-                self.aspect_map[aspect].new_from_json_dict(x) for x in res["data"]
-            ],
-            _callback,
-        )
+    def analytics(self, aspect="posts", _callback=None, as_columns=False, **kwargs):
         options = self._format_analytics_args(**kwargs)
-        res = self.conn._request_endpoint(
-            "/analytics/%s" % aspect, options, _callback=handler if _callback else None
+        return self._call(
+            "/analytics/%s" % aspect,
+            options,
+            self._rows_handler(aspect, as_columns),
+            _callback,
         )
-        return handler(res) if not _callback else None
+
+    def _rows_handler(self, aspect, as_columns=False):
+        """
+        Build a response handler returning the rows of `res["data"]` as a list
+        of model objects, or as a ResultFrame if `as_columns` is set
+        """
+        if as_columns:
+            return lambda res: ResultFrame.from_rows(res["data"], aspect)
+        return lambda res: [
+            self.aspect_map[aspect].new_from_json_dict(x) for x in res["data"]
+        ]
 
     def post_detail(self, post, days="", _callback=None):
         url = post.url if hasattr(post, "url") else post
-        handler = self._build_callback(
-            lambda res: Post.new_from_json_dict(res["data"][0]), _callback
-        )
-        res = self.conn._request_endpoint(
+        return self._call(
             "/analytics/post/detail",
             {"url": url, "days": days},
-            _callback=handler if _callback else None,
+            lambda res: Post.new_from_json_dict(res["data"][0]),
+            _callback,
         )
-        return handler(res) if not _callback else None
 
     @valid_kwarg([x[:-1] for x in aspect_map if x is not "posts"])
     def meta_detail(self, meta_obj, aspect="author", _callback=None, **kwargs):
         value = getattr(meta_obj, aspect) if hasattr(meta_obj, aspect) else meta_obj
         options = self._format_analytics_args(**kwargs)
 
-        handler = self._build_callback(
-            lambda res: [Post.new_from_json_dict(x) for x in res["data"]], _callback
-        )
-        res = self.conn._request_endpoint(
+        return self._call(
             "/analytics/%s/%s/detail" % (aspect, value),
             options,
-            _callback=handler if _callback else None,
+            lambda res: [Post.new_from_json_dict(x) for x in res["data"]],
+            _callback,
         )
-        return handler(res) if not _callback else None
 
     @valid_kwarg(ref_types, arg_name="ref_type")
     def referrers(
@@ -101,6 +104,7 @@ class Parsely(BaseParselyClient):
         domain="",
         days=3,
         _callback=None,
+        as_columns=False,
         **kwargs
     ):
         dates = self._format_date_args(**kwargs)
@@ -109,16 +113,16 @@ class Parsely(BaseParselyClient):
         def inner(res):
             for r in res["data"]:
                 r["ref_type"] = ref_type
+            if as_columns:
+                return ResultFrame.from_rows(res["data"], "referrers")
             return [Referrer.new_from_json_dict(x) for x in res["data"]]
 
-        handler = self._build_callback(inner, _callback)
-
-        res = self.conn._request_endpoint(
+        return self._call(
             "/referrers/%s" % ref_type,
             dict(list(options.items()) + list(dates.items())),
-            _callback=handler if _callback else None,
+            inner,
+            _callback,
         )
-        return handler(res) if not _callback else None
 
     @valid_kwarg(ref_types, arg_name="ref_type")
     @valid_kwarg(list(aspect_map.keys()), arg_name="meta")
@@ -130,6 +134,7 @@ class Parsely(BaseParselyClient):
         domain="",
         days=3,
         _callback=None,
+        as_columns=False,
         **kwargs
     ):
         dates = self._format_date_args(**kwargs)
@@ -137,18 +142,12 @@ class Parsely(BaseParselyClient):
 
         endpoint = "/referrers/%s/%s" % (ref_type, meta)
 
-        handler = self._build_callback(
-            lambda res: [
-                self.aspect_map[meta].new_from_json_dict(x) for x in res["data"]
-            ],
-            _callback,
-        )
-        res = self.conn._request_endpoint(
+        return self._call(
             endpoint,
             dict(list(options.items()) + list(dates.items())),
-            _callback=handler if _callback else None,
+            self._rows_handler(meta, as_columns),
+            _callback,
         )
-        return handler(res) if not _callback else None
 
     @valid_kwarg(ref_types, arg_name="ref_type")
     @valid_kwarg([x[:-1] for x in aspect_map if x is not "posts"], arg_name="meta")
@@ -167,31 +166,24 @@ class Parsely(BaseParselyClient):
         dates = self._format_date_args(**kwargs)
         options = {"domain": domain, "days": days}
 
-        handler = self._build_callback(
-            lambda res: [Post.new_from_json_dict(x) for x in res["data"]], _callback
-        )
-
-        res = self.conn._request_endpoint(
+        return self._call(
             "/referrers/%s/%s/%s/detail" % (ref_type, meta, value),
             dict(list(options.items()) + list(dates.items())),
-            _callback=handler if _callback else None,
+            lambda res: [Post.new_from_json_dict(x) for x in res["data"]],
+            _callback,
         )
-        return handler(res) if not _callback else None
 
     def referrers_post_detail(self, post, days=3, _callback=None, **kwargs):
         url = post.url if hasattr(post, "url") else post
         dates = self._format_date_args(**kwargs)
         options = {"days": days, "url": url}
 
-        handler = self._build_callback(
-            lambda res: [Referrer.new_from_json_dict(x) for x in res["data"]], _callback
-        )
-        res = self.conn._request_endpoint(
+        return self._call(
             "/referrers/post/detail",
             dict(list(options.items()) + list(dates.items())),
-            _callback=handler if _callback else None,
+            lambda res: [Referrer.new_from_json_dict(x) for x in res["data"]],
+            _callback,
         )
-        return handler(res) if not _callback else None
 
     @valid_kwarg(["posts", "authors"])
     def shares(
@@ -207,15 +199,12 @@ class Parsely(BaseParselyClient):
     ):
         url = post.url if hasattr(post, "url") else post
         if url:
-            handler = self._build_callback(
-                lambda res: Shares.new_from_json_dict(res["data"][0]), _callback
-            )
-            res = self.conn._request_endpoint(
+            return self._call(
                 "/shares/post/detail",
                 {"url": url},
-                _callback=handler if _callback else None,
+                lambda res: Shares.new_from_json_dict(res["data"][0]),
+                _callback,
             )
-            return handler(res) if not _callback else None
         else:
             if self._require_both(start, end):
                 raise ValueError("Start and end must be specified together")
@@ -223,24 +212,20 @@ class Parsely(BaseParselyClient):
             start = start.strftime("%Y-%m-%d") if start else ""
             end = end.strftime("%Y-%m-%d") if end else ""
 
-            handler = self._build_callback(
-                lambda res: [
-                    self.aspect_map[aspect].new_from_json_dict(x) for x in res["data"]
-                ],
-                _callback,
-            )
-            res = self.conn._request_endpoint(
+            return self._call(
                 "/shares/%s" % aspect,
                 {
                     "pub_days": days,
                     "pub_date_start": start,
                     "pub_date_end": end,
-                    "limit": 10,
-                    "page": 1,
+                    "limit": limit,
+                    "page": page,
                 },
-                _callback=handler if _callback else None,
+                lambda res: [
+                    self.aspect_map[aspect].new_from_json_dict(x) for x in res["data"]
+                ],
+                _callback,
             )
-            return handler(res) if not _callback else None
 
     @valid_kwarg(aspect_map.keys())
     def realtime(self, aspect="posts", per=None, limit=10, page=1, _callback=None):
@@ -252,16 +237,14 @@ class Parsely(BaseParselyClient):
         if per:
             options["time"] = "%dh" % per.hours if per.hours else "%dm" % per.minutes
 
-        handler = self._build_callback(
+        return self._call(
+            "/analytics/%s" % aspect,
+            options,
             lambda res: [
                 self.aspect_map[aspect].new_from_json_dict(x) for x in res["data"]
             ],
             _callback,
         )
-        res = self.conn._request_endpoint(
-            "/analytics/%s" % aspect, options, _callback=handler if _callback else None
-        )
-        return handler(res) if not _callback else None
 
     @valid_kwarg(allowed_metrics, arg_name="boost")
     def related(
@@ -274,21 +257,56 @@ class Parsely(BaseParselyClient):
             "page": page,
             "boost": boost,
         }
-        handler = self._build_callback(
-            lambda res: [Post.new_from_json_dict(x) for x in res["data"]], _callback
-        )
-        res = self.conn._request_endpoint(
-            "/related", options, _callback=handler if _callback else None
+        return self._call(
+            "/related",
+            options,
+            lambda res: [Post.new_from_json_dict(x) for x in res["data"]],
+            _callback,
         )
-        return handler(res) if not _callback else None
 
     @valid_kwarg(allowed_metrics, arg_name="boost")
     def search(self, query, limit=10, page=1, boost="views", _callback=None):
         options = {"q": query, "limit": limit, "page": page, "boost": boost}
-        handler = self._build_callback(
-            lambda res: [Post.new_from_json_dict(x) for x in res["data"]], _callback
+        return self._call(
+            "/search",
+            options,
+            lambda res: [Post.new_from_json_dict(x) for x in res["data"]],
+            _callback,
+        )
+
+    def iter_analytics(self, aspect="posts", prefetch=2, max_items=None, **kwargs):
+        return self.paginate(
+            "analytics", aspect=aspect, prefetch=prefetch, max_items=max_items, **kwargs
+        )
+
+    def iter_meta_detail(
+        self, meta_obj, aspect="author", prefetch=2, max_items=None, **kwargs
+    ):
+        return self.paginate(
+            "meta_detail",
+            meta_obj,
+            aspect=aspect,
+            prefetch=prefetch,
+            max_items=max_items,
+            **kwargs
         )
-        res = self.conn._request_endpoint(
-            "/search", options, _callback=handler if _callback else None
+
+    def iter_shares(self, aspect="posts", prefetch=2, max_items=None, **kwargs):
+        return self.paginate(
+            "shares", aspect=aspect, prefetch=prefetch, max_items=max_items, **kwargs
+        )
+
+    def iter_realtime(self, aspect="posts", prefetch=2, max_items=None, **kwargs):
+        return self.paginate(
+            "realtime", aspect=aspect, prefetch=prefetch, max_items=max_items, **kwargs
+        )
+
+    def iter_related(self, url, prefetch=2, max_items=None, **kwargs):
+        return self.paginate(
+            "related", url, prefetch=prefetch, max_items=max_items, **kwargs
+        )
+
+    def iter_search(self, query, prefetch=2, max_items=None, **kwargs):
+        return self.paginate(
+            "search", query, prefetch=prefetch, max_items=max_items, **kwargs
         )
-        return handler(res) if not _callback else None
@@ -0,0 +1,115 @@
+from __future__ import absolute_import
+
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from .errors import AuthenticationError
+from .parsely import Parsely
+from .transport import PooledTransport
+
+
+class SiteResult(namedtuple("SiteResult", ["site", "result", "error"])):
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class ParselyPool(object):
+    """
+    One client per site (API key), all sharing one transport, cache and rate
+    limits
+
+    `sites` maps API keys to their secrets; more can be added with `add`.
+    Clients are built on first use and kept. Their credentials are checked
+    once per process, the first time `client` is asked for them, rather
+    than on every construction. Other keyword arguments (cache, ttl_policy,
+    limiter, concurrency, retry, codec, ...) are shared by every client.
+
+        >>> pool = ParselyPool({"site-a.com": "...", "site-b.com": "..."},
+        ...                    cache=MemoryCache(), limiter=RateLimiter(rate=20))
+        >>> pool["site-a.com"].analytics()
+        >>> for r in pool.fan_out("analytics", aspect="authors"):
+        ...     print r.site, r.result if r.ok else r.error
+    """
+
+    client_class = Parsely
+
+    def __init__(self, sites=None, root=None, transport=None, **shared):
+        self.sites = dict(sites) if sites else {}
+        self.root = root
+        self.transport = transport if transport else self._default_transport()
+        self.shared = shared
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def _default_transport(self):
+        return PooledTransport()
+
+    def add(self, apikey, secret=None):
+        with self._lock:
+            if self.sites.get(apikey, secret) != secret:
+                # new credentials: rebuild the client
+                self._clients.pop(apikey, None)
+            self.sites[apikey] = secret
+
+    def __contains__(self, apikey):
+        return apikey in self.sites
+
+    def __getitem__(self, apikey):
+        return self.client(apikey)
+
+    def client(self, apikey, verify=True):
+        """
+        Return the client for a site, checking its credentials the first time
+        unless `verify` is false. Raises KeyError for unknown sites and
+        AuthenticationError if the credentials are known to be rejected.
+        """
+        client = self._client(apikey)
+        ok = client.conn.credentials_ok()
+        if verify and ok is None:
+            ok = client.authenticated()
+        if ok is False:
+            raise AuthenticationError("Authentication failed for %s" % apikey)
+        return client
+
+    def _client(self, apikey):
+        with self._lock:
+            client = self._clients.get(apikey)
+            if client is None:
+                client = self._clients[apikey] = self._build(apikey, self.sites[apikey])
+            return client
+
+    def _build(self, apikey, secret):
+        return self.client_class(
+            apikey,
+            secret=secret,
+            root=self.root,
+            authenticate=False,
+            transport=self.transport,
+            **self.shared
+        )
+
+    def fan_out(self, method, *args, sites=None, max_concurrency=10, **kwargs):
+        """
+        Call `method` on every site's client (or those in `sites`)
+        concurrently and return a SiteResult per site, in order. A failing
+        site is reported through its result's `error`.
+        """
+        sites = list(sites) if sites else list(self.sites)
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            futures = [
+                executor.submit(self._run, site, method, args, kwargs) for site in sites
+            ]
+            return [future.result() for future in futures]
+
+    def _run(self, site, method, args, kwargs):
+        try:
+            return SiteResult(
+                site, getattr(self.client(site), method)(*args, **kwargs), None
+            )
+        except Exception as e:
+            return SiteResult(site, None, e)
+
+    def close(self):
+        self.transport.close()
@@ -0,0 +1,195 @@
+from __future__ import absolute_import
+
+import threading
+import time
+
+
+def endpoint_family(endpoint):
+    """
+    Group an endpoint by its first path segment, e.g. /analytics/post/detail
+    belongs to /analytics
+    """
+    return "/" + endpoint.strip("/").split("/")[0]
+
+
+class TokenBucket(object):
+    """
+    Allow `rate` requests per second on average, with bursts of up to `burst`
+
+    Callers reserve a token up front and then sleep off any debt, so waiting
+    callers are served in arrival order.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst else max(rate, 1))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Take a token and return how many seconds to wait before using it
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= 1
+            return 0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        import asyncio
+
+        wait = self.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+
+class RateLimiter(object):
+    """
+    Token buckets per API key and per endpoint family
+
+    `rate`/`burst` apply to every request made with an API key; `keys` maps
+    API keys to their own rate, or (rate, burst) pair, overriding it.
+    `families` maps endpoint families (/analytics, /referrers, /shares,
+    /related, /profile, ...) to a rate or (rate, burst) pair that applies on
+    top of the key's overall limit. `total`, a rate or (rate, burst) pair,
+    caps all keys together. One limiter can be shared by several clients.
+    """
+
+    def __init__(self, rate=None, burst=None, keys=None, families=None, total=None):
+        self.rate = rate
+        self.burst = burst
+        self.total = total
+        self.keys = keys if keys else {}
+        self.families = families if families else {}
+        self.waited = 0.0
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def buckets(self, apikey, endpoint):
+        family = endpoint_family(endpoint)
+        limits = [
+            ((None, None), self.total),
+            ((apikey, None), self.keys.get(apikey, (self.rate, self.burst))),
+            ((apikey, family), self.families.get(family)),
+        ]
+        buckets = []
+        with self._lock:
+            for name, limit in limits:
+                if not isinstance(limit, tuple):
+                    limit = (limit, None)
+                if not limit[0]:
+                    continue
+                if name not in self._buckets:
+                    self._buckets[name] = TokenBucket(*limit)
+                buckets.append(self._buckets[name])
+        return buckets
+
+    def reserve(self, apikey, endpoint):
+        wait = max([b.reserve() for b in self.buckets(apikey, endpoint)] or [0])
+        with self._lock:
+            self.waited += wait
+        return wait
+
+    def acquire(self, apikey, endpoint):
+        wait = self.reserve(apikey, endpoint)
+        if wait:
+            time.sleep(wait)
+
+    async def acquire_async(self, apikey, endpoint):
+        import asyncio
+
+        wait = self.reserve(apikey, endpoint)
+        if wait:
+            await asyncio.sleep(wait)
+
+
+class AdaptiveConcurrency(object):
+    """
+    AIMD limit on the number of requests in flight
+
+    Every healthy response (no error, latency under `latency_target` seconds)
+    raises the limit by `increase / limit`, i.e. about `increase` per round
+    of requests. An error or slow response multiplies it by `decrease`, at
+    most once per `latency_target` seconds so one burst of failures counts
+    once. Threads and coroutines can share one governor.
+    """
+
+    def __init__(
+        self,
+        initial=10,
+        minimum=1,
+        maximum=100,
+        latency_target=1.0,
+        increase=1.0,
+        decrease=0.5,
+    ):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.increase = increase
+        self.decrease = decrease
+        self.in_flight = 0
+        self._last_decrease = 0
+        self._cond = threading.Condition()
+        self._waiters = []
+
+    def _try_acquire(self):
+        with self._cond:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    async def acquire_async(self):
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        while not self._try_acquire():
+            waiter = loop.create_future()
+            with self._cond:
+                self._waiters.append((loop, waiter))
+            # a slot may have opened before the waiter was registered
+            if self._try_acquire():
+                return
+            await waiter
+
+    def release(self, latency, ok=True):
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if not ok or latency > self.latency_target:
+                if now - self._last_decrease >= self.latency_target:
+                    self.limit = max(self.minimum, self.limit * self.decrease)
+                    self._last_decrease = now
+            else:
+                self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+            waiters, self._waiters = self._waiters, []
+            self._cond.notify_all()
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(_wake, waiter)
+
+    def stats(self):
+        with self._cond:
+            return {"limit": self.limit, "in_flight": self.in_flight}
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
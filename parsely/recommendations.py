@@ -1,30 +1,189 @@
 from __future__ import absolute_import
 
+import threading
+import time
+from collections import OrderedDict
+
 from .models import Post
 from .utils import BaseParselyClient
 
 
+class _Visitor(object):
+    __slots__ = ("history", "urls", "related")
+
+    def __init__(self):
+        self.history = None
+        self.urls = None
+        self.related = {}
+
+
+class RecommendationCache(object):
+    """
+    Recommendations and history of the most recent `max_users` visitors
+
+    `related` results are kept per uuid and query options for `ttl` seconds,
+    and served without the urls in the visitor's cached history, so pages
+    the visitor has read drop out without another request. Training a uuid
+    on a url that isn't in its history yet drops its cached recommendations
+    and history.
+    The least recently used visitor is evicted first. One cache can be
+    shared by any number of User objects.
+    """
+
+    def __init__(self, max_users=10000, ttl=300):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._visitors = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def related(self, uuid, options):
+        """
+        Return the cached recommendations for a query, filtered, or None
+        """
+        key = _options_key(options)
+        with self._lock:
+            visitor = self._visitors.get(uuid)
+            cached = visitor.related.get(key) if visitor is not None else None
+            if cached is not None and cached[1] + self.ttl <= time.time():
+                del visitor.related[key]
+                cached = None
+            if cached is None:
+                self.misses += 1
+                return None
+            self._visitors.move_to_end(uuid)
+            self.hits += 1
+            return self._unread(visitor, cached[0])
+
+    def store_related(self, uuid, options, posts):
+        """
+        Cache the recommendations for a query and return them, filtered
+        """
+        with self._lock:
+            visitor = self._visitor(uuid)
+            visitor.related[_options_key(options)] = (posts, time.time())
+            return self._unread(visitor, posts)
+
+    def history(self, uuid):
+        with self._lock:
+            visitor = self._visitors.get(uuid)
+            if visitor is None or visitor.history is None:
+                self.misses += 1
+                return None
+            self._visitors.move_to_end(uuid)
+            self.hits += 1
+            return visitor.history
+
+    def store_history(self, uuid, history):
+        with self._lock:
+            visitor = self._visitor(uuid)
+            visitor.history = history
+            visitor.urls = set(_history_urls(history))
+        return history
+
+    def trained(self, uuid, url):
+        """
+        Note that `uuid` read `url`, dropping its recommendations if that's new
+        """
+        with self._lock:
+            visitor = self._visitors.get(uuid)
+            if visitor is None:
+                return
+            if visitor.urls is not None:
+                if url in visitor.urls:
+                    return
+                # keep filtering on it, but fetch the history afresh
+                visitor.urls.add(url)
+                visitor.history = None
+            if visitor.related:
+                visitor.related = {}
+                self.invalidations += 1
+
+    def invalidate(self, uuid):
+        with self._lock:
+            self._visitors.pop(uuid, None)
+
+    def clear(self):
+        with self._lock:
+            self._visitors.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "users": len(self._visitors),
+            }
+
+    def _visitor(self, uuid):
+        visitor = self._visitors.get(uuid)
+        if visitor is None:
+            visitor = self._visitors[uuid] = _Visitor()
+            while len(self._visitors) > self.max_users:
+                self._visitors.popitem(last=False)
+                self.evictions += 1
+        else:
+            self._visitors.move_to_end(uuid)
+        return visitor
+
+    def _unread(self, visitor, posts):
+        if not visitor.urls:
+            return list(posts)
+        return [post for post in posts if post.url not in visitor.urls]
+
+
+def _options_key(options):
+    return tuple(sorted((k, str(v)) for k, v in options.items()))
+
+
+def _history_urls(history):
+    # /history answers {"uuid": ..., "urls": [...]}
+    if isinstance(history, dict):
+        history = history.get("urls") or []
+    return [item.get("url") if isinstance(item, dict) else item for item in history]
+
+
 class User(BaseParselyClient):
-    def __init__(self, p, uuid):
+    """
+    Recommendations for one visitor
+
+    With a RecommendationCache, `history` and `related` are answered from it
+    when they can be, and `related` leaves out what the visitor has read.
+    """
+
+    def __init__(self, p, uuid, cache=None):
         self.conn = p.conn if hasattr(p, "conn") else p
         self.uuid = uuid
+        self.cache = cache
 
     def train(self, post, _callback=None):
         url = post.url if hasattr(post, "url") else post
-        handler = self._build_callback(lambda res: bool(res["success"]), _callback)
-        res = self.conn._request_endpoint(
+
+        def handle(res):
+            ok = bool(res["success"])
+            if ok and self.cache is not None:
+                self.cache.trained(self.uuid, url)
+            return ok
+
+        return self._call(
             "/profile",
             {"uuid": self.uuid, "url": url},
-            _callback=handler if _callback else None,
+            handle,
+            _callback,
         )
-        return handler(res) if not _callback else None
 
     def history(self, _callback=None):
-        handler = self._build_callback(lambda res: res["data"], _callback)
-        res = self.conn._request_endpoint(
-            "/history", {"uuid": self.uuid}, _callback=handler if _callback else None
-        )
-        return handler(res) if not _callback else None
+        def handle(res):
+            if self.cache is None:
+                return res["data"]
+            return self.cache.store_history(self.uuid, res["data"])
+
+        return self._call("/history", {"uuid": self.uuid}, handle, _callback)
 
     def related(
         self, days=14, limit=10, page=10, boost="views", section="", _callback=None
@@ -36,10 +195,25 @@ class User(BaseParselyClient):
             "page": page,
             "boost": boost,
         }
-        handler = self._build_callback(
-            lambda res: [Post.new_from_json_dict(x) for x in res["data"]], _callback
-        )
-        res = self.conn._request_endpoint(
-            "/related", options, _callback=handler if _callback else None
+
+        def handle(res):
+            posts = [Post.new_from_json_dict(x) for x in res["data"]]
+            if self.cache is None:
+                return posts
+            return self.cache.store_related(self.uuid, options, posts)
+
+        return self._call("/related", options, handle, _callback)
+
+    def _from_cache(self, endpoint, options):
+        if self.cache is None:
+            return None
+        if endpoint == "/related":
+            return self.cache.related(self.uuid, options)
+        if endpoint == "/history":
+            return self.cache.history(self.uuid)
+        return None
+
+    def iter_related(self, prefetch=2, max_items=None, **kwargs):
+        return self.paginate(
+            "related", prefetch=prefetch, max_items=max_items, **kwargs
         )
-        return handler(res) if not _callback else None
@@ -0,0 +1,189 @@
+from __future__ import absolute_import
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+
+class PinnedQuery(object):
+    def __init__(self, endpoint, options, interval):
+        self.endpoint = endpoint
+        self.options = dict(options)
+        self.interval = interval
+        self.next_run = 0
+        self.last_refresh = None
+        self.last_error = None
+
+
+class Refresher(object):
+    """
+    Background cache refreshes for a ParselyAPIConnection
+
+    `revalidate` refetches a stale cache entry off the caller's path, at most
+    once at a time per key. Pinned queries are refetched every `interval`
+    seconds on a daemon thread so their cache entries never go cold; on an
+    async connection, by a task on the event loop `pin_async` is called from.
+    """
+
+    def __init__(self, conn, max_workers=2):
+        self.conn = conn
+        self.max_workers = max_workers
+        self.pinned = {}
+        self.stale_served = 0
+        self.refreshes = 0
+        self.errors = 0
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._stopped = False
+        # asyncio holds only weak references to tasks
+        self._tasks = {}
+        self._background = set()
+
+    def revalidate(self, key, func):
+        if not self._claim(key):
+            return
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self._executor.submit(self._run, key, func)
+
+    def revalidate_async(self, key, func):
+        import asyncio
+
+        if not self._claim(key):
+            return
+
+        async def run():
+            try:
+                await func()
+                self._done(key, None)
+            except Exception as e:
+                self._done(key, e)
+
+        task = asyncio.ensure_future(run())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def pin(self, endpoint, options, interval):
+        key = self.conn._flight_key(endpoint, options)
+        with self._lock:
+            self.pinned[key] = PinnedQuery(endpoint, options, interval)
+            if self._thread is None:
+                self._stopped = False
+                self._thread = threading.Thread(target=self._loop)
+                self._thread.daemon = True
+                self._thread.start()
+        self._wakeup.set()
+        return key
+
+    def pin_async(self, endpoint, options, interval):
+        import asyncio
+
+        key = self.conn._flight_key(endpoint, options)
+        query = PinnedQuery(endpoint, options, interval)
+        task = asyncio.get_running_loop().create_task(self._refresh(key, query))
+        with self._lock:
+            self.pinned[key] = query
+            previous = self._tasks.pop(key, None)
+            self._tasks[key] = task
+        if previous is not None:
+            previous.cancel()
+        return key
+
+    def unpin(self, key):
+        with self._lock:
+            self.pinned.pop(key, None)
+            task = self._tasks.pop(key, None)
+        if task is not None:
+            task.cancel()
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            thread, self._thread = self._thread, None
+            tasks, self._tasks = list(self._tasks.values()), {}
+        for task in tasks:
+            task.cancel()
+        self._wakeup.set()
+        if thread is not None:
+            thread.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "stale_served": self.stale_served,
+                "refreshes": self.refreshes,
+                "errors": self.errors,
+                "in_flight": len(self._pending),
+                "pinned": len(self.pinned),
+            }
+
+    def _claim(self, key):
+        with self._lock:
+            self.stale_served += 1
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+            return True
+
+    def _run(self, key, func):
+        try:
+            func()
+            self._done(key, None)
+        except Exception as e:
+            self._done(key, e)
+
+    def _done(self, key, error):
+        with self._lock:
+            self._pending.discard(key)
+            if error is None:
+                self.refreshes += 1
+            else:
+                self.errors += 1
+        if error is not None:
+            log.warning("Background refresh of %s failed: %r", key, error)
+
+    async def _refresh(self, key, query):
+        import asyncio
+
+        while True:
+            try:
+                await self.conn._load(query.endpoint, query.options)
+                query.last_refresh, query.last_error = time.time(), None
+                self._done(key, None)
+            except Exception as e:
+                query.last_error = e
+                self._done(key, e)
+            await asyncio.sleep(query.interval)
+
+    def _loop(self):
+        while True:
+            self._wakeup.clear()
+            with self._lock:
+                if self._stopped:
+                    return
+                now = time.time()
+                due = [(k, q) for k, q in self.pinned.items() if q.next_run <= now]
+                for _, query in due:
+                    query.next_run = now + query.interval
+            for key, query in due:
+                try:
+                    self.conn._load(query.endpoint, query.options)
+                    query.last_refresh, query.last_error = time.time(), None
+                    self._done(key, None)
+                except Exception as e:
+                    query.last_error = e
+                    self._done(key, e)
+            with self._lock:
+                next_run = min([q.next_run for q in self.pinned.values()] or [None])
+            self._wakeup.wait(None if next_run is None else next_run - time.time())
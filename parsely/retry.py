@@ -0,0 +1,319 @@
+from __future__ import absolute_import
+
+import random
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from six.moves import http_client
+
+from .errors import DeadlineExceeded
+from .ratelimit import endpoint_family
+
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+RETRY_ERRORS = (socket.error, http_client.HTTPException)
+
+
+class LatencyTracker(object):
+    """
+    Response times of the last `size` requests
+    """
+
+    def __init__(self, size=200, min_samples=20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q):
+        """
+        Return the q-th percentile, or None until `min_samples` are known
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < max(self.min_samples, 1):
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q / 100.0))]
+
+
+class _Deadline(object):
+    def __init__(self, seconds):
+        self.expires = None if seconds is None else time.time() + seconds
+
+    def remaining(self):
+        if self.expires is None:
+            return None
+        return max(0, self.expires - time.time())
+
+    def cap(self, timeout):
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        return remaining if timeout is None else min(timeout, remaining)
+
+
+class RetryPolicy(object):
+    """
+    Timeouts, retries and hedging for API requests
+
+    `connect_timeout` and `read_timeout` bound each attempt, in seconds, and
+    `deadline` bounds the whole call including retries; past it the call
+    raises DeadlineExceeded. Failed attempts (connection errors, timeouts and
+    the statuses in `retry_statuses`) are retried up to `retries` times,
+    sleeping a random time between 0 and `backoff * 2 ** attempt` (at most
+    `max_backoff`) in between. Endpoints in `never_retry` are not idempotent
+    and get a single attempt.
+
+    With `hedge` set, an attempt still unanswered after the
+    `hedge_percentile`-th percentile of recent latencies for its endpoint
+    family (or after a fixed `hedge_after` seconds) is duplicated, and the
+    first good reply wins.
+    """
+
+    def __init__(
+        self,
+        retries=2,
+        backoff=0.1,
+        max_backoff=5.0,
+        connect_timeout=None,
+        read_timeout=None,
+        deadline=None,
+        hedge=False,
+        hedge_after=None,
+        hedge_percentile=95,
+        retry_statuses=RETRY_STATUSES,
+        never_retry=("/profile",),
+        max_workers=16,
+    ):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+        self.hedge = hedge or hedge_after is not None
+        self.hedge_after = hedge_after
+        self.hedge_percentile = hedge_percentile
+        self.retry_statuses = retry_statuses
+        self.never_retry = never_retry
+        self.max_workers = max_workers
+        self.attempts = 0
+        self.retried = 0
+        self.hedged = 0
+        self._latencies = {}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    def retryable(self, response):
+        return response.code in self.retry_statuses
+
+    def latencies(self, endpoint):
+        family = endpoint_family(endpoint)
+        with self._lock:
+            if family not in self._latencies:
+                self._latencies[family] = LatencyTracker()
+            return self._latencies[family]
+
+    def hedge_delay(self, endpoint):
+        # a duplicate of a request that is never retried would apply it twice
+        if not self.hedge or endpoint.startswith(self.never_retry):
+            return None
+        if self.hedge_after is not None:
+            return self.hedge_after
+        return self.latencies(endpoint).percentile(self.hedge_percentile)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "attempts": self.attempts,
+                "retried": self.retried,
+                "hedged": self.hedged,
+            }
+
+    def run(self, endpoint, fetch, hedge=True):
+        """
+        Call `fetch(connect_timeout, read_timeout)` until it returns a good
+        response or the policy gives up. With `hedge` false attempts are
+        never duplicated, e.g. for a streamed response only one caller reads.
+
+        Hedged duplicates are made as `fetch(connect_timeout, read_timeout,
+        hedge=True)` and counted in `hedged` rather than `attempts`, so they
+        don't pass for retries.
+        """
+        deadline = _Deadline(self.deadline)
+        retries = 0 if endpoint.startswith(self.never_retry) else self.retries
+        attempt = 0
+        while True:
+            try:
+                response = self._hedged(endpoint, fetch, deadline, hedge)
+            except RETRY_ERRORS as e:
+                response, error = None, e
+            else:
+                if not self.retryable(response):
+                    return response
+                error = None
+            wait = self._backoff(attempt, retries, deadline, response, error)
+            if wait is None:
+                return response
+            time.sleep(wait)
+            attempt += 1
+
+    async def run_async(self, endpoint, fetch, hedge=True):
+        """
+        Like `run`, for a `fetch` returning a coroutine
+        """
+        import asyncio
+
+        deadline = _Deadline(self.deadline)
+        retries = 0 if endpoint.startswith(self.never_retry) else self.retries
+        attempt = 0
+        while True:
+            try:
+                response = await asyncio.wait_for(
+                    self._hedged_async(endpoint, fetch, deadline, hedge),
+                    deadline.remaining(),
+                )
+            except (asyncio.TimeoutError,) + RETRY_ERRORS as e:
+                # either the deadline, which _backoff reports, or a read
+                # timeout to retry
+                response, error = None, e
+            else:
+                if not self.retryable(response):
+                    return response
+                error = None
+            wait = self._backoff(attempt, retries, deadline, response, error)
+            if wait is None:
+                return response
+            await asyncio.sleep(wait)
+            attempt += 1
+
+    def _backoff(self, attempt, retries, deadline, response, error):
+        """
+        Return how long to sleep before the next attempt, None to return
+        `response` as it is, or raise
+        """
+        remaining = deadline.remaining()
+        if remaining == 0:
+            raise DeadlineExceeded(
+                "deadline of %ss exceeded" % self.deadline
+            ) from error
+        if attempt >= retries:
+            if error is not None:
+                raise error
+            return None
+        wait = self.delay(attempt)
+        if remaining is not None and wait >= remaining:
+            raise DeadlineExceeded(
+                "deadline of %ss exceeded" % self.deadline
+            ) from error
+        with self._lock:
+            self.retried += 1
+        return wait
+
+    def _timeouts(self, deadline):
+        return deadline.cap(self.connect_timeout), deadline.cap(self.read_timeout)
+
+    def _attempt(self, endpoint, fetch, deadline, hedge=False):
+        with self._lock:
+            if hedge:
+                self.hedged += 1
+            else:
+                self.attempts += 1
+        started = time.time()
+        if hedge:
+            response = fetch(*self._timeouts(deadline), hedge=True)
+        else:
+            response = fetch(*self._timeouts(deadline))
+        if not self.retryable(response):
+            self.latencies(endpoint).add(time.time() - started)
+        return response
+
+    async def _attempt_async(self, endpoint, fetch, deadline, hedge=False):
+        with self._lock:
+            if hedge:
+                self.hedged += 1
+            else:
+                self.attempts += 1
+        started = time.time()
+        if hedge:
+            response = await fetch(*self._timeouts(deadline), hedge=True)
+        else:
+            response = await fetch(*self._timeouts(deadline))
+        if not self.retryable(response):
+            self.latencies(endpoint).add(time.time() - started)
+        return response
+
+    def _hedged(self, endpoint, fetch, deadline, hedge=True):
+        after = self.hedge_delay(endpoint) if hedge else None
+        if after is None:
+            return self._attempt(endpoint, fetch, deadline)
+        executor = self._get_executor()
+        first = executor.submit(self._attempt, endpoint, fetch, deadline)
+        done, _ = wait([first], timeout=deadline.cap(after))
+        if done:
+            return first.result()
+        # the losing attempt runs to completion in the background
+        return self._first_good(
+            [first, executor.submit(self._attempt, endpoint, fetch, deadline, True)],
+            deadline,
+        )
+
+    async def _hedged_async(self, endpoint, fetch, deadline, hedge=True):
+        import asyncio
+
+        after = self.hedge_delay(endpoint) if hedge else None
+        if after is None:
+            return await self._attempt_async(endpoint, fetch, deadline)
+        tasks = [asyncio.ensure_future(self._attempt_async(endpoint, fetch, deadline))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=after)
+            if done:
+                return tasks[0].result()
+            tasks.append(
+                asyncio.ensure_future(
+                    self._attempt_async(endpoint, fetch, deadline, True)
+                )
+            )
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None and not self.retryable(task.result()):
+                        return task.result()
+            return task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _first_good(self, futures, deadline):
+        """
+        Return the first result that needs no retry, else the last outcome
+        """
+        pending = set(futures)
+        while pending:
+            done, pending = wait(
+                pending, timeout=deadline.remaining(), return_when=FIRST_COMPLETED
+            )
+            if not done:
+                raise DeadlineExceeded("deadline of %ss exceeded" % self.deadline)
+            for future in done:
+                if future.exception() is None and not self.retryable(future.result()):
+                    return future.result()
+        return future.result()
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self._executor
@@ -0,0 +1,210 @@
+from __future__ import absolute_import
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+from .models import Post, Referrer
+from .pagination import paginate_async
+
+SHARD_SIZES = {"day": 1, "week": 7}
+
+# date-ranged methods that return a single page
+UNPAGED = frozenset(
+    ["referrers", "referrers_meta", "referrers_meta_detail", "referrers_post_detail"]
+)
+
+_POST_FIELDS = (
+    "url",
+    "title",
+    "section",
+    "author",
+    "pub_date",
+    "tags",
+    "thumb_url_medium",
+    "image_url",
+    "metadata",
+)
+
+
+def shard_range(start, end, size="day"):
+    """
+    Split the inclusive range start..end into consecutive (start, end) pairs
+    of `size` days, "day", "week" or a number
+    """
+    days = SHARD_SIZES.get(size, size)
+    if not isinstance(days, int) or days < 1:
+        raise ValueError("shard size must be 'day', 'week' or a number of days")
+    if end < start:
+        raise ValueError("end must not be before start")
+    shards = []
+    while start <= end:
+        last = min(end, start + timedelta(days=days - 1))
+        shards.append((start, last))
+        start = last + timedelta(days=1)
+    return shards
+
+
+def merge(items, rank_by="hits"):
+    """
+    Combine items describing the same post (by url) or the same author,
+    section, tag or referrer (by name), summing their hits and metrics, and
+    rank the result by `rank_by`, highest first
+
+    Sums are only meaningful for additive metrics: a unique visitor counted
+    in two shards is counted twice.
+    """
+    merged = OrderedDict()
+    for item in items:
+        key = (_kind(item), _identity(item))
+        merged[key] = _combine(merged[key], item) if key in merged else item
+    return sorted(merged.values(), key=lambda item: _rank(item, rank_by), reverse=True)
+
+
+def query_shards(
+    client,
+    method,
+    start,
+    end,
+    shard="day",
+    max_concurrency=8,
+    progress=None,
+    rank_by=None,
+    prefetch=0,
+    **kwargs
+):
+    """
+    Run a date-ranged method, every page of it, once per shard of
+    start..end on up to `max_concurrency` threads, and merge the results
+
+    `progress(done, total, shard)` is called as each shard completes. The
+    first failing shard cancels the rest and its error is raised.
+    """
+    shards = _plan(client, method, start, end, shard, kwargs)
+    executor = ThreadPoolExecutor(max_workers=max_concurrency)
+    futures = {
+        executor.submit(_fetch_shard, client, method, s, prefetch, kwargs): s
+        for s in shards
+    }
+    items = []
+    try:
+        for done, future in enumerate(as_completed(futures), 1):
+            items.extend(future.result())
+            if progress is not None:
+                progress(done, len(shards), futures[future])
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return merge(items, rank_by if rank_by else _default_rank(kwargs))
+
+
+async def query_shards_async(
+    client,
+    method,
+    start,
+    end,
+    shard="day",
+    max_concurrency=8,
+    progress=None,
+    rank_by=None,
+    prefetch=0,
+    **kwargs
+):
+    import asyncio
+
+    shards = _plan(client, method, start, end, shard, kwargs)
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def fetch(s):
+        async with semaphore:
+            if method in UNPAGED:
+                return s, await getattr(client, method)(start=s[0], end=s[1], **kwargs)
+            pages = paginate_async(
+                client, method, prefetch=prefetch, start=s[0], end=s[1], **kwargs
+            )
+            return s, [item async for item in pages]
+
+    tasks = [asyncio.ensure_future(fetch(s)) for s in shards]
+    items = []
+    try:
+        for done, task in enumerate(asyncio.as_completed(tasks), 1):
+            s, shard_items = await task
+            items.extend(shard_items)
+            if progress is not None:
+                progress(done, len(shards), s)
+    finally:
+        for task in tasks:
+            task.cancel()
+    return merge(items, rank_by if rank_by else _default_rank(kwargs))
+
+
+def _plan(client, method, start, end, shard, kwargs):
+    if client._require_both(start, end):
+        raise ValueError("start and end must be specified together")
+    if not start:
+        raise ValueError("sharding needs a start and end date")
+    # let the method reject bad arguments (e.g. a lone pub_start) up front
+    client._describe(method, start=start, end=end, **kwargs)
+    return shard_range(start, end, shard)
+
+
+def _fetch_shard(client, method, shard, prefetch, kwargs):
+    if method in UNPAGED:
+        return getattr(client, method)(start=shard[0], end=shard[1], **kwargs)
+    return list(
+        client.paginate(
+            method, prefetch=prefetch, start=shard[0], end=shard[1], **kwargs
+        )
+    )
+
+
+def _default_rank(kwargs):
+    sort = kwargs.get("sort")
+    return sort if sort and sort != "_hits" else "hits"
+
+
+def _kind(item):
+    # posts with different metrics have different layouts, but are all posts
+    return Post if isinstance(item, Post) else type(item)
+
+
+def _identity(item):
+    if isinstance(item, Post):
+        return item.url
+    if isinstance(item, Referrer):
+        return item.name, item.ref_type
+    return item.name
+
+
+def _rank(item, rank_by):
+    value = getattr(item, rank_by, None)
+    return value if isinstance(value, (int, float)) else float("-inf")
+
+
+def _add(first, second):
+    if first is None:
+        return second
+    if second is None:
+        return first
+    if isinstance(first, dict) and isinstance(second, dict):
+        keys = list(first) + [k for k in second if k not in first]
+        return {k: _add(first.get(k), second.get(k)) for k in keys}
+    if isinstance(first, (int, float)) and isinstance(second, (int, float)):
+        return first + second
+    return first
+
+
+def _combine(first, second):
+    if isinstance(first, Post):
+        data = {name: getattr(first, name) for name in _POST_FIELDS}
+        data["_hits"] = _add(first.hits, second.hits)
+        data["_shares"] = _add(first.shares, second.shares)
+        data["visitors"] = _add(first.visitors, second.visitors)
+        data["metrics"] = _add(first.metrics, second.metrics)
+        return Post.new_from_json_dict(data)
+    if isinstance(first, Referrer):
+        return Referrer(
+            name=first.name,
+            hits=_add(first.hits, second.hits),
+            ref_type=first.ref_type,
+        )
+    return type(first)(name=first.name, hits=_add(first.hits, second.hits))
@@ -0,0 +1,76 @@
+"""
+Helpers for running local stand-ins for the Parse.ly API, shared by the
+tests and the benchmarks
+"""
+
+from __future__ import absolute_import
+
+import asyncio
+import threading
+
+import tornado.httpserver
+import tornado.ioloop
+import tornado.netutil
+
+
+class ServerThread(object):
+    """
+    Runs a Tornado application on an IOLoop and thread of its own
+
+    The application comes from `make_app()`, passed in or overridden by a
+    subclass. `start` returns once the server is listening on `port` (any
+    free one by default); `stop` closes every connection still open, so a
+    client waiting on an answer doesn't wait forever.
+    """
+
+    def __init__(self, make_app=None, port=0):
+        if make_app is not None:
+            self.make_app = make_app
+        self.port = port
+        self._started = threading.Event()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d" % self.port
+
+    def make_app(self):
+        raise NotImplementedError
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def stop(self):
+        self.io_loop.add_callback(self.io_loop.stop)
+        self._thread.join()
+
+    def run_in_loop(self, function):
+        """
+        Call `function` on the server's IOLoop and wait for it to return
+        """
+        done = threading.Event()
+
+        def call():
+            try:
+                function()
+            finally:
+                done.set()
+
+        self.io_loop.add_callback(call)
+        done.wait()
+
+    def _run(self):
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        sockets = tornado.netutil.bind_sockets(self.port, "127.0.0.1")
+        self.port = sockets[0].getsockname()[1]
+        http_server = tornado.httpserver.HTTPServer(self.make_app())
+        http_server.add_sockets(sockets)
+        self.io_loop = tornado.ioloop.IOLoop.current()
+        self._started.set()
+        self.io_loop.start()
+        http_server.stop()
+        self.io_loop.run_sync(http_server.close_all_connections, timeout=5)
+        self.io_loop.close(all_fds=True)
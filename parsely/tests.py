@@ -1,13 +1,2216 @@
 from __future__ import absolute_import
-from datetime import datetime
+from datetime import date, datetime
+import asyncio
+import contextlib
+import gzip
+import io
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
 import unittest
 import random
 
-from . import parsely
-from .recommendations import User
-from .secret import secrets
+import tornado.httpclient
+import tornado.httpserver
+import tornado.iostream
+import tornado.netutil
+import tornado.web
 
+from . import parsely, utils
+from .aio import AsyncParsely, AsyncParselyPool, AsyncUser
+from .batch import call
+from .cache import MemoryCache, TTLPolicy, request_key
+from .codec import JSONCodec, available_codecs, get_codec
+from .diskcache import DiskCache, main as diskcache_main
+from .frame import ResultFrame
+from .jsonstream import ArrayItemParser
+from .errors import AuthenticationError, DeadlineExceeded, HTTPError
+from .incremental import IncrementalSync, SyncState
+from .index import PostIndex
+from .leaderboard import Leaderboard
+from .instrument import (
+    PHASES,
+    PrometheusInstrument,
+    Recorder,
+    SpanInstrument,
+    combine,
+)
+from .models import MAX_LAYOUTS, Post, Referrer, Shares
+from .pool import ParselyPool
+from .ratelimit import AdaptiveConcurrency, RateLimiter, TokenBucket
+from .retry import LatencyTracker, RetryPolicy
+from .training import TrainingCheckpoint, TrainingPipeline
+from .recommendations import RecommendationCache, User
+from .sharding import merge, shard_range
+from .testing import ServerThread
+from .transport import PooledTransport
 
+try:
+    from .secret import secrets
+except ImportError:
+    secrets = None
+
+
+class StandInHandler(tornado.web.RequestHandler):
+    def initialize(self, server):
+        self.server = server
+
+    async def get(self, path):
+        args = {k: self.get_argument(k) for k in self.request.arguments}
+        delay = self.server.delay
+        if callable(delay):
+            delay = delay("/" + path, args)
+        if delay:
+            await asyncio.sleep(delay)
+        self.server.record(self.request.connection.stream, "/" + path, args)
+        if "/" + path in self.server.redirects:
+            self.redirect(self.server.redirects["/" + path], permanent=True)
+            return
+        self.set_status(self.server.statuses.get("/" + path, 200))
+        body = self.server.respond("/" + path, args)
+        if isinstance(body, bytes):
+            self.set_header("Content-Type", "text/html")
+        else:
+            self.set_header("Content-Type", "application/json")
+            body = json.dumps(body).encode()
+        if self.server.gzip and "gzip" in self.request.headers.get(
+            "Accept-Encoding", ""
+        ):
+            self.set_header("Content-Encoding", "gzip")
+            body = gzip.compress(body)
+        size = self.server.chunk_size or len(body)
+        try:
+            for i in range(0, len(body), size):
+                self.write(body[i : i + size])
+                await self.flush()
+        except tornado.iostream.StreamClosedError:
+            pass
+
+
+class StandInAPI(ServerThread):
+    """
+    Local Tornado server answering requests the way the Parse.ly API would
+
+    Responses default to a single post; individual paths can be overridden by
+    assigning a payload (bytes are sent as they are) or a callable taking the
+    query arguments to `routes`, and answered with another status through
+    `statuses`. A path in `redirects` is answered with a 301 to the location
+    it maps to. With `gzip` set, bodies are gzipped for clients that accept it.
+    `delay` is a number of seconds, or a callable taking the path and query
+    arguments that returns one.
+    """
+
+    def __init__(self):
+        super(StandInAPI, self).__init__()
+        self.routes = {}
+        self.statuses = {}
+        self.redirects = {}
+        self.gzip = False
+        self.delay = 0
+        self.chunk_size = None
+        self.requests = []
+        self.streams = set()
+
+    @property
+    def root(self):
+        return self.url + "/v2"
+
+    def make_app(self):
+        return tornado.web.Application(
+            [(r"/v2/(.*)", StandInHandler, {"server": self})]
+        )
+
+    def drop_connections(self):
+        def close_all():
+            for stream in self.streams:
+                stream.close()
+            self.streams.clear()
+
+        self.run_in_loop(close_all)
+
+    def record(self, stream, path, args):
+        self.streams.add(stream)
+        self.requests.append((path, args))
+
+    def respond(self, path, args):
+        payload = self.routes.get(path)
+        if callable(payload):
+            return payload(args)
+        if payload is not None:
+            return payload
+        return {"data": [{"url": "http://example.com/1", "title": "One", "_hits": 1}]}
+
+
+class StandInTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInAPI().start()
+        self.addCleanup(self.server.stop)
+        # each stand-in server decides afresh which credentials it accepts
+        utils._credentials.clear()
+
+
+class TestPooledTransport(StandInTestCase):
+    def test_reuses_connections(self):
+        p = parsely.Parsely("example.com", "secret", root=self.server.root)
+        for _ in range(4):
+            p.analytics()
+        stats = p.conn.transport.stats()
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hits"], 4)
+        self.assertEqual(stats["open"], 1)
+        self.assertEqual(len(self.server.streams), 1)
+
+    def test_per_host_limit(self):
+        transport = PooledTransport(max_per_host=2)
+        p = parsely.Parsely(
+            "example.com",
+            "secret",
+            root=self.server.root,
+            transport=transport,
+            coalesce=False,
+        )
+        threads = [threading.Thread(target=p.analytics) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        stats = transport.stats()
+        self.assertLessEqual(stats["misses"], 2)
+        self.assertLessEqual(stats["open"], 2)
+        self.assertEqual(stats["hits"] + stats["misses"], 9)
+
+    def test_recovers_from_closed_socket(self):
+        p = parsely.Parsely("example.com", "secret", root=self.server.root)
+        self.server.drop_connections()
+        res = p.analytics()
+        self.assertEqual(res[0].url, "http://example.com/1")
+        self.assertEqual(p.conn.transport.stats()["misses"], 2)
+
+    def test_follows_redirects(self):
+        self.server.redirects["/moved"] = "/v2/analytics/posts"
+        self.server.redirects["/loop"] = "/v2/loop"
+        transport = PooledTransport()
+        res = transport.fetch(self.server.root + "/moved?page=2")
+        self.assertEqual(res.code, 200)
+        self.assertEqual(json.loads(res.body)["data"][0]["url"], "http://example.com/1")
+        self.assertEqual(
+            [path for path, _ in self.server.requests], ["/moved", "/analytics/posts"]
+        )
+        # both hops went over the same kept-alive connection
+        self.assertEqual(transport.stats()["misses"], 1)
+        res = transport.fetch(self.server.root + "/loop")
+        self.assertEqual(res.code, 301)
+        self.assertEqual(len(self.server.requests), 2 + 6)
+
+    def test_gzip(self):
+        self.server.gzip = True
+        rows = [{"url": "http://example.com/%d" % i, "_hits": i} for i in range(200)]
+        self.server.routes["/analytics/posts"] = {"data": rows, "links": {}}
+        res = PooledTransport().fetch(self.server.root + "/analytics/posts")
+        self.assertEqual(res.headers["X-Consumed-Content-Encoding"], "gzip")
+        self.assertEqual(json.loads(res.body)["data"], rows)
+        p = parsely.Parsely("example.com", "secret", root=self.server.root)
+        self.assertEqual(len(p.analytics()), 200)
+        self.server.chunk_size = 100
+        posts = p.stream("analytics", limit=200)
+        self.assertEqual([post.hits for post in posts], list(range(200)))
+
+    def test_close(self):
+        p = parsely.Parsely("example.com", "secret", root=self.server.root)
+        p.conn.transport.close()
+        self.assertEqual(p.conn.transport.stats()["open"], 0)
+
+
+class TestAsyncParsely(StandInTestCase):
+    def test_gather(self):
+        self.server.routes["/analytics/authors"] = {
+            "data": [{"author": "Ars Staff", "_hits": 3}]
+        }
+        p = AsyncParsely("example.com", "secret", root=self.server.root)
+
+        async def run():
+            return await asyncio.gather(
+                p.authenticated(),
+                p.analytics(aspect="authors"),
+                *[p.post_detail("http://example.com/%d" % i) for i in range(10)]
+            )
+
+        results = asyncio.run(run())
+        self.assertTrue(results[0])
+        self.assertEqual(results[1][0].name, "Ars Staff")
+        self.assertEqual(results[2].url, "http://example.com/1")
+        self.assertEqual(len(self.server.requests), 12)
+
+    def test_user(self):
+        self.server.routes["/profile"] = {"success": True}
+        self.server.routes["/history"] = {"data": {"uuid": "u1", "urls": ["a"]}}
+        user = AsyncUser(AsyncParsely("example.com", root=self.server.root), "u1")
+        handled = []
+
+        async def run():
+            trained = await user.train("a", _callback=handled.append)
+            return trained, await user.history()
+
+        trained, history = asyncio.run(run())
+        self.assertTrue(trained)
+        self.assertEqual(handled, [True])
+        self.assertEqual(history["urls"], ["a"])
+        path, args = self.server.requests[0]
+        self.assertEqual((path, args["uuid"], args["url"]), ("/profile", "u1", "a"))
+
+
+class TestBatch(StandInTestCase):
+    def setUp(self):
+        super(TestBatch, self).setUp()
+        self.server.routes["/analytics/post/detail"] = lambda args: {
+            "data": [] if args["url"] == "bad" else [{"url": args["url"]}]
+        }
+        self.urls = ["http://example.com/%d" % i for i in range(20)] + ["bad"]
+
+    def check(self, results):
+        self.assertEqual(len(results), len(self.urls))
+        for res in results:
+            if res.call.args[0] == "bad":
+                self.assertIsInstance(res.error, IndexError)
+            else:
+                self.assertTrue(res.ok)
+                self.assertEqual(res.result.url, self.urls[res.index])
+
+    def test_batch(self):
+        p = parsely.Parsely("example.com", "secret", root=self.server.root)
+        results = p.batch(
+            (call("post_detail", url) for url in self.urls), max_concurrency=4
+        )
+        self.assertEqual([r.index for r in results], list(range(len(self.urls))))
+        self.check(results)
+
+    def test_iter_batch(self):
+        p = parsely.Parsely("example.com", "secret", root=self.server.root)
+        specs = [("post_detail", (url,)) for url in self.urls]
+        self.check(list(p.iter_batch(specs, max_concurrency=4)))
+
+    def test_async_batch(self):
+        p = AsyncParsely("example.com", "secret", root=self.server.root)
+        specs = [call("post_detail", url) for url in self.urls]
+
+        async def run():
+            ordered = await p.batch(specs, max_concurrency=4)
+            streamed = [res async for res in p.iter_batch(specs, max_concurrency=4)]
+            in_order = [
+                res
+                async for res in p.iter_batch(specs, max_concurrency=4, ordered=True)
+            ]
+            return ordered, streamed, in_order
+
+        ordered, streamed, in_order = asyncio.run(run())
+        self.assertEqual([r.index for r in ordered], list(range(len(self.urls))))
+        self.assertEqual([r.index for r in in_order], list(range(len(self.urls))))
+        self.check(ordered)
+        self.check(streamed)
+        self.check(in_order)
+
+
+class TestPagination(StandInTestCase):
+    def setUp(self):
+        super(TestPagination, self).setUp()
+
+        def page(args):
+            page, limit = int(args.get("page", 1)), int(args.get("limit", 10))
+            if page > 5:
+                return {"data": []}
+            return {
+                "data": [
+                    {"url": "http://example.com/%d" % ((page - 1) * limit + i)}
+                    for i in range(limit)
+                ]
+            }
+
+        for path in ("/analytics/posts", "/search", "/shares/posts"):
+            self.server.routes[path] = page
+
+    def test_iter_analytics(self):
+        p = parsely.Parsely("example.com", "secret", root=self.server.root)
+        urls = [post.url for post in p.iter_analytics(limit=3, prefetch=2)]
+        self.assertEqual(urls, ["http://example.com/%d" % i for i in range(15)])
+        # 5 pages plus the empty one, and at most `prefetch` pages past it
+        self.assertLessEqual(len(self.server.requests), 1 + 6 + 2)
+
+    def test_max_items(self):
+        p = parsely.Parsely("example.com", "secret", root=self.server.root)
+        posts = list(p.iter_search("security", limit=4, max_items=6))
+        self.assertEqual(len(posts), 6)
+        posts = list(p.iter_shares(limit=4, page=5))
+        self.assertEqual(len(posts), 4)
+        seen = len(self.server.requests)
+        self.assertEqual(list(p.iter_search("security", max_items=0)), [])
+        self.assertEqual(len(self.server.requests), seen)
+
+        async def run():
+            a = AsyncParsely("example.com", "secret", root=self.server.root)
+            return [post async for post in a.iter_search("security", max_items=0)]
+
+        self.assertEqual(asyncio.run(run()), [])
+
+    def test_async_paginate(self):
+        p = AsyncParsely("example.com", "secret", root=self.server.root)
+
+        async def run():
+            return [post.url async for post in p.iter_analytics(limit=2)]
+
+        urls = asyncio.run(run())
+        self.assertEqual(urls, ["http://example.com/%d" % i for i in range(10)])
+
+
+class TestCache(StandInTestCase):
+    def test_request_key(self):
+        self.assertEqual(
+            request_key("root", "key", "/search", {"q": "a", "page": 1, "tag": ""}),
+            request_key("root", "key", "/search", {"page": "1", "q": "a"}),
+        )
+        self.assertNotEqual(
+            request_key("root", "key", "/search", {"q": "a"}, "right"),
+            request_key("root", "key", "/search", {"q": "a"}, "wrong"),
+        )
+        self.assertNotIn("right", request_key("root", "key", "/", {}, "right"))
+
+    def test_shared_cache_checks_secret(self):
+        cache = MemoryCache()
+        right = parsely.Parsely(
+            "example.com", "right", root=self.server.root, cache=cache
+        )
+        wrong = parsely.Parsely(
+            "example.com",
+            "wrong",
+            root=self.server.root,
+            cache=cache,
+            authenticate=False,
+        )
+        right.analytics(aspect="authors")
+        self.server.routes["/analytics/authors"] = {"code": 403, "message": "No"}
+        with self.assertRaises(AuthenticationError):
+            wrong.analytics(aspect="authors")
+
+    def test_ttl_policy(self):
+        policy = TTLPolicy(realtime=1, window=2, historical=3)
+        self.assertEqual(policy.ttl("/profile", {"uuid": "u"}), 0)
+        self.assertEqual(policy.ttl("/analytics/posts", {"time": "1h"}), 1)
+        self.assertEqual(policy.ttl("/analytics/posts", {"days": 14}), 2)
+        past = {"period_start": "2013-01-01", "period_end": "2013-01-31"}
+        self.assertEqual(policy.ttl("/analytics/posts", past), 3)
+
+    def test_lru_bounds(self):
+        cache = MemoryCache(max_entries=2, max_bytes=100)
+        cache.set("a", b"1", 60)
+        cache.set("b", b"2", 60)
+        cache.get("a")
+        cache.set("c", b"3", 60)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a").value, b"1")
+        cache.set("d", b"x" * 98, 60)
+        self.assertEqual(cache.stats()["entries"], 1)
+        self.assertEqual(cache.stats()["evictions"], 3)
+        cache.set("e", b"1", -1)
+        self.assertIsNone(cache.get("e"))
+        self.assertEqual(cache.stats()["expirations"], 1)
+
+    def test_cached_requests(self):
+        cache = MemoryCache()
+        p = parsely.Parsely("example.com", "secret", root=self.server.root, cache=cache)
+        user = User(p, "u1")
+        self.server.routes["/profile"] = {"success": True}
+        for _ in range(3):
+            self.assertEqual(p.analytics(days=14)[0].url, "http://example.com/1")
+            user.train("http://example.com/1")
+        paths = [path for path, _ in self.server.requests]
+        self.assertEqual(paths.count("/analytics/posts"), 2)
+        self.assertEqual(paths.count("/profile"), 3)
+        self.assertEqual(cache.stats()["hits"], 2)
+
+    def test_async_cached_requests(self):
+        p = AsyncParsely(
+            "example.com", "secret", root=self.server.root, cache=MemoryCache()
+        )
+
+        async def run():
+            for _ in range(3):
+                await p.search("security")
+
+        asyncio.run(run())
+        self.assertEqual(len(self.server.requests), 1)
+
+
+class TestCoalescing(StandInTestCase):
+    def test_threads(self):
+        p = parsely.Parsely("example.com", "secret", root=self.server.root)
+        self.server.routes["/analytics/authors"] = {"data": [{"author": "A"}]}
+        self.server.delay = 0.2
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(p.analytics(aspect="authors"))
+            )
+            for _ in range(10)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual([r[0].name for r in results], ["A"] * 10)
+        paths = [path for path, _ in self.server.requests]
+        self.assertEqual(paths.count("/analytics/authors"), 1)
+        self.assertEqual(p.conn.flights.stats()["coalesced"], 9)
+
+    def test_async(self):
+        p = AsyncParsely("example.com", "secret", root=self.server.root)
+        self.server.delay = 0.1
+
+        async def run():
+            return await asyncio.gather(
+                *[p.search("security") for _ in range(10)], p.search("other")
+            )
+
+        results = asyncio.run(run())
+        self.assertEqual(len(results), 11)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(
+            p.conn.flights.stats(), {"leaders": 2, "coalesced": 9, "in_flight": 0}
+        )
+
+    def test_errors_are_shared(self):
+        p = AsyncParsely("example.com", "secret", root=self.server.root)
+        self.server.routes["/search"] = lambda args: 1 / 0
+        self.server.delay = 0.1
+
+        async def run():
+            return await asyncio.gather(
+                *[p.search("security") for _ in range(3)], return_exceptions=True
+            )
+
+        results = asyncio.run(run())
+        self.assertTrue(all(isinstance(r, HTTPError) for r in results))
+        self.assertEqual(len(self.server.requests), 1)
+
+
+class TestStaleWhileRevalidate(StandInTestCase):
+    def setUp(self):
+        super(TestStaleWhileRevalidate, self).setUp()
+        self.title = "old"
+        self.server.routes["/analytics/posts"] = lambda args: {
+            "data": [{"url": "http://example.com/1", "title": self.title}]
+        }
+
+    def client(self, **ttls):
+        p = parsely.Parsely(
+            "example.com",
+            "secret",
+            root=self.server.root,
+            cache=MemoryCache(),
+            ttl_policy=TTLPolicy(**ttls),
+        )
+        self.addCleanup(p.conn.refresher.stop)
+        return p
+
+    def wait_for(self, condition):
+        deadline = time.time() + 5
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def test_serves_stale_and_refreshes(self):
+        p = self.client(window=0.1, stale=60)
+        p.analytics()
+        self.title = "new"
+        time.sleep(0.15)
+        self.assertEqual(p.analytics()[0].title, "old")
+        self.wait_for(lambda: p.conn.refresher.stats()["refreshes"] == 1)
+        self.assertEqual(p.analytics()[0].title, "new")
+        self.assertEqual(p.conn.refresher.stats()["stale_served"], 1)
+
+    def test_hard_ttl_blocks(self):
+        p = self.client(window=0.05, stale=0.05)
+        p.analytics()
+        self.title = "new"
+        time.sleep(0.15)
+        self.assertEqual(p.analytics()[0].title, "new")
+        self.assertEqual(p.conn.refresher.stats()["stale_served"], 0)
+
+    def test_async_refresh(self):
+        cache = MemoryCache()
+        p = AsyncParsely(
+            "example.com",
+            "secret",
+            root=self.server.root,
+            cache=cache,
+            ttl_policy=TTLPolicy(window=0.1, stale=60),
+        )
+
+        async def run():
+            await p.analytics()
+            self.title = "new"
+            await asyncio.sleep(0.15)
+            stale = await p.analytics()
+            await asyncio.sleep(0.1)
+            return stale, await p.analytics()
+
+        stale, fresh = asyncio.run(run())
+        self.assertEqual((stale[0].title, fresh[0].title), ("old", "new"))
+
+    def test_pinned(self):
+        p = self.client(window=60)
+        p.pin("analytics", aspect="posts", interval=0.05)
+        requests = lambda: len(self.server.requests)
+        self.wait_for(lambda: requests() >= 3)
+        self.title = "new"
+        self.wait_for(lambda: p.analytics()[0].title == "new")
+        self.assertEqual(p.conn.refresher.stats()["pinned"], 1)
+
+    def test_async_pinned(self):
+        p = AsyncParsely(
+            "example.com",
+            "secret",
+            root=self.server.root,
+            cache=MemoryCache(),
+            ttl_policy=TTLPolicy(window=60),
+        )
+
+        async def run():
+            key = p.pin("analytics", aspect="posts", interval=0.05)
+            await asyncio.sleep(0.2)
+            self.title = "new"
+            await asyncio.sleep(0.1)
+            title = (await p.analytics())[0].title
+            p.conn.unpin(key)
+            # let a request already on the wire land
+            await asyncio.sleep(0.03)
+            seen = len(self.server.requests)
+            await asyncio.sleep(0.15)
+            return title, seen
+
+        title, seen = asyncio.run(run())
+        self.assertEqual(title, "new")
+        self.assertGreaterEqual(seen, 3)
+        self.assertEqual(len(self.server.requests), seen)
+        self.assertEqual(p.conn.refresher.stats()["pinned"], 0)
+
+
+class TestModels(unittest.TestCase):
+    def test_post_metrics(self):
+        data = {
+            "url": "http://example.com/1",
+            "visitors": 1,
+            "metrics": {"views": 3, "visitors": 2, "not_a_known_metric": 4},
+        }
+        post = Post.new_from_json_dict(data)
+        other = Post.new_from_json_dict(data)
+        self.assertEqual((post.views, post.visitors), (3, 2))
+        self.assertEqual(post.not_a_known_metric, 4)
+        self.assertEqual(post.metrics, data["metrics"])
+        self.assertIs(type(post), type(other))
+        self.assertIsInstance(post, Post)
+        self.assertFalse(hasattr(post, "mobile_views"))
+        self.assertFalse(hasattr(post, "__dict__"))
+
+    def test_layouts(self):
+        first = Post.new_from_json_dict({"metrics": {"views": 1, "visitors_new": 2}})
+        second = Post.new_from_json_dict({"metrics": {"visitors_new": 3, "views": 4}})
+        self.assertIs(type(first), type(second))
+        self.assertEqual(second.metrics, {"views": 4, "visitors_new": 3})
+        layouts = dict(Post._layouts)
+        self.addCleanup(Post._layouts.update, layouts)
+        self.addCleanup(Post._layouts.clear)
+        Post._layouts.clear()
+        Post._layouts.update({("x%d" % i,): Post for i in range(MAX_LAYOUTS)})
+        post = Post.new_from_json_dict({"metrics": {"views": 5, "rare": 6}})
+        self.assertEqual((post.views, post.rare), (5, 6))
+        self.assertEqual(len(Post._layouts), MAX_LAYOUTS)
+
+    def test_odd_metric_names(self):
+        metrics = {"views": 1, "metrics": 2, "new-visitors": 3}
+        post = Post.new_from_json_dict({"metrics": metrics})
+        self.assertEqual(post.metrics, metrics)
+        self.assertEqual(post.views, 1)
+        copied = pickle.loads(pickle.dumps(post))
+        self.assertIs(type(copied), type(post))
+        self.assertEqual(copied.metrics, metrics)
+
+    def test_no_metrics(self):
+        post = Post.new_from_json_dict({"url": "http://example.com/1"})
+        self.assertEqual(post.metrics, {})
+        with self.assertRaises(AttributeError):
+            post.views
+        ref = Referrer.new_from_json_dict({"name": "t.co", "type": "social"})
+        self.assertEqual((ref.name, ref.ref_type), ("t.co", "social"))
+
+
+class TestResultFrame(StandInTestCase):
+    rows = [
+        {"url": "a", "title": "A", "_hits": 5, "metrics": {"views": 10}},
+        {"url": "b", "title": "B", "_hits": 7},
+        {"url": "c", "title": "C", "_hits": 1, "metrics": {"views": 30, "visitors": 2}},
+    ]
+
+    def test_from_rows(self):
+        frame = ResultFrame.from_rows(self.rows)
+        self.assertEqual(len(frame), 3)
+        self.assertEqual(frame["url"], ["a", "b", "c"])
+        self.assertEqual(list(frame["hits"]), [5.0, 7.0, 1.0])
+        self.assertEqual(frame["views"][0], 10.0)
+        self.assertNotEqual(frame["views"][1], frame["views"][1])
+        self.assertEqual(len(frame["visitors"]), 3)
+
+    def test_operations(self):
+        frame = ResultFrame.from_rows(self.rows)
+        self.assertEqual(frame.sort("hits")["url"], ["b", "a", "c"])
+        self.assertEqual(frame.top("views", 2)["url"], ["c", "a"])
+        self.assertEqual(frame.filter("hits", lambda h: h > 2)["title"], ["A", "B"])
+        both = ResultFrame.concat(
+            [frame, ResultFrame.from_rows([{"author": "X", "_hits": 3}], "authors")]
+        )
+        self.assertEqual(len(both), 4)
+        self.assertEqual(both["name"], [None, None, None, "X"])
+        self.assertEqual(both["url"], ["a", "b", "c", None])
+        self.assertEqual(list(both.rows())[3]["hits"], 3.0)
+
+    def test_as_columns(self):
+        self.server.routes["/analytics/posts"] = {"data": self.rows}
+        self.server.routes["/referrers/social/authors"] = {
+            "data": [{"author": "X", "_hits": 3}]
+        }
+        p = parsely.Parsely("example.com", "secret", root=self.server.root)
+        frame = p.analytics(as_columns=True)
+        self.assertEqual(frame.top("hits", 1)["url"], ["b"])
+        frame = p.referrers_meta(meta="authors", as_columns=True)
+        self.assertEqual(frame["name"], ["X"])
+        self.server.routes["/referrers/search"] = {
+            "data": [{"name": "google", "_hits": 2}]
+        }
+        frame = p.referrers(ref_type="search", as_columns=True)
+        self.assertEqual((frame["name"], frame["ref_type"]), (["google"], ["search"]))
+
+    def test_paginated_columns(self):
+        self.server.routes["/analytics/posts"] = lambda args: {
+            "data": self.rows if int(args.get("page", 1)) <= 2 else []
+        }
+        p = parsely.Parsely("example.com", "secret", root=self.server.root)
+        frames = list(p.iter_analytics(as_columns=True, prefetch=0))
+        self.assertEqual([len(frame) for frame in frames], [3, 3])
+        self.assertEqual(ResultFrame.concat(frames)["url"], ["a", "b", "c"] * 2)
+        frames = list(p.iter_analytics(as_columns=True, max_items=4))
+        self.assertEqual([frame["url"] for frame in frames], [["a", "b", "c"], ["a"]])
+
+        async def run():
+            a = AsyncParsely("example.com", "secret", root=self.server.root)
+            return [f async for f in a.iter_analytics(as_columns=True, max_items=2)]
+
+        (frame,) = asyncio.run(run())
+        self.assertEqual(frame["url"], ["a", "b"])
+
+
+class TestStreaming(StandInTestCase):
+    def setUp(self):
+        super(TestStreaming, self).setUp()
+        self.rows = [
+            {"url": "http://example.com/%d" % i, "title": 'a "quoted" ]}', "_hits": i}
+            for i in range(500)
+        ]
+        self.server.routes["/analytics/posts"] = {"data": self.rows, "links": {}}
+        self.server.chunk_size = 100
+
+    def test_parser(self):
+        doc = {"code": 200, "data": [{"a": [1, "]"]}, 2, "x", None], "next": "\\"}
+        raw = json.dumps(doc).encode()
+        for size in (1, 3, 7, len(raw)):
+            parser = ArrayItemParser("data")
+            items = []
+            for i in range(0, len(raw), size):
+                items.extend(parser.feed(raw[i : i + size]))
+            items.extend(parser.close())
+            self.assertEqual(items, doc["data"])
+            self.assertEqual(parser.fields, {"code": 200, "next": "\\"})
+
+    def test_parser_releases_items_promptly(self):
+        parser = ArrayItemParser("data")
+        big = json.dumps({"title": "x" * 1000})
+        self.assertEqual(
+            parser.feed(('{"data": [%s, ' % big).encode()), [json.loads(big)]
+        )
+        # a small element after a large one is released by its closing brace
+        self.assertEqual(parser.feed(b'{"a": 1'), [])
+        self.assertEqual(parser.feed(b"}"), [{"a": 1}])
+        self.assertEqual(parser.feed(b', "abc'), [])
+        self.assertEqual(parser.feed(b'd"'), ["abcd"])
+        self.assertEqual(parser.feed(b"]}"), [])
+        self.assertEqual(parser.close(), [])
+
+    def test_stream(self):
+        p = parsely.Parsely("example.com", "secret", root=self.server.root)
+        posts = p.stream("analytics", limit=500)
+        first = next(posts)
+        self.assertEqual((first.url, first.hits), ("http://example.com/0", 0))
+        self.assertEqual([post.hits for post in posts], list(range(1, 500)))
+
+    def test_abandoned_stream(self):
+        p = parsely.Parsely("example.com", "secret", root=self.server.root)
+        posts = p.stream("analytics", limit=500)
+        next(posts)
+        posts.close()
+        # the half-read connection is closed rather than returned to the pool
+        self.assertEqual(p.conn.transport.stats()["open"], 0)
+        self.assertEqual(len(p.search("security")), 1)
+
+    def test_error_document(self):
+        self.server.routes["/search"] = {"code": 403, "message": "forbidden"}
+        p = parsely.Parsely("example.com", "secret", root=self.server.root)
+        with self.assertRaises(ValueError):
+            list(p.stream("search", "security"))
+
+    def test_async_stream(self):
+        p = AsyncParsely("example.com", "secret", root=self.server.root)
+
+        async def run():
+            return [post.url async for post in p.stream("analytics", limit=500)]
+
+        urls = asyncio.run(run())
+        self.assertEqual(urls, [row["url"] for row in self.rows])
+
+    def test_error_status(self):
+        self.server.statuses["/search"] = 502
+        self.server.routes["/search"] = b"<html>Bad Gateway</html>"
+        p = parsely.Parsely("example.com", "secret", root=self.server.root)
+        with self.assertRaises(HTTPError) as caught:
+            list(p.stream("search", "security"))
+        self.assertEqual(caught.exception.code, 502)
+
+        async def run():
+            a = AsyncParsely("example.com", "secret", root=self.server.root)
+            return [post async for post in a.stream("search", "security")]
+
+        with self.assertRaises(HTTPError):
+            asyncio.run(run())
+
+    def test_retried(self):
+        rows = self.server.routes["/analytics/posts"]
+
+        def unavailable_once(args):
+            self.server.routes["/analytics/posts"] = rows
+            del self.server.statuses["/analytics/posts"]
+            return {"code": 503, "message": "try again"}
+
+        for client in (parsely.Parsely, AsyncParsely):
+            self.server.statuses["/analytics/posts"] = 503
+            self.server.routes["/analytics/posts"] = unavailable_once
+            recorder = Recorder()
+            p = client(
+                "example.com",
+                "secret",
+                root=self.server.root,
+                retry=RetryPolicy(backoff=0),
+                concurrency=AdaptiveConcurrency(),
+                instrument=recorder,
+            )
+            if client is parsely.Parsely:
+                hits = [post.hits for post in p.stream("analytics", limit=500)]
+            else:
+
+                async def run():
+                    return [post.hits async for post in p.stream("analytics")]
+
+                hits = asyncio.run(run())
+            self.assertEqual(hits, list(range(500)))
+            stats = recorder.stats()["/analytics/posts"]
+            self.assertEqual((stats["retries"], stats["errors"]), (1, 0))
+            self.assertTrue(stats["bytes"] > 0)
+            self.assertEqual(p.conn.concurrency.stats()["in_flight"], 0)
+
+
+class TestCodec(StandInTestCase):
+    def test_get_codec(self):
+        self.assertEqual(get_codec().name, available_codecs()[0])
+        self.assertEqual(get_codec("json").loads(b'{"a": 1}'), {"a": 1})
+        with self.assertRaises(ValueError):
+            get_codec("yaml")
+
+    def test_client_codec(self):
+        class CountingCodec(JSONCodec):
+            calls = 0
+
+            def loads(self, data):
+                CountingCodec.calls += 1
+                return super(CountingCodec, self).loads(data)
+
+        cache = MemoryCache()
+        p = parsely.Parsely(
+            "example.com",
+            "secret",
+            root=self.server.root,
+            codec=CountingCodec(),
+            cache=cache,
+        )
+        p.analytics()
+        p.analytics()
+        self.assertEqual(CountingCodec.calls, 3)
+        # cache entries hold the raw body and are decoded on every read
+        key = request_key(
+            p.conn.rooturl,
+            "example.com",
+            "/analytics/posts",
+            p._describe("analytics")[1],
+            "secret",
+        )
+        self.assertIsInstance(cache.get(key).value, bytes)
+
+
+class TestRateLimit(StandInTestCase):
+    def test_token_bucket(self):
+        bucket = TokenBucket(10, burst=2)
+        waits = [bucket.reserve() for _ in range(4)]
+        self.assertEqual(waits[:2], [0, 0])
+        self.assertAlmostEqual(waits[2], 0.1, places=2)
+        self.assertAlmostEqual(waits[3], 0.2, places=2)
+
+    def test_keys_and_families(self):
+        limiter = RateLimiter(rate=100, keys={"b.com": (1, 1)}, families={"/shares": 5})
+        self.assertEqual(len(limiter.buckets("a.com", "/analytics/posts")), 1)
+        self.assertEqual(len(limiter.buckets("a.com", "/shares/post/detail")), 2)
+        self.assertEqual(limiter.buckets("b.com", "/related")[0].rate, 1)
+        # families are limited per key
+        self.assertIsNot(
+            limiter.buckets("a.com", "/shares")[1],
+            limiter.buckets("b.com", "/shares")[1],
+        )
+
+    def test_client_limiter(self):
+        limiter = RateLimiter(families={"/analytics": (20, 1)})
+        p = parsely.Parsely(
+            "example.com", "secret", root=self.server.root, limiter=limiter
+        )
+        started = time.time()
+        for _ in range(4):
+            p.analytics(aspect="authors")
+        self.assertGreaterEqual(time.time() - started, 0.15)
+
+    def test_async_limiter(self):
+        limiter = RateLimiter(rate=20, burst=1)
+        p = AsyncParsely(
+            "example.com", "secret", root=self.server.root, limiter=limiter
+        )
+
+        async def run():
+            return await asyncio.gather(*[p.search("q%d" % i) for i in range(4)])
+
+        started = time.time()
+        asyncio.run(run())
+        self.assertGreaterEqual(time.time() - started, 0.15)
+        self.assertGreater(limiter.waited, 0)
+
+    def test_aimd(self):
+        governor = AdaptiveConcurrency(initial=4, minimum=1, latency_target=0.5)
+        for _ in range(4):
+            governor.acquire()
+        governor.release(0.01)
+        self.assertAlmostEqual(governor.limit, 4.25)
+        governor.release(1.0)
+        self.assertAlmostEqual(governor.limit, 2.125)
+        # a burst of failures only backs off once
+        governor.release(0.01, ok=False)
+        self.assertAlmostEqual(governor.limit, 2.125)
+        self.assertEqual(governor.in_flight, 1)
+
+    def test_async_governor(self):
+        p = AsyncParsely(
+            "example.com",
+            "secret",
+            root=self.server.root,
+            coalesce=False,
+            concurrency=AdaptiveConcurrency(initial=2, latency_target=5),
+        )
+        self.server.delay = 0.05
+
+        async def run():
+            return await asyncio.gather(*[p.search("q") for _ in range(6)])
+
+        started = time.time()
+        asyncio.run(run())
+        # two at a time, growing slowly: at least three rounds
+        self.assertGreaterEqual(time.time() - started, 0.15)
+        self.assertEqual(p.conn.concurrency.stats()["in_flight"], 0)
+        self.assertGreater(p.conn.concurrency.limit, 2)
+
+    def test_errors_back_off(self):
+        p = parsely.Parsely(
+            "example.com",
+            "secret",
+            root=self.server.root,
+            concurrency=AdaptiveConcurrency(initial=8),
+        )
+        self.server.routes["/search"] = lambda args: 1 / 0
+        with self.assertRaises(HTTPError):
+            p.search("q")
+        # halved once, after growing a little on the authentication call
+        self.assertLess(p.conn.concurrency.limit, 5)
+
+
+class TestRetryPolicy(StandInTestCase):
+    def setUp(self):
+        super(TestRetryPolicy, self).setUp()
+        self.p = parsely.Parsely("example.com", "secret", root=self.server.root)
+        self.failures = 0
+
+    def slow_once(self):
+        # only the next request is slow
+        arrivals = []
+
+        def delay(path, args):
+            arrivals.append(path)
+            return 0.5 if len(arrivals) == 1 else 0
+
+        return delay
+
+    def flaky(self, failures):
+        def route(args):
+            if self.failures < failures:
+                self.failures += 1
+                raise RuntimeError("unavailable")
+            return {"data": [{"url": "http://example.com/1", "title": "One"}]}
+
+        return route
+
+    def test_retries_server_errors(self):
+        self.server.routes["/search"] = self.flaky(2)
+        p = self.p.with_policy(RetryPolicy(retries=2, backoff=0.01))
+        self.assertEqual(p.search("q")[0].title, "One")
+        self.assertEqual(p.conn.retry.stats()["retried"], 2)
+        # the original client is untouched and shares the connection pool
+        self.assertIsNone(self.p.conn.retry)
+        self.assertIs(p.conn.transport, self.p.conn.transport)
+
+    def test_gives_up(self):
+        self.server.routes["/search"] = self.flaky(5)
+        p = self.p.with_policy(RetryPolicy(retries=1, backoff=0.01))
+        with self.assertRaises(HTTPError) as raised:
+            p.search("q")
+        self.assertEqual(raised.exception.code, 500)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_no_retry_for_training(self):
+        self.server.routes["/profile"] = self.flaky(1)
+        user = User(self.p.with_policy(RetryPolicy(backoff=0.01)), "uuid")
+        with self.assertRaises(HTTPError):
+            user.train("http://example.com/1")
+        self.assertEqual(self.failures, 1)
+
+    def test_deadline(self):
+        self.server.delay = 0.5
+        p = self.p.with_policy(RetryPolicy(retries=5, read_timeout=0.1, deadline=0.3))
+        started = time.time()
+        with self.assertRaises(DeadlineExceeded):
+            p.search("q")
+        self.assertLess(time.time() - started, 0.45)
+
+    def test_async_deadline(self):
+        p = AsyncParsely(
+            "example.com",
+            "secret",
+            root=self.server.root,
+            retry=RetryPolicy(retries=5, deadline=0.2),
+        )
+        self.server.delay = 0.5
+        with self.assertRaises(DeadlineExceeded):
+            asyncio.run(p.search("q"))
+
+    def test_async_retries(self):
+        p = AsyncParsely(
+            "example.com",
+            "secret",
+            root=self.server.root,
+            retry=RetryPolicy(backoff=0.01, read_timeout=0.1),
+        )
+        # the first attempt times out, the retry is answered at once
+        self.server.delay = self.slow_once()
+        self.assertEqual(asyncio.run(p.search("q"))[0].title, "One")
+
+    def hedged(self):
+        self.server.delay = self.slow_once()
+        return RetryPolicy(hedge_after=0.05)
+
+    def test_hedge(self):
+        recorder = Recorder()
+        p = parsely.Parsely(
+            "example.com",
+            "secret",
+            root=self.server.root,
+            authenticate=False,
+            retry=self.hedged(),
+            instrument=recorder,
+        )
+        started = time.time()
+        self.assertEqual(p.search("q")[0].title, "One")
+        self.assertLess(time.time() - started, 0.4)
+        stats = p.conn.retry.stats()
+        self.assertEqual((stats["attempts"], stats["hedged"]), (1, 1))
+        # the duplicate is not a retry
+        stats = recorder.stats()["/search"]
+        self.assertEqual((stats["retries"], stats["hedged"]), (0, 1))
+
+    def test_no_hedge_for_training(self):
+        self.server.routes["/profile"] = {"success": True}
+        user = User(self.p.with_policy(self.hedged()), "uuid")
+        self.assertTrue(user.train("http://example.com/1"))
+        sent = [path for path, _ in self.server.requests if path == "/profile"]
+        self.assertEqual(sent, ["/profile"])
+        self.assertEqual(user.conn.retry.stats()["hedged"], 0)
+
+    def test_async_hedge(self):
+        p = AsyncParsely(
+            "example.com", "secret", root=self.server.root, retry=self.hedged()
+        )
+        started = time.time()
+        self.assertEqual(asyncio.run(p.search("q"))[0].title, "One")
+        self.assertLess(time.time() - started, 0.4)
+
+    def test_latency_percentile(self):
+        tracker = LatencyTracker(min_samples=10)
+        for i in range(9):
+            tracker.add(i)
+        self.assertIsNone(tracker.percentile(95))
+        for i in range(9, 100):
+            tracker.add(i)
+        self.assertEqual(tracker.percentile(95), 95)
+
+
+class TestIncrementalSync(StandInTestCase):
+    def setUp(self):
+        super(TestIncrementalSync, self).setUp()
+        self.p = parsely.Parsely("example.com", "secret", root=self.server.root)
+        self.server.routes["/analytics/posts"] = self.window
+        self.path = os.path.join(tempfile.mkdtemp(), "posts.sync")
+        self.addCleanup(lambda: os.path.exists(self.path) and os.unlink(self.path))
+
+    def window(self, args):
+        if args.get("page", "1") != "1" or "period_start" not in args:
+            return {"data": []}
+        day = args["period_start"]
+        return {"data": [{"url": "http://example.com/" + day, "_hits": 2}]}
+
+    def windows_fetched(self):
+        # prefetched pages of an earlier run's last window may land late
+        return sorted(
+            set(
+                args["period_start"]
+                for path, args in self.server.requests
+                if "period_start" in args and args.get("page", "1") == "1"
+            )
+        )
+
+    def sync(self, days=5, **kwargs):
+        return IncrementalSync(self.p, self.path, days=days, **kwargs)
+
+    def test_fetches_only_open_windows(self):
+        sync = self.sync()
+        self.assertEqual(len(sync.run(today=date(2026, 10, 10))), 5)
+        self.assertEqual(sync.sink.totals()["http://example.com/2026-10-06"], 2)
+        self.assertEqual(SyncState(self.path).watermark, "2026-10-08")
+
+        del self.server.requests[:]
+        self.assertEqual(
+            sync.run(today=date(2026, 10, 10)), [date(2026, 10, 9), date(2026, 10, 10)]
+        )
+        self.assertEqual(self.windows_fetched(), ["2026-10-09", "2026-10-10"])
+        # refetching a window replaces it
+        self.assertEqual(sum(sync.sink.totals().values()), 10)
+
+        del self.server.requests[:]
+        self.sync().run(today=date(2026, 10, 11))
+        self.assertEqual(
+            self.windows_fetched(), ["2026-10-09", "2026-10-10", "2026-10-11"]
+        )
+        state = SyncState(self.path)
+        self.assertEqual(state.watermark, "2026-10-09")
+        self.assertNotIn("2026-10-06", state.windows)
+
+    def test_resumes_after_crash(self):
+        def crash(window, items):
+            if window == date(2026, 10, 8):
+                raise RuntimeError("warehouse unavailable")
+
+        with self.assertRaises(RuntimeError):
+            self.sync(sink=crash).run(today=date(2026, 10, 10))
+        self.assertEqual(
+            sorted(SyncState(self.path).windows), ["2026-10-06", "2026-10-07"]
+        )
+
+        del self.server.requests[:]
+        self.sync().run(today=date(2026, 10, 10))
+        self.assertEqual(
+            self.windows_fetched(), ["2026-10-08", "2026-10-09", "2026-10-10"]
+        )
+
+    def test_arguments_it_sets(self):
+        with self.assertRaises(ValueError):
+            self.sync(start=date(2026, 10, 1))
+        with self.assertRaises(ValueError):
+            # shares(aspect, days, start, end, limit)
+            IncrementalSync(self.p, self.path, "shares", "posts", 14, None, None, 5)
+        self.assertEqual(self.sync(aspect="authors", limit=5).limit, 5)
+
+    def test_pub_date_windows(self):
+        sync = self.sync(by="pub_date", days=1)
+        sync.run(today=date(2026, 10, 10))
+        args = [args for path, args in self.server.requests if "pub_date_start" in args]
+        self.assertEqual(args[0]["pub_date_end"], "2026-10-10")
+
+
+class TestSharding(StandInTestCase):
+    def setUp(self):
+        super(TestSharding, self).setUp()
+        self.p = parsely.Parsely("example.com", "secret", root=self.server.root)
+        self.server.routes["/analytics/posts"] = self.posts
+        self.server.routes["/referrers/social"] = {
+            "data": [{"name": "twitter", "_hits": 3}, {"name": "facebook", "_hits": 1}]
+        }
+
+    def posts(self, args):
+        if args.get("page", "1") != "1" or "period_start" not in args:
+            return {"data": []}
+        day = int(args["period_start"][-2:])
+        rows = [{"url": "http://example.com/a", "_hits": 1, "metrics": {"views": day}}]
+        if day % 2 == 0:
+            rows.append({"url": "http://example.com/b", "_hits": 5})
+        return {"data": rows}
+
+    def test_shard_range(self):
+        shards = shard_range(date(2026, 10, 1), date(2026, 10, 16), "week")
+        self.assertEqual(
+            shards,
+            [
+                (date(2026, 10, 1), date(2026, 10, 7)),
+                (date(2026, 10, 8), date(2026, 10, 14)),
+                (date(2026, 10, 15), date(2026, 10, 16)),
+            ],
+        )
+        with self.assertRaises(ValueError):
+            shard_range(date(2026, 10, 2), date(2026, 10, 1))
+
+    def test_merge(self):
+        posts = [
+            Post.new_from_json_dict({"url": "u", "_hits": 1, "metrics": {"views": 2}}),
+            Post.new_from_json_dict({"url": "v", "_hits": 1}),
+            Post.new_from_json_dict({"url": "u", "_hits": 1, "metrics": {"views": 3}}),
+        ]
+        merged = merge(posts)
+        self.assertEqual([(p.url, p.hits) for p in merged], [("u", 2), ("v", 1)])
+        self.assertEqual(merged[0].views, 5)
+
+    def test_merge_across_layouts(self):
+        # shards report the same post with metrics in another order, or without
+        # some of them
+        rows = [
+            {"url": "u", "_hits": 1, "metrics": {"views": 1, "visitors": 1}},
+            {"url": "u", "_hits": 1, "metrics": {"visitors": 2, "views": 2}},
+            {"url": "u", "_hits": 1, "metrics": {"views": 3}},
+            {"url": "u", "_hits": 1},
+        ]
+        self.server.routes["/analytics/posts"] = lambda args: {
+            "data": (
+                [rows[int(args["period_start"][-1]) - 1]]
+                if args.get("page", "1") == "1"
+                else []
+            )
+        }
+        posts = self.p.sharded("analytics", date(2026, 10, 1), date(2026, 10, 4))
+        self.assertEqual([(p.url, p.hits) for p in posts], [("u", 4)])
+        self.assertEqual(posts[0].metrics, {"views": 6, "visitors": 3})
+
+    def test_sharded(self):
+        progress = []
+        posts = self.p.sharded(
+            "analytics",
+            date(2026, 10, 1),
+            date(2026, 10, 7),
+            progress=lambda done, total, shard: progress.append((done, total)),
+        )
+        self.assertEqual(
+            [(p.url, p.hits) for p in posts],
+            [("http://example.com/b", 15), ("http://example.com/a", 7)],
+        )
+        self.assertEqual(posts[1].views, 28)
+        self.assertEqual(progress[-1], (7, 7))
+        # ranked by the sort metric when there is one
+        posts = self.p.sharded(
+            "analytics", date(2026, 10, 1), date(2026, 10, 7), sort="views"
+        )
+        self.assertEqual(posts[0].url, "http://example.com/a")
+
+    def test_unpaged(self):
+        referrers = self.p.sharded(
+            "referrers", date(2026, 10, 1), date(2026, 10, 14), shard="week"
+        )
+        self.assertEqual(
+            [(r.name, r.hits) for r in referrers], [("twitter", 6), ("facebook", 2)]
+        )
+
+    def test_date_rules(self):
+        with self.assertRaises(ValueError):
+            self.p.sharded("analytics", date(2026, 10, 1), None)
+        with self.assertRaises(ValueError):
+            self.p.sharded("analytics", None, None)
+        with self.assertRaises(ValueError):
+            self.p.sharded(
+                "analytics",
+                date(2026, 10, 1),
+                date(2026, 10, 7),
+                pub_start=date(2026, 9, 1),
+            )
+
+    def test_async(self):
+        p = AsyncParsely("example.com", "secret", root=self.server.root)
+        posts = asyncio.run(
+            p.sharded(
+                "analytics", date(2026, 10, 1), date(2026, 10, 7), max_concurrency=3
+            )
+        )
+        self.assertEqual([p.hits for p in posts], [15, 7])
+
+
+class TestDiskCache(StandInTestCase):
+    def setUp(self):
+        super(TestDiskCache, self).setUp()
+        self.directory = tempfile.mkdtemp()
+
+    def test_persists(self):
+        cache = DiskCache(self.directory)
+        cache.set("a", b"first", 60)
+        cache.set("b", b"second", 60)
+        cache.set("a", b"third", 60)
+        cache.delete("b")
+        cache.close()
+        cache = DiskCache(self.directory)
+        self.assertEqual(cache.get("a").value, b"third")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.stats()["entries"], 1)
+
+    def test_expiry_and_compaction(self):
+        cache = DiskCache(self.directory, max_bytes=1000)
+        cache.set("old", b"x", -1)
+        self.assertIsNone(cache.get("old"))
+        for i in range(30):
+            cache.set("k%d" % i, b"x" * 100, 60)
+        stats = cache.stats()
+        self.assertLessEqual(stats["segment_bytes"], 1000)
+        self.assertGreater(stats["compactions"], 0)
+        # the newest entries survive
+        self.assertEqual(cache.get("k29").value, b"x" * 100)
+        self.assertIsNone(cache.get("k0"))
+
+    def test_truncated_index(self):
+        cache = DiskCache(self.directory)
+        cache.set("a", b"body", 60)
+        cache.close()
+        with open(cache.index_path, "ab") as f:
+            f.write(b'{"k": "b", "r": [4, ')
+        self.assertEqual(DiskCache(self.directory).items()[0][0], "a")
+
+    def test_client_across_restarts(self):
+        ttl_policy = TTLPolicy(historical=3600)
+        p = parsely.Parsely(
+            "example.com",
+            "secret",
+            root=self.server.root,
+            cache=DiskCache(self.directory),
+            ttl_policy=ttl_policy,
+        )
+        args = dict(start=date(2026, 1, 1), end=date(2026, 1, 31))
+        p.analytics(**args)
+        p.conn.cache.close()
+
+        del self.server.requests[:]
+        p = parsely.Parsely(
+            "example.com",
+            "secret",
+            root=self.server.root,
+            cache=DiskCache(self.directory),
+            ttl_policy=ttl_policy,
+        )
+        self.assertEqual(p.analytics(**args)[0].title, "One")
+        # even the authentication check was answered from disk
+        self.assertEqual(self.server.requests, [])
+
+    def test_cli(self):
+        cache = DiskCache(self.directory)
+        cache.set("a", b"body", 60)
+        cache.set("b", b"gone", -1)
+        cache.close()
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            diskcache_main([self.directory, "list"])
+            diskcache_main([self.directory, "prune"])
+            diskcache_main([self.directory, "stats"])
+        self.assertIn("expired", out.getvalue())
+        self.assertIn('"entries": 1', out.getvalue())
+
+
+class TestPostIndex(StandInTestCase):
+    def setUp(self):
+        super(TestPostIndex, self).setUp()
+        self.p = parsely.Parsely("example.com", "secret", root=self.server.root)
+        posts = [
+            {
+                "url": "http://example.com/%d" % i,
+                "title": "Post %d" % i,
+                "author": "Ann" if i % 2 else "Bob",
+                "section": "News",
+                "tags": ["tag%d" % i],
+                "_hits": i * 10,
+            }
+            for i in range(1, 6)
+        ]
+        self.server.routes["/analytics/posts"] = self.paged(posts)
+        self.server.routes["/shares/posts"] = self.paged(
+            [{"url": p["url"], "_shares": p["_hits"] // 10} for p in posts]
+        )
+        self.server.routes["/referrers/social/posts"] = {
+            "data": [{"url": "http://example.com/5", "_hits": 7}]
+        }
+        self.server.routes["/shares/post/detail"] = {"data": [{"total": 3}]}
+        self.server.routes["/referrers/post/detail"] = {
+            "data": [{"name": "t.co", "_hits": 4}, {"name": "fb.com", "_hits": 9}]
+        }
+        self.server.routes["/analytics/post/detail"] = lambda args: {
+            "data": [{"url": args["url"], "author": "Cy", "_hits": 1}]
+        }
+
+    def paged(self, rows):
+        return lambda args: {
+            "data": rows if args.get("page", "1") == "1" and "limit" in args else []
+        }
+
+    def test_join(self):
+        index = PostIndex(self.p)
+        index.load_analytics(limit=5)
+        index.load_shares(limit=5)
+        index.load_referrals("social")
+        self.assertEqual(len(index), 5)
+        top = index.top(2)
+        self.assertEqual(
+            [r.url for r in top], ["http://example.com/5", "http://example.com/4"]
+        )
+        self.assertEqual(top[0].shares.total, 5)
+        self.assertEqual(top[0].referrals, {"social": 7})
+        self.assertEqual(
+            sorted(r.url for r in index.by_author("Bob")),
+            ["http://example.com/2", "http://example.com/4"],
+        )
+        self.assertEqual(index.by_tag("tag3")[0].post.title, "Post 3")
+
+        del self.server.requests[:]
+        index.fill(top + ["http://example.com/new"], shares=False)
+        # ignore page prefetches still landing from the loads above
+        paths = sorted(
+            path for path, _ in self.server.requests if path.endswith("/detail")
+        )
+        self.assertEqual(
+            paths,
+            ["/analytics/post/detail"] + ["/referrers/post/detail"] * 3,
+        )
+        self.assertEqual(top[0].top_referrers(1)[0].name, "fb.com")
+        self.assertEqual(index.by_author("Cy")[0].url, "http://example.com/new")
+
+    def test_fill_after_load_shares(self):
+        index = PostIndex(self.p)
+        index.load_shares(limit=5)
+        del self.server.requests[:]
+        records = index.fill(
+            ["http://example.com/5", "http://example.com/new"], referrers=False
+        )
+        # the loaded total is kept, only the new url's shares are fetched
+        paths = sorted(
+            path for path, _ in self.server.requests if path.endswith("/detail")
+        )
+        self.assertEqual(
+            paths, ["/analytics/post/detail"] * 2 + ["/shares/post/detail"]
+        )
+        self.assertEqual([r.shares.total for r in records], [5, 3])
+        self.assertTrue(all(isinstance(r.shares, Shares) for r in records))
+
+    def test_incremental_update(self):
+        index = PostIndex()
+        index.add_posts([Post(url="u", author="Ann", hits=1)])
+        index.add_posts([Post(url="u", author="Bob", hits=2)])
+        self.assertEqual(index.by_author("Ann"), [])
+        self.assertEqual(index.by_author("Bob")[0].hits, 2)
+
+
+class TestParselyPool(StandInTestCase):
+    def setUp(self):
+        super(TestParselyPool, self).setUp()
+        self.sites = {"a.com": "s1", "b.com": "s2", "bad.com": "s3"}
+        self.server.routes["/analytics/posts"] = self.posts
+
+    def posts(self, args):
+        if args["apikey"] == "bad.com":
+            return {"code": 403, "message": "Forbidden"}
+        return {"data": [{"url": "http://%s/1" % args["apikey"], "_hits": 1}]}
+
+    def auth_requests(self):
+        return [
+            args["apikey"]
+            for path, args in self.server.requests
+            if path == "/analytics/posts" and set(args) == {"apikey", "secret"}
+        ]
+
+    def test_lazy_cached_auth(self):
+        pool = ParselyPool(self.sites, root=self.server.root, cache=MemoryCache())
+        self.assertEqual(self.server.requests, [])
+        pool["a.com"].analytics(aspect="authors")
+        pool["a.com"].analytics(aspect="sections")
+        self.assertEqual(self.auth_requests(), ["a.com"])
+        self.assertIs(pool["a.com"].conn.transport, pool.client("b.com").conn.transport)
+        self.assertIs(pool["a.com"].conn.cache, pool["b.com"].conn.cache)
+        with self.assertRaises(AuthenticationError):
+            pool["bad.com"]
+        with self.assertRaises(KeyError):
+            pool["unknown.com"]
+
+    def test_fan_out(self):
+        pool = ParselyPool(self.sites, root=self.server.root, cache=MemoryCache())
+        results = pool.fan_out("analytics", limit=5)
+        self.assertEqual([r.site for r in results], ["a.com", "b.com", "bad.com"])
+        self.assertEqual(results[1].result[0].url, "http://b.com/1")
+        self.assertFalse(results[2].ok)
+        self.assertIsInstance(results[2].error, AuthenticationError)
+
+    def test_new_credentials(self):
+        pool = ParselyPool({"a.com": "old"}, root=self.server.root)
+        first = pool["a.com"]
+        pool.add("a.com", "new")
+        self.assertIsNot(pool["a.com"], first)
+        self.assertEqual(pool["a.com"].conn.secret, "new")
+
+    def test_async(self):
+        pool = AsyncParselyPool(self.sites, root=self.server.root)
+        results = asyncio.run(pool.fan_out("analytics", sites=["a.com", "bad.com"]))
+        self.assertEqual(results[0].result[0].url, "http://a.com/1")
+        self.assertIsInstance(results[1].error, AuthenticationError)
+
+
+class TestAuthentication(StandInTestCase):
+    def deny(self, args):
+        return {"code": 403, "message": "Forbidden"}
+
+    def test_memoized(self):
+        parsely.Parsely("example.com", "secret", root=self.server.root)
+        parsely.Parsely("example.com", "secret", root=self.server.root)
+        self.assertEqual(len(self.server.requests), 1)
+        parsely.Parsely("example.com", "other", root=self.server.root)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_lazy(self):
+        p = parsely.Parsely(
+            "example.com", "secret", root=self.server.root, authenticate="lazy"
+        )
+        self.assertEqual(self.server.requests, [])
+        self.server.routes["/referrers/post/detail"] = self.deny
+        with self.assertRaises(AuthenticationError):
+            p.referrers_post_detail("http://example.com/1")
+        self.assertFalse(p.conn.credentials_ok())
+        # known bad credentials fail at construction, without a request
+        with self.assertRaises(AuthenticationError):
+            parsely.Parsely(
+                "example.com", "secret", root=self.server.root, authenticate="lazy"
+            )
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_first_request_remembers(self):
+        p = parsely.Parsely(
+            "example.com", "secret", root=self.server.root, authenticate="lazy"
+        )
+        p.analytics(aspect="authors")
+        self.assertTrue(p.conn.credentials_ok())
+        parsely.Parsely("example.com", "secret", root=self.server.root)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_rejected(self):
+        self.server.routes["/analytics/posts"] = self.deny
+        with self.assertRaises(AuthenticationError):
+            parsely.Parsely("example.com", "secret", root=self.server.root)
+
+    def test_async(self):
+        self.server.routes["/search"] = self.deny
+        p = AsyncParsely("example.com", "secret", root=self.server.root)
+        with self.assertRaises(AuthenticationError):
+            asyncio.run(p.search("security"))
+        self.assertIs(p.conn.credentials_ok(), False)
+
+
+class TestHTTPErrors(StandInTestCase):
+    def setUp(self):
+        super(TestHTTPErrors, self).setUp()
+        self.p = parsely.Parsely(
+            "example.com", "secret", root=self.server.root, authenticate=False
+        )
+
+    def test_json_error(self):
+        self.server.routes["/analytics/posts"] = {
+            "code": 503,
+            "message": "Service Unavailable",
+        }
+        self.server.statuses["/analytics/posts"] = 503
+        with self.assertRaises(HTTPError) as raised:
+            self.p.analytics()
+        self.assertEqual(raised.exception.code, 503)
+        self.assertEqual(raised.exception.message, "Service Unavailable")
+        # the same error in the body of a 200
+        del self.server.statuses["/analytics/posts"]
+        with self.assertRaises(HTTPError) as raised:
+            self.p.analytics()
+        self.assertEqual(raised.exception.code, 503)
+
+    def test_html_error(self):
+        self.server.routes["/search"] = b"<html><body>Bad Gateway</body></html>"
+        self.server.statuses["/search"] = 502
+        with self.assertRaises(HTTPError) as raised:
+            self.p.search("q")
+        self.assertEqual(raised.exception.code, 502)
+        self.assertIsNone(raised.exception.message)
+
+    def test_not_cached(self):
+        self.server.routes["/search"] = {"code": 500, "message": "Oops"}
+        self.server.statuses["/search"] = 500
+        p = parsely.Parsely(
+            "example.com",
+            "secret",
+            root=self.server.root,
+            authenticate=False,
+            cache=MemoryCache(),
+        )
+        for _ in range(2):
+            with self.assertRaises(HTTPError):
+                p.search("q")
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_async(self):
+        self.server.routes["/search"] = b"<html>Service Unavailable</html>"
+        self.server.statuses["/search"] = 503
+        p = AsyncParsely("example.com", "secret", root=self.server.root)
+        with self.assertRaises(HTTPError) as raised:
+            asyncio.run(p.search("q"))
+        self.assertEqual(raised.exception.code, 503)
+
+
+class FakeSpan(object):
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = dict(attributes)
+        self.errors = []
+        self.ended = False
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def record_exception(self, error):
+        self.errors.append(error)
+
+    def end(self):
+        self.ended = True
+
+
+class FakeMetric(object):
+    def __init__(self):
+        self.observed = []
+
+    def labels(self, **labels):
+        metric = self
+
+        class Child(object):
+            def observe(self, value):
+                metric.observed.append((labels, value))
+
+            def inc(self):
+                metric.observed.append((labels, 1))
+
+        return Child()
+
+
+class TestInstrumentation(StandInTestCase):
+    def setUp(self):
+        super(TestInstrumentation, self).setUp()
+        self.recorder = Recorder()
+        self.spans = []
+        self.tracer = type(
+            "Tracer",
+            (object,),
+            {
+                "start_span": lambda _, name, attributes: self.record_span(
+                    name, attributes
+                )
+            },
+        )()
+
+    def record_span(self, name, attributes):
+        self.spans.append(FakeSpan(name, attributes))
+        return self.spans[-1]
+
+    def client(self, **kwargs):
+        return parsely.Parsely(
+            "example.com",
+            "secret",
+            root=self.server.root,
+            authenticate=False,
+            instrument=self.recorder,
+            **kwargs
+        )
+
+    def test_phases(self):
+        p = self.client(cache=MemoryCache())
+        p.analytics(aspect="authors")
+        p.analytics(aspect="authors")
+        stats = self.recorder.stats()["/analytics/authors"]
+        self.assertEqual(stats["count"], 2)
+        self.assertEqual(stats["cache"], {"miss": 1, "hit": 1})
+        self.assertEqual(set(stats["phases"]), set(PHASES))
+        self.assertLessEqual(stats["p50"], stats["p99"])
+        self.assertGreater(stats["bytes"], 0)
+
+    def test_errors_and_retries(self):
+        failures = []
+
+        def flaky(args):
+            if not failures:
+                failures.append(1)
+                raise RuntimeError("unavailable")
+            return {"code": 403, "message": "Forbidden"}
+
+        self.server.routes["/search"] = flaky
+        p = self.client(retry=RetryPolicy(backoff=0.01))
+        with self.assertRaises(AuthenticationError):
+            p.search("q")
+        stats = self.recorder.stats()["/search"]
+        self.assertEqual((stats["errors"], stats["retries"]), (1, 1))
+
+    def test_hooks(self):
+        latency = FakeMetric()
+        p = self.client()
+        p.conn.instrument = combine(
+            [SpanInstrument(self.tracer), PrometheusInstrument(latency)]
+        )
+        User(p, "uuid").history()
+        span = self.spans[0]
+        self.assertEqual(span.name, "parsely /history")
+        self.assertTrue(span.ended)
+        self.assertIn("parsely.ttfb_ms", span.attributes)
+        self.assertEqual(span.attributes["http.status_code"], 200)
+        phases = [labels["phase"] for labels, _ in latency.observed]
+        self.assertEqual(phases, list(PHASES) + ["total"])
+
+    def test_endpoint_templates(self):
+        p = self.client()
+        p.conn.instrument = combine([self.recorder, SpanInstrument(self.tracer)])
+        p.meta_detail("Ars Staff", aspect="author")
+        p.meta_detail("Jane Doe", aspect="author")
+        p.post_detail("http://example.com/1")
+        self.assertEqual(
+            sorted(self.recorder.stats()),
+            ["/analytics/post/detail", "/analytics/{aspect}/{value}/detail"],
+        )
+        self.assertEqual(
+            self.recorder.stats()["/analytics/{aspect}/{value}/detail"]["count"], 2
+        )
+        span = self.spans[1]
+        self.assertEqual(span.name, "parsely /analytics/{aspect}/{value}/detail")
+        self.assertEqual(
+            span.attributes["parsely.path"], "/analytics/author/Jane Doe/detail"
+        )
+
+    def test_async(self):
+        p = AsyncParsely(
+            "example.com", "secret", root=self.server.root, instrument=self.recorder
+        )
+        asyncio.run(p.analytics())
+        stats = self.recorder.stats()["/analytics/posts"]
+        self.assertEqual(stats["count"], 1)
+        self.assertIn("build", stats["phases"])
+
+    def test_off_by_default(self):
+        p = parsely.Parsely("example.com", "secret", root=self.server.root)
+        self.assertIsNone(p.conn.instrument)
+        self.assertIsNone(p.conn._begin("/analytics/posts"))
+
+
+class TestTrainingPipeline(StandInTestCase):
+    def setUp(self):
+        super(TestTrainingPipeline, self).setUp()
+        self.server.routes["/profile"] = self.profile
+        self.p = parsely.Parsely(
+            "example.com", "secret", root=self.server.root, authenticate=False
+        )
+        self.path = os.path.join(tempfile.mkdtemp(), "train.ckpt")
+
+    def profile(self, args):
+        if args["url"] == "bad":
+            raise RuntimeError("unavailable")
+        return {"success": True}
+
+    def trained(self):
+        return sorted(
+            (args["uuid"], args["url"])
+            for path, args in self.server.requests
+            if path == "/profile"
+        )
+
+    def test_dedup_and_failures(self):
+        results = []
+        events = [("u1", "a"), ("u1", "b"), ("u1", "a"), ("u2", "a"), ("u2", "bad")]
+        pipeline = TrainingPipeline(self.p, workers=3, on_result=results.append)
+        stats = pipeline.run(iter(events))
+        self.assertEqual(
+            self.trained(), [("u1", "a"), ("u1", "b"), ("u2", "a"), ("u2", "bad")]
+        )
+        self.assertEqual(
+            (stats["events"], stats["trained"], stats["failed"], stats["duplicates"]),
+            (5, 3, 1, 1),
+        )
+        by_offset = {r.offset: r for r in results}
+        self.assertTrue(by_offset[2].duplicate)
+        self.assertIsInstance(by_offset[4].error, HTTPError)
+
+    def test_window(self):
+        events = [("u1", "a"), ("u1", "b"), ("u1", "c"), ("u1", "a")]
+        stats = TrainingPipeline(self.p, window=2).run(events)
+        self.assertEqual((stats["trained"], stats["duplicates"]), (4, 0))
+
+    def test_resume(self):
+        events = [("u%d" % i, "http://example.com/%d" % i) for i in range(20)]
+
+        def crash_after(n):
+            for event in events[:n]:
+                yield event
+            raise IOError("stream lost")
+
+        pipeline = TrainingPipeline(self.p, workers=4, checkpoint=self.path)
+        with self.assertRaises(IOError):
+            pipeline.run(crash_after(12))
+        self.assertEqual(TrainingCheckpoint(self.path).offset, 12)
+
+        stats = TrainingPipeline(self.p, workers=4, checkpoint=self.path).run(events)
+        self.assertEqual(stats["trained"], 8)
+        self.assertEqual(self.trained(), sorted(events))
+        checkpoint = TrainingCheckpoint(self.path)
+        self.assertEqual((checkpoint.offset, checkpoint.trained), (20, 20))
+
+
+class TestRecommendationCache(StandInTestCase):
+    def setUp(self):
+        super(TestRecommendationCache, self).setUp()
+        self.server.routes["/profile"] = {"success": True}
+        self.server.routes["/history"] = {
+            "data": {"uuid": "u1", "urls": ["http://example.com/1"]}
+        }
+        self.server.routes["/related"] = {
+            "data": [{"url": "http://example.com/%d" % i} for i in range(1, 5)]
+        }
+        self.p = parsely.Parsely(
+            "example.com", "secret", root=self.server.root, authenticate=False
+        )
+        self.cache = RecommendationCache(max_users=2)
+
+    def paths(self):
+        return [path for path, _ in self.server.requests]
+
+    def urls(self, posts):
+        return [post.url[-1] for post in posts]
+
+    def test_cached_and_filtered(self):
+        user = User(self.p, "u1", cache=self.cache)
+        self.assertEqual(self.urls(user.related()), ["1", "2", "3", "4"])
+        user.history()
+        # served from the cache, without what the visitor has read
+        self.assertEqual(
+            self.urls(User(self.p, "u1", cache=self.cache).related()), ["2", "3", "4"]
+        )
+        self.assertEqual(self.urls(user.related(limit=5)), ["2", "3", "4"])
+        self.assertEqual(user.history()["urls"], ["http://example.com/1"])
+        self.assertEqual(self.paths(), ["/related", "/history", "/related"])
+
+    def test_train_invalidates(self):
+        user = User(self.p, "u1", cache=self.cache)
+        user.history()
+        user.related()
+        user.train("http://example.com/1")
+        user.related()
+        self.assertEqual(self.paths(), ["/history", "/related", "/profile"])
+        user.train("http://example.com/2")
+        self.assertEqual(self.urls(user.related()), ["3", "4"])
+        self.assertEqual(self.paths()[3:], ["/profile", "/related"])
+        self.assertEqual(self.cache.stats()["invalidations"], 1)
+
+    def test_lru(self):
+        for uuid in ("u1", "u2", "u1", "u3"):
+            User(self.p, uuid, cache=self.cache).related()
+        self.assertEqual(self.paths(), ["/related", "/related", "/related"])
+        User(self.p, "u2", cache=self.cache).related()
+        self.assertEqual(len(self.paths()), 4)
+        self.assertEqual(self.cache.stats()["evictions"], 2)
+
+    def test_async(self):
+        user = AsyncUser(
+            AsyncParsely("example.com", "secret", root=self.server.root),
+            "u1",
+            cache=self.cache,
+        )
+
+        async def run():
+            await user.related()
+            return await user.related()
+
+        self.assertEqual(len(asyncio.run(run())), 4)
+        self.assertEqual(self.paths(), ["/related"])
+
+
+class TestLeaderboard(StandInTestCase):
+    def setUp(self):
+        super(TestLeaderboard, self).setUp()
+        self.hits = {"a": 50, "b": 40, "c": 30, "d": 20}
+        self.server.routes["/analytics/posts"] = self.posts
+        self.server.routes["/analytics/authors"] = {
+            "data": [{"author": "Ann", "_hits": 9}, {"author": "Bob", "_hits": 7}]
+        }
+        self.p = parsely.Parsely(
+            "example.com", "secret", root=self.server.root, authenticate=False
+        )
+
+    def posts(self, args):
+        return {
+            "data": [
+                {"url": "http://example.com/" + name, "_hits": hits}
+                for name, hits in sorted(self.hits.items())
+            ]
+        }
+
+    def test_changes(self):
+        received = []
+        board = Leaderboard(self.p, aspects=("posts", "authors"), k=3)
+        board.subscribe(lambda aspect, changes: received.append((aspect, changes)))
+        first = board.poll()
+        self.assertEqual([c.rank for c in first["posts"]], [1, 2, 3])
+        self.assertTrue(all(c.new for c in first["posts"]))
+        self.assertEqual([c.key for c in first["authors"]], ["Ann", "Bob"])
+
+        self.hits["d"] = 45
+        self.hits["a"] = 55
+        changes = board.poll()
+        by_key = {c.key.rsplit("/", 1)[1]: c for c in changes["posts"]}
+        # d overtakes b, pushing c out
+        self.assertEqual(sorted(by_key), ["a", "b", "c", "d"])
+        self.assertEqual((by_key["b"].rank, by_key["b"].delta), (3, 0))
+        self.assertEqual((by_key["a"].delta, by_key["a"].rank), (5, 1))
+        self.assertEqual((by_key["d"].rank, by_key["d"].previous_rank), (2, None))
+        self.assertTrue(by_key["c"].dropped)
+        self.assertGreater(by_key["a"].velocity, 0)
+        self.assertEqual(changes["authors"], [])
+        self.assertEqual(
+            [aspect for aspect, _ in received], ["posts", "authors", "posts"]
+        )
+        self.assertEqual([post.url[-1] for post in board.top("posts")], ["a", "d", "b"])
+
+        self.assertEqual(board.poll()["posts"], [])
+
+    def test_failing_subscriber(self):
+        received = []
+        board = Leaderboard(self.p, aspects=("posts", "authors"), k=3)
+
+        def broken(aspect, changes):
+            raise RuntimeError("push failed")
+
+        board.subscribe(broken)
+        board.subscribe(lambda aspect, changes: received.append(aspect))
+        with self.assertLogs("parsely.leaderboard", "ERROR"):
+            changes = board.poll()
+        self.assertEqual(len(changes["posts"]), 3)
+        self.assertEqual(received, ["posts", "authors"])
+        self.assertEqual((board.polls, board.errors), (1, 0))
+
+    def test_removed(self):
+        board = Leaderboard(self.p, k=2)
+        board.poll()
+        del self.hits["a"]
+        changes = board.poll()["posts"]
+        self.assertEqual(
+            [(c.key[-1], c.rank) for c in changes], [("b", 1), ("c", 2), ("a", None)]
+        )
+
+    def test_async(self):
+        board = Leaderboard(
+            AsyncParsely("example.com", "secret", root=self.server.root),
+            k=2,
+            interval=0.01,
+        )
+
+        async def run():
+            updates = board.updates()
+            first = await updates.__anext__()
+            self.hits["c"] = 100
+            second = await updates.__anext__()
+            await updates.aclose()
+            return first, second
+
+        first, second = asyncio.run(run())
+        self.assertEqual(len(first[1]), 2)
+        self.assertEqual(
+            [(c.key[-1], c.rank) for c in second[1]], [("c", 1), ("a", 2), ("b", None)]
+        )
+
+    def test_async_poll_is_concurrent(self):
+        self.server.delay = 0.2
+        board = Leaderboard(
+            AsyncParsely("example.com", "secret", root=self.server.root),
+            aspects=("posts", "authors", "tags"),
+        )
+        started = time.time()
+        changes = asyncio.run(board.poll_async())
+        self.assertLess(time.time() - started, 0.5)
+        self.assertEqual(sorted(changes), ["authors", "posts", "tags"])
+
+
+class TestServer(StandInTestCase):
+    def fetch_all(self, requests, api=None):
+        import server
+
+        async def run():
+            sockets = tornado.netutil.bind_sockets(0, "127.0.0.1")
+            http_server = tornado.httpserver.HTTPServer(
+                server.get_app(
+                    api or AsyncParsely("example.com", root=self.server.root)
+                )
+            )
+            http_server.add_sockets(sockets)
+            base = "http://127.0.0.1:%d" % sockets[0].getsockname()[1]
+            client = tornado.httpclient.AsyncHTTPClient(force_instance=True)
+            try:
+                responses = []
+                for batch in requests:
+                    responses.append(
+                        await asyncio.gather(
+                            *[
+                                client.fetch(
+                                    base + path,
+                                    headers=headers,
+                                    decompress_response=False,
+                                    raise_error=False,
+                                )
+                                for path, headers in batch
+                            ]
+                        )
+                    )
+                return responses
+            finally:
+                client.close()
+                http_server.stop()
+
+        return asyncio.run(run())
+
+    def test_coalesced_and_cached(self):
+        self.server.delay = 0.05
+        gzipped = {"Accept-Encoding": "gzip"}
+        first, again = self.fetch_all(
+            [
+                [("/analytics/posts?days=3", gzipped)] * 5,
+                [("/analytics/posts?days=3", {})],
+            ]
+        )
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(first[0].headers["Content-Encoding"], "gzip")
+        data = json.loads(gzip.decompress(first[0].body))["data"]
+        self.assertEqual(data[0]["url"], "http://example.com/1")
+        self.assertEqual(data[0]["hits"], 1)
+        self.assertEqual(json.loads(again[0].body)["data"], data)
+        # the same body, but the plain and gzipped encodings are tagged apart
+        self.assertEqual(
+            again[0].headers["Etag"][:-1] + '-gzip"', first[0].headers["Etag"]
+        )
+
+    def test_etag_and_errors(self):
+        (first,) = self.fetch_all([[("/analytics/authors", {})]])
+        etag = first[0].headers["Etag"]
+        (responses,) = self.fetch_all(
+            [
+                [
+                    ("/analytics/authors", {"If-None-Match": etag}),
+                    ("/analytics/authors?bogus=1", {}),
+                    ("/search", {}),
+                ]
+            ]
+        )
+        self.assertEqual([r.code for r in responses], [304, 400, 400])
+        self.assertEqual(
+            json.loads(responses[1].body)["message"], "unknown argument: bogus"
+        )
+
+    def test_upstream_errors(self):
+        self.server.statuses["/analytics/posts"] = 503
+        self.server.routes["/analytics/posts"] = {"code": 503, "message": "busy"}
+        self.server.statuses["/analytics/authors"] = 502
+        self.server.routes["/analytics/authors"] = b"<html>Bad Gateway</html>"
+        self.server.statuses["/search"] = 500
+        (responses,) = self.fetch_all(
+            [
+                [
+                    ("/analytics/posts", {}),
+                    ("/analytics/authors", {}),
+                    ("/search?q=x", {}),
+                    ("/analytics/sections?sort=bogus", {}),
+                ]
+            ]
+        )
+        self.assertEqual([r.code for r in responses], [503, 502, 502, 400])
+        self.assertIn("busy", json.loads(responses[0].body)["message"])
+        # argument errors are caught before anything is sent upstream
+        self.assertNotIn("/analytics/sections", [p for p, _ in self.server.requests])
+
+    def test_encodings(self):
+        (responses,) = self.fetch_all(
+            [
+                [
+                    ("/analytics/posts", {"Accept-Encoding": "gzip, deflate"}),
+                    ("/analytics/posts", {"Accept-Encoding": "gzip;q=0, deflate"}),
+                    ("/analytics/posts", {"Accept-Encoding": "*;q=0.5"}),
+                ]
+            ]
+        )
+        self.assertEqual(
+            [r.headers.get("Content-Encoding") for r in responses],
+            ["gzip", None, "gzip"],
+        )
+        gzipped, plain = responses[0].headers["Etag"], responses[1].headers["Etag"]
+        self.assertNotEqual(gzipped, plain)
+        # a cached plain body is not a cached gzipped one
+        (responses,) = self.fetch_all(
+            [
+                [
+                    (
+                        "/analytics/posts",
+                        {"Accept-Encoding": "gzip", "If-None-Match": plain},
+                    ),
+                    ("/analytics/posts", {"If-None-Match": plain}),
+                ]
+            ]
+        )
+        self.assertEqual([r.code for r in responses], [200, 304])
+
+    def test_unreachable_upstream(self):
+        sock = tornado.netutil.bind_sockets(0, "127.0.0.1")[0]
+        closed = "http://127.0.0.1:%d/v2" % sock.getsockname()[1]
+        sock.close()
+        self.server.delay = 0.5
+        (responses,) = self.fetch_all(
+            [[("/analytics/posts", {})]],
+            api=AsyncParsely("example.com", root=closed),
+        )
+        slow = AsyncParsely(
+            "example.com",
+            root=self.server.root,
+            retry=RetryPolicy(retries=0, read_timeout=0.05),
+        )
+        responses += self.fetch_all([[("/analytics/posts", {})]], api=slow)[0]
+        self.assertEqual([r.code for r in responses], [502, 504])
+
+
+class TestMockAPI(unittest.TestCase):
+    def test_every_endpoint(self):
+        from benchmarks.mockapi import MockAPI
+
+        api = MockAPI(rows=3).start()
+        self.addCleanup(api.stop)
+        p = parsely.Parsely("example.com", "secret", root=api.root, authenticate=False)
+        user = User(p, "u1")
+        calls = [
+            lambda: p.analytics(aspect="posts"),
+            lambda: p.analytics(aspect="authors"),
+            lambda: p.analytics(aspect="sections"),
+            lambda: p.analytics(aspect="tags"),
+            lambda: [p.post_detail("http://example.com/1")],
+            lambda: p.meta_detail("Ars Staff", aspect="author"),
+            lambda: p.referrers(ref_type="social"),
+            lambda: p.referrers_meta(ref_type="search", meta="authors"),
+            lambda: p.referrers_meta_detail("Ars Staff", meta="author"),
+            lambda: p.referrers_post_detail("http://example.com/1"),
+            lambda: p.shares(aspect="posts"),
+            lambda: p.shares(aspect="authors"),
+            lambda: [p.shares(post="http://example.com/1")],
+            lambda: p.related("http://example.com/1"),
+            lambda: p.search("security"),
+            lambda: [user.train("http://example.com/1")],
+            lambda: user.history()["urls"],
+            lambda: user.related(),
+        ]
+        for call in calls:
+            self.assertTrue(call())
+        self.assertEqual((api.requests, api.errors), (len(calls), 0))
+
+
+class TestCallbackPath(StandInTestCase):
+    def test_callback(self):
+        p = parsely.Parsely("example.com", "secret", root=self.server.root)
+        handled = []
+        p.analytics(_callback=handled.append)
+        self.assertEqual(handled[0][0].url, "http://example.com/1")
+
+    def test_error(self):
+        p = parsely.Parsely(
+            "example.com", "secret", root=self.server.root, cache=MemoryCache()
+        )
+        self.server.routes["/search"] = b"<html>Service Unavailable</html>"
+        self.server.statuses["/search"] = 503
+        handled = []
+        for _ in range(2):
+            p.search("q", _callback=handled.append)
+        self.assertEqual([type(r) for r in handled], [HTTPError, HTTPError])
+        self.assertEqual(handled[0].code, 503)
+        # errors are not cached
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_authenticated(self):
+        self.server.statuses["/analytics/posts"] = 403
+        self.server.routes["/analytics/posts"] = {"code": 403, "message": "no"}
+        p = parsely.Parsely(
+            "example.com", "rejected", root=self.server.root, authenticate=False
+        )
+        handled = []
+        self.assertFalse(p.authenticated())
+        p.authenticated(_callback=handled.append)
+        a = AsyncParsely("example.com", "rejected", root=self.server.root)
+        self.assertFalse(asyncio.run(a.authenticated(_callback=handled.append)))
+        self.assertEqual(handled, [False, False])
+
+    def test_retried_on_running_loop(self):
+        p = parsely.Parsely(
+            "example.com",
+            "secret",
+            root=self.server.root,
+            retry=RetryPolicy(backoff=0.01),
+        )
+        failures = []
+
+        def flaky(args):
+            if not failures:
+                failures.append(args)
+                raise RuntimeError("unavailable")
+            return {"data": [{"url": "http://example.com/1", "title": "One"}]}
+
+        self.server.routes["/search"] = flaky
+
+        async def run():
+            done = asyncio.get_running_loop().create_future()
+            p.search("q", _callback=done.set_result)
+            return await done
+
+        self.assertEqual(asyncio.run(run())[0].title, "One")
+        self.assertEqual(p.conn.retry.stats()["retried"], 1)
+
+
+@unittest.skipIf(secrets is None, "live API tests need parsely/secret.py")
 class TestParselyBindings(unittest.TestCase):
     def setUp(self):
         self.apikey = "arstechnica.com"
@@ -0,0 +1,258 @@
+from __future__ import absolute_import
+
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from six.moves import queue
+
+from .recommendations import User
+
+
+class TrainResult(
+    namedtuple("TrainResult", ["offset", "uuid", "url", "result", "error"])
+):
+    """
+    Outcome of one event: `result` is what User.train returned, or None for
+    a repeat that was skipped
+    """
+
+    @property
+    def ok(self):
+        return self.error is None and self.result is not False
+
+    @property
+    def duplicate(self):
+        return self.error is None and self.result is None
+
+
+class TrainingCheckpoint(object):
+    """
+    Progress of a TrainingPipeline, persisted as JSON
+
+    `offset` is the number of events, from the start of the stream, that
+    have all been handled. The file is replaced atomically on every save.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.trained = 0
+        self.failed = 0
+        self.duplicates = 0
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.offset = data.get("offset", 0)
+            self.trained = data.get("trained", 0)
+            self.failed = data.get("failed", 0)
+            self.duplicates = data.get("duplicates", 0)
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".training-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(
+                    {
+                        "offset": self.offset,
+                        "trained": self.trained,
+                        "failed": self.failed,
+                        "duplicates": self.duplicates,
+                    },
+                    f,
+                    sort_keys=True,
+                )
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+
+class TrainingPipeline(object):
+    """
+    Train user profiles from a stream of (uuid, url) events
+
+    Events are read from the stream in the calling thread and handed to
+    `workers` threads, each calling User.train, through a queue holding at
+    most `queue_size` of them: once it is full, reading waits for the
+    workers, so a fast stream never runs ahead of the API. An event repeating
+    one of the last `window` distinct events is skipped.
+
+    Every event's TrainResult is passed to `on_result`, from the worker
+    thread that handled it. With a `checkpoint` (a TrainingCheckpoint or the
+    path of its file) progress is saved every `checkpoint_every` events and
+    when the run ends, and a later run over the same stream skips the events
+    already handled.
+
+        >>> pipeline = TrainingPipeline(p, workers=16, checkpoint="train.ckpt")
+        >>> pipeline.run(read_clickstream())
+        {'events': ..., 'trained': ..., 'per_second': ...}
+    """
+
+    def __init__(
+        self,
+        client,
+        workers=8,
+        queue_size=None,
+        window=10000,
+        checkpoint=None,
+        checkpoint_every=1000,
+        on_result=None,
+    ):
+        if checkpoint is not None and not isinstance(checkpoint, TrainingCheckpoint):
+            checkpoint = TrainingCheckpoint(checkpoint)
+        self.client = client
+        self.workers = workers
+        self.queue_size = queue_size if queue_size else 4 * workers
+        self.window = window
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
+        self.on_result = on_result
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._seen = OrderedDict()
+        self._completed = set()
+        self._offset = 0
+        self._base = (0, 0, 0)
+        if self.checkpoint is not None:
+            # totals in the checkpoint carry over from earlier runs
+            self._offset = self.checkpoint.offset
+            self._base = (
+                self.checkpoint.trained,
+                self.checkpoint.failed,
+                self.checkpoint.duplicates,
+            )
+        self._since_save = 0
+        self._stopping = False
+        self.events = 0
+        self.trained = 0
+        self.failed = 0
+        self.duplicates = 0
+        self.started = time.time()
+
+    def run(self, events):
+        """
+        Train every event of `events` past the checkpoint and return `stats`
+
+        If reading the stream fails, the events already read are trained
+        before the error is raised; if the run is interrupted (e.g. by
+        KeyboardInterrupt) they are dropped. Either way the checkpoint is
+        saved, and the next run starts again with the first event not yet
+        handled.
+        """
+        self._reset()
+        pending = queue.Queue(self.queue_size)
+        threads = [
+            threading.Thread(target=self._work, args=(pending,))
+            for _ in range(self.workers)
+        ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            stream = itertools.islice(events, self._offset, None)
+            for offset, (uuid, url) in enumerate(stream, self._offset):
+                with self._lock:
+                    self.events += 1
+                if self._repeat(uuid, url):
+                    self._finish(TrainResult(offset, uuid, url, None, None))
+                else:
+                    pending.put((offset, uuid, url))
+        except (KeyboardInterrupt, SystemExit):
+            # drop what is queued; the next run retries it
+            self._stopping = True
+            raise
+        finally:
+            for _ in threads:
+                pending.put(None)
+            for thread in threads:
+                thread.join()
+            self._save()
+        return self.stats()
+
+    def stats(self):
+        """
+        Return event counts so far and the events handled per second
+        """
+        with self._lock:
+            done = self.trained + self.failed + self.duplicates
+            elapsed = max(time.time() - self.started, 1e-9)
+            return {
+                "events": self.events,
+                "trained": self.trained,
+                "failed": self.failed,
+                "duplicates": self.duplicates,
+                "in_flight": self.events - done,
+                "offset": self._offset,
+                "seconds": elapsed,
+                "per_second": done / elapsed,
+            }
+
+    def _repeat(self, uuid, url):
+        key = (uuid, url)
+        if key in self._seen:
+            self._seen.move_to_end(key)
+            return True
+        self._seen[key] = None
+        if len(self._seen) > self.window:
+            self._seen.popitem(last=False)
+        return False
+
+    def _work(self, pending):
+        while True:
+            event = pending.get()
+            if event is None:
+                return
+            if self._stopping:
+                # left for the next run, which resumes before it
+                continue
+            offset, uuid, url = event
+            try:
+                result = TrainResult(
+                    offset, uuid, url, User(self.client, uuid).train(url), None
+                )
+            except Exception as e:
+                result = TrainResult(offset, uuid, url, None, e)
+            self._finish(result)
+
+    def _finish(self, result):
+        with self._lock:
+            if result.duplicate:
+                self.duplicates += 1
+            elif result.ok:
+                self.trained += 1
+            else:
+                self.failed += 1
+            # the checkpoint offset only moves past events handled in order
+            self._completed.add(result.offset)
+            while self._offset in self._completed:
+                self._completed.remove(self._offset)
+                self._offset += 1
+            self._since_save += 1
+            save = self._since_save >= self.checkpoint_every
+            if save:
+                self._since_save = 0
+        if self.on_result is not None:
+            self.on_result(result)
+        if save:
+            self._save()
+
+    def _save(self):
+        if self.checkpoint is None:
+            return
+        with self._save_lock:
+            with self._lock:
+                trained, failed, duplicates = self._base
+                self.checkpoint.offset = self._offset
+                self.checkpoint.trained = trained + self.trained
+                self.checkpoint.failed = failed + self.failed
+                self.checkpoint.duplicates = duplicates + self.duplicates
+            self.checkpoint.save()
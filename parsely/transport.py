@@ -0,0 +1,394 @@
+from __future__ import absolute_import
+
+import socket
+import threading
+import time
+import weakref
+import zlib
+from collections import deque
+from contextlib import contextmanager
+
+from six.moves import http_client
+from six.moves.urllib.parse import urljoin, urlsplit
+
+USER_AGENT = "python-parsely"
+# as many redirects as Tornado follows by default
+MAX_REDIRECTS = 5
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+
+class TransportResponse(object):
+    """
+    `timings` holds whichever of the "connect", "ttfb" and "transfer" phases
+    the transport measured, in seconds
+    """
+
+    def __init__(self, code, body, headers=None, reused=False, timings=None):
+        self.code = code
+        self.body = body
+        self.headers = headers if headers else {}
+        self.reused = reused
+        self.timings = timings if timings else {}
+
+
+class Transport(object):
+    """
+    Base class for the HTTP layer underneath ParselyAPIConnection
+
+    Subclasses implement `fetch`, which performs a GET and returns a
+    TransportResponse, giving up with a socket.timeout if connecting or
+    reading takes longer than the timeouts passed in. Asynchronous transports
+    return a coroutine instead. Transports that can stream also implement
+    `stream`, which first yields a TransportResponse with the status and
+    headers but no body, then the body in chunks as it arrives.
+    """
+
+    def fetch(self, url, connect_timeout=None, read_timeout=None):
+        raise NotImplementedError
+
+    def stream(self, url, chunk_size=65536, connect_timeout=None, read_timeout=None):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+class PooledTransport(Transport):
+    """
+    Blocking transport that keeps HTTP/1.1 keep-alive connections open between
+    requests
+
+    At most `max_per_host` requests are in flight to any one host; callers past
+    that limit wait for a slot. Up to `max_idle` idle sockets are kept around
+    overall, and sockets idle for longer than `idle_timeout` seconds are
+    discarded instead of being reused.
+
+    Like AsyncTransport, it follows up to MAX_REDIRECTS redirects and asks for
+    gzipped bodies, handing them back decompressed.
+    """
+
+    def __init__(self, max_per_host=10, max_idle=10, idle_timeout=60.0, timeout=None):
+        self.max_per_host = max_per_host
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._slots = {}
+        self._open = 0
+        self._hits = 0
+        self._misses = 0
+
+    def fetch(self, url, connect_timeout=None, read_timeout=None):
+        timings = {}
+        timeouts = (connect_timeout, read_timeout)
+        with self._request(url, timeouts, timings) as (response, reused):
+            started = time.perf_counter()
+            body = response.read()
+            headers, gunzip = _decoded_headers(response)
+            if gunzip:
+                body = gunzip.decompress(body) + gunzip.flush()
+            timings["transfer"] = time.perf_counter() - started
+        return TransportResponse(
+            response.status, body, headers, reused=reused, timings=timings
+        )
+
+    def stream(self, url, chunk_size=65536, connect_timeout=None, read_timeout=None):
+        timeouts = (connect_timeout, read_timeout)
+        with self._request(url, timeouts) as (response, reused):
+            headers, gunzip = _decoded_headers(response)
+            yield TransportResponse(response.status, None, headers, reused=reused)
+            while True:
+                chunk = response.read1(chunk_size)
+                if not chunk:
+                    break
+                if gunzip:
+                    chunk = gunzip.decompress(chunk)
+                if chunk:
+                    yield chunk
+            if gunzip:
+                chunk = gunzip.flush()
+                if chunk:
+                    yield chunk
+
+    @contextmanager
+    def _request(self, url, timeouts=(None, None), timings=None):
+        for redirects in range(MAX_REDIRECTS, -1, -1):
+            with self._exchange(url, timeouts, timings) as (response, reused):
+                location = response.getheader("Location")
+                if not (redirects and location and response.status in REDIRECT_CODES):
+                    yield response, reused
+                    return
+                # read the redirect's body so its connection can be reused
+                response.read()
+            url = urljoin(url, location)
+
+    @contextmanager
+    def _exchange(self, url, timeouts, timings):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path + ("?" + parts.query if parts.query else "")
+
+        with self._host_slot(key):
+            conn, reused = self._checkout(key)
+            try:
+                response = self._send(conn, path, parts.netloc, timeouts, timings)
+            except (http_client.HTTPException, socket.error):
+                self._discard(conn)
+                if not reused:
+                    raise
+                # the server closed a kept-alive socket under us; retry once on a
+                # fresh connection
+                conn, reused = self._connect(key), False
+                try:
+                    response = self._send(conn, path, parts.netloc, timeouts, timings)
+                except (http_client.HTTPException, socket.error):
+                    self._discard(conn)
+                    raise
+
+            try:
+                yield response, reused
+            except BaseException:
+                # the body may be partly unread, so the socket can't be reused
+                self._discard(conn)
+                raise
+            if response.will_close or not response.isclosed():
+                self._discard(conn)
+            else:
+                self._checkin(key, conn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "open": self._open,
+                "idle": sum(len(conns) for conns in self._idle.values()),
+            }
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn, _ in conns:
+                self._discard(conn)
+
+    def _send(self, conn, path, host, timeouts, timings=None):
+        connect_timeout, read_timeout = timeouts
+        started = time.perf_counter()
+        if conn.sock is None:
+            conn.timeout = self.timeout if connect_timeout is None else connect_timeout
+            conn.connect()
+        connected = time.perf_counter()
+        conn.sock.settimeout(self.timeout if read_timeout is None else read_timeout)
+        conn.request(
+            "GET",
+            path,
+            headers={
+                "Host": host,
+                "Connection": "keep-alive",
+                "User-Agent": USER_AGENT,
+                "Accept-Encoding": "gzip",
+            },
+        )
+        response = conn.getresponse()
+        if timings is not None:
+            timings["connect"] = connected - started
+            timings["ttfb"] = time.perf_counter() - connected
+        return response
+
+    def _host_slot(self, key):
+        with self._lock:
+            if key not in self._slots:
+                self._slots[key] = threading.BoundedSemaphore(self.max_per_host)
+            return self._slots[key]
+
+    def _checkout(self, key):
+        now = time.time()
+        stale = []
+        conn = None
+        with self._lock:
+            conns = self._idle.get(key)
+            while conns:
+                candidate, since = conns.pop()
+                if now - since < self.idle_timeout:
+                    conn = candidate
+                    self._hits += 1
+                    break
+                stale.append(candidate)
+        for candidate in stale:
+            self._discard(candidate)
+        if conn is not None:
+            return conn, True
+        return self._connect(key), False
+
+    def _connect(self, key):
+        scheme, host, port = key
+        if scheme == "https":
+            import ssl
+
+            conn = http_client.HTTPSConnection(
+                host,
+                port,
+                timeout=self.timeout,
+                context=ssl.create_default_context(),
+            )
+        else:
+            conn = http_client.HTTPConnection(host, port, timeout=self.timeout)
+        with self._lock:
+            self._misses += 1
+            self._open += 1
+        return conn
+
+    def _checkin(self, key, conn):
+        evicted = None
+        with self._lock:
+            self._idle.setdefault(key, deque()).append((conn, time.time()))
+            if sum(len(conns) for conns in self._idle.values()) > self.max_idle:
+                oldest = min(
+                    (conns for conns in self._idle.values() if conns),
+                    key=lambda conns: conns[0][1],
+                )
+                evicted = oldest.popleft()[0]
+        if evicted is not None:
+            self._discard(evicted)
+
+    def _discard(self, conn):
+        conn.close()
+        with self._lock:
+            self._open -= 1
+
+
+class AsyncTransport(Transport):
+    """
+    Non-blocking transport built on Tornado's AsyncHTTPClient, which is
+    imported on first use
+
+    `fetch` is a coroutine and can be awaited from any running asyncio loop.
+    Each loop gets its own client, with at most `max_clients` requests in
+    flight at a time.
+    """
+
+    def __init__(self, max_clients=10, validate_cert=True):
+        self.max_clients = max_clients
+        self.validate_cert = validate_cert
+        self._slots = weakref.WeakKeyDictionary()
+
+    async def fetch(self, url, connect_timeout=None, read_timeout=None):
+        from tornado.httpclient import AsyncHTTPClient
+        from tornado.simple_httpclient import HTTPStreamClosedError, HTTPTimeoutError
+
+        async with self._slot():
+            try:
+                response = await AsyncHTTPClient().fetch(
+                    url,
+                    method="GET",
+                    validate_cert=self.validate_cert,
+                    user_agent=USER_AGENT,
+                    raise_error=False,
+                    connect_timeout=connect_timeout,
+                    request_timeout=read_timeout,
+                )
+            except HTTPTimeoutError as e:
+                raise socket.timeout(str(e)) from e
+            except HTTPStreamClosedError as e:
+                raise ConnectionError(str(e)) from e
+        return TransportResponse(
+            response.code,
+            response.body,
+            dict(response.headers),
+            timings=_curl_timings(response.time_info),
+        )
+
+    async def stream(
+        self, url, chunk_size=None, connect_timeout=None, read_timeout=None
+    ):
+        import asyncio
+
+        from tornado.httpclient import AsyncHTTPClient
+        from tornado.httputil import HTTPHeaders, parse_response_start_line
+        from tornado.simple_httpclient import HTTPStreamClosedError, HTTPTimeoutError
+
+        chunks = asyncio.Queue()
+        head = {"headers": HTTPHeaders()}
+
+        def on_header(line):
+            if line.startswith("HTTP/"):
+                head["code"] = parse_response_start_line(line.strip()).code
+                head["headers"] = HTTPHeaders()
+            elif line.strip():
+                head["headers"].parse_line(line)
+            elif not 300 <= head["code"] < 400:
+                # the end of the headers of a response that isn't a redirect
+                head["sent"] = True
+                chunks.put_nowait(
+                    TransportResponse(head["code"], None, dict(head["headers"]))
+                )
+
+        async with self._slot():
+            fetch = asyncio.ensure_future(
+                AsyncHTTPClient().fetch(
+                    url,
+                    method="GET",
+                    validate_cert=self.validate_cert,
+                    user_agent=USER_AGENT,
+                    raise_error=False,
+                    connect_timeout=connect_timeout,
+                    request_timeout=read_timeout,
+                    header_callback=on_header,
+                    streaming_callback=chunks.put_nowait,
+                )
+            )
+            fetch.add_done_callback(lambda _: chunks.put_nowait(None))
+            while True:
+                chunk = await chunks.get()
+                if chunk is None:
+                    break
+                yield chunk
+            try:
+                response = await fetch
+            except HTTPTimeoutError as e:
+                raise socket.timeout(str(e)) from e
+            except HTTPStreamClosedError as e:
+                raise ConnectionError(str(e)) from e
+            if "sent" not in head:
+                yield TransportResponse(response.code, None, dict(response.headers))
+
+    def _slot(self):
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        if loop not in self._slots:
+            self._slots[loop] = asyncio.Semaphore(self.max_clients)
+        return self._slots[loop]
+
+
+def _decoded_headers(response):
+    """
+    Return the headers of an http.client response as a dict and, if its body is
+    gzipped, a decompressor for it
+
+    Content-Encoding is renamed to X-Consumed-Content-Encoding, as Tornado does
+    for the bodies it decompresses.
+    """
+    headers = dict(response.getheaders())
+    for name in list(headers):
+        if name.lower() == "content-encoding" and headers[name].lower() == "gzip":
+            headers["X-Consumed-Content-Encoding"] = headers.pop(name)
+            return headers, zlib.decompressobj(16 + zlib.MAX_WBITS)
+    return headers, None
+
+
+def _curl_timings(info):
+    # curl_httpclient reports cumulative times; simple_httpclient reports none
+    if "starttransfer" not in info:
+        return {}
+    return {
+        "connect": info["connect"],
+        "ttfb": info["starttransfer"] - info["connect"],
+        "transfer": info["total"] - info["starttransfer"],
+    }
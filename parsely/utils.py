@@ -1,11 +1,22 @@
 from __future__ import absolute_import
 
-import json
+import copy
+import functools
+import time
 
 from six.moves.urllib.parse import quote, urlencode
 
-import tornado.gen
-from tornado.httpclient import HTTPClient, AsyncHTTPClient
+from .batch import iter_batch
+from .cache import TTLPolicy, request_key
+from .coalesce import SingleFlight
+from .codec import get_codec
+from .errors import AuthenticationError, HTTPError
+from .instrument import CallRecord, combine
+from .jsonstream import ArrayItemParser
+from .pagination import paginate
+from .refresh import Refresher
+from .sharding import query_shards
+from .transport import PooledTransport
 
 
 class BaseParselyClient(object):
@@ -45,16 +56,185 @@ class BaseParselyClient(object):
     def _require_both(self, first, second):
         return bool(first) != bool(second)
 
-    def _build_callback(self, datafunc, _callback=None):
+    def batch(self, calls, max_concurrency=10):
+        """
+        Run many calls concurrently and return a BatchResult for each, in order
+
+            >>> p.batch([call("post_detail", url) for url in urls])
+        """
+        return list(iter_batch(self, calls, max_concurrency=max_concurrency))
+
+    def iter_batch(self, calls, max_concurrency=10, ordered=False):
+        """
+        Like `batch`, but yields each BatchResult as soon as it is available
+        """
+        return iter_batch(self, calls, max_concurrency=max_concurrency, ordered=ordered)
+
+    def paginate(self, method, *args, prefetch=2, max_items=None, **kwargs):
+        """
+        Iterate over every item of a paged method, reading `prefetch` pages ahead
+
+            >>> for post in p.paginate("analytics", limit=100, max_items=5000):
+            ...     pass
+        """
+        return paginate(
+            self, method, *args, prefetch=prefetch, max_items=max_items, **kwargs
+        )
+
+    def sharded(self, method, start, end, shard="day", max_concurrency=8, **kwargs):
+        """
+        Split a long start..end query into day or week shards, run them
+        concurrently and merge the results into one list ranked by hits (or
+        by the `sort` metric), summing hits and metrics per url or name
+
+            >>> p.sharded("analytics", start, end, shard="week", limit=100,
+            ...           progress=lambda done, total, shard: print(done, total))
+        """
+        return query_shards(
+            self,
+            method,
+            start,
+            end,
+            shard=shard,
+            max_concurrency=max_concurrency,
+            **kwargs
+        )
+
+    def _call(self, endpoint, options, datafunc, _callback=None):
+        cached = self._from_cache(endpoint, options)
+        if cached is not None:
+            if not _callback:
+                return cached
+            _callback(cached)
+            return None
+        record = self.conn._begin(endpoint)
+        handler = self._build_callback(datafunc, _callback, record)
+        try:
+            res = self.conn._request_endpoint(
+                endpoint,
+                options,
+                _callback=handler if _callback else None,
+                record=record,
+            )
+            return handler(res) if not _callback else None
+        except Exception as e:
+            self.conn._end(record, e)
+            raise
+
+    def _from_cache(self, endpoint, options):
+        """
+        Return the result of a call answered without a request, or None
+        """
+        return None
+
+    def _describe(self, method, *args, **kwargs):
+        """
+        Return the (endpoint, options) pair a method call would request,
+        without making the request
+        """
+        return self._describe_call(method, *args, **kwargs)[:2]
+
+    def _describe_call(self, method, *args, **kwargs):
+        spec = copy.copy(self)
+        spec._call = lambda endpoint, options, datafunc, _callback=None: (
+            endpoint,
+            options,
+            datafunc,
+        )
+        return getattr(spec, method)(*args, **kwargs)
+
+    def stream(self, method, *args, **kwargs):
+        """
+        Like calling `method`, but yield each result as soon as it has been
+        received and decoded, without buffering the whole response
+
+            >>> for post in p.stream("analytics", limit=5000):
+            ...     pass
+
+        Streamed requests bypass the cache.
+        """
+        endpoint, options, datafunc = self._describe_call(method, *args, **kwargs)
+        for item in self.conn._stream_endpoint(endpoint, options):
+            yield _build_item(datafunc, item)
+
+    def pin(self, method, *args, interval=60, **kwargs):
+        """
+        Keep the cached response of a method call warm, e.g.
+        p.pin("analytics", aspect="authors", interval=30)
+        """
+        endpoint, options = self._describe(method, *args, **kwargs)
+        return self.conn.pin(endpoint, options, interval=interval)
+
+    def with_policy(self, policy):
+        """
+        Return a copy of this client whose requests follow `policy`, a
+        RetryPolicy, e.g. p.with_policy(RetryPolicy(deadline=2)).analytics()
+
+        The copy shares this client's connection pool, cache and limits.
+        """
+        client = copy.copy(self)
+        client.conn = copy.copy(self.conn)
+        client.conn.retry = policy
+        return client
+
+    def _build_callback(self, datafunc, _callback=None, record=None):
         def handle(res):
-            res = datafunc(res)
             if not _callback:
+                res = self.conn._construct(record, datafunc, res)
+                self.conn._end(record)
                 return res
+            # a callback is given the exception of a failed call instead
+            if not isinstance(res, Exception):
+                try:
+                    res = self.conn._construct(record, datafunc, res)
+                except Exception as e:
+                    res = e
+            self.conn._end(record, res if isinstance(res, Exception) else None)
             _callback(res)
 
         return handle
 
 
+def _build_item(datafunc, item):
+    # run a response handler over a single streamed element of "data"
+    res = datafunc({"data": [item]})
+    return res[0] if isinstance(res, list) else res
+
+
+def _open(chunks):
+    # a transport stream starts with the response, without its body
+    response = next(chunks)
+    if 200 <= response.code < 300:
+        response.body = chunks
+    else:
+        response.body = b"".join(chunks)
+    return response
+
+
+def _stream_started(response, record):
+    if record is not None:
+        record.status, record.bytes = response.code, 0
+
+
+def _stream_read(chunk, record):
+    if record is not None:
+        record.bytes += len(chunk)
+
+
+def _error_fields(response, codec):
+    # error bodies are usually JSON, but may be a proxy's HTML page
+    try:
+        fields = codec.loads(response.body)
+    except ValueError:
+        return {}
+    return fields if isinstance(fields, dict) else {}
+
+
+def _healthy(response):
+    # throttling and server errors count against the concurrency limit
+    return response.code != 429 and response.code < 500
+
+
 def valid_kwarg(aspects, arg_name=""):
     allowed_metrics = [
         "views",
@@ -81,6 +261,7 @@ def valid_kwarg(aspects, arg_name=""):
     ]
 
     def _valid_aspect(func):
+        @functools.wraps(func)
         def inner(*args, **kwargs):
             name = arg_name if arg_name else "aspect"
             if name in list(kwargs.keys()) and kwargs[name] not in aspects:
@@ -119,14 +300,42 @@ def is_loop_running(loop):
         )
 
 
+# whether the API accepted each (apikey, secret) pair, for the process lifetime
+_credentials = {}
+
+
 class ParselyAPIConnection(object):
-    def __init__(self, apikey, secret=None, root=None):
+    def __init__(
+        self,
+        apikey,
+        secret=None,
+        root=None,
+        transport=None,
+        cache=None,
+        ttl_policy=None,
+        coalesce=True,
+        codec=None,
+        limiter=None,
+        concurrency=None,
+        retry=None,
+        instrument=None,
+    ):
         self.rooturl = root if root else "http://api.parsely.com/v2"
         self.apikey = apikey
         self.secret = secret
+        self.transport = transport if transport else PooledTransport()
+        self.cache = cache
+        self.ttl_policy = ttl_policy if ttl_policy else TTLPolicy()
+        self.flights = SingleFlight() if coalesce else None
+        self.refresher = Refresher(self)
+        self.codec = get_codec(codec)
+        self.limiter = limiter
+        self.concurrency = concurrency
+        self.retry = retry
+        self.instrument = combine(instrument)
 
-    def _request_endpoint(self, endpoint, options={}, _callback=None):
-        url = "{root}{endpoint}?apikey={apikey}&secret={secret}&{query}".format(
+    def _build_url(self, endpoint, options):
+        return "{root}{endpoint}?apikey={apikey}&secret={secret}&{query}".format(
             root=self.rooturl,
             endpoint=quote(endpoint),
             apikey=self.apikey,
@@ -134,33 +343,310 @@ class ParselyAPIConnection(object):
             query=urlencode({k: v for k, v in options.items() if v}),
         )
 
+    def _cache_key(self, endpoint, options):
+        """
+        Return the cache key and TTL for a request, or (None, 0) if it should
+        not be cached
+        """
+        if self.cache is None:
+            return None, 0
+        ttl = self.ttl_policy.ttl(endpoint, options)
+        if not ttl:
+            return None, 0
+        return (
+            request_key(self.rooturl, self.apikey, endpoint, options, self.secret),
+            ttl,
+        )
+
+    def _cache_lookup(self, key, ttl):
+        """
+        Return the cached entry for `key` and whether it is past its TTL
+        """
+        entry = self.cache.get(key) if key else None
+        return entry, entry is not None and time.time() - entry.created >= ttl
+
+    def _cache_store(self, key, ttl, response):
+        if key is not None and response.code == 200:
+            self.cache.set(key, response.body, ttl + self.ttl_policy.stale)
+
+    def pin(self, endpoint, options, interval=60):
+        """
+        Keep the cached response for a request warm by refetching it every
+        `interval` seconds in the background. Returns a key for `unpin`.
+        """
+        if self.cache is None:
+            raise ValueError("pinning queries requires a cache")
+        return self.refresher.pin(endpoint, options, interval)
+
+    def unpin(self, key):
+        self.refresher.unpin(key)
+
+    def _load(self, endpoint, options, record=None):
+        """
+        Fetch a request from the API, coalesced with identical requests in
+        flight, and store the response in the cache
+        """
+        key, ttl = self._cache_key(endpoint, options)
+        url = self._build_url(endpoint, options)
+        if self.flights is None:
+            return self._fetch(endpoint, url, key, ttl, record)
+        js = self.flights.do(
+            self._flight_key(endpoint, options),
+            lambda: self._fetch(endpoint, url, key, ttl, record),
+        )
+        if record is not None and not record.attempts:
+            record.coalesced = True
+        return js
+
+    def _flight_key(self, endpoint, options):
+        return request_key(self.rooturl, self.apikey, endpoint, options, self.secret)
+
+    def _request_endpoint(self, endpoint, options={}, _callback=None, record=None):
+        key, ttl = self._cache_key(endpoint, options)
+        entry, stale = self._cache_lookup(key, ttl)
+        if stale:
+            self.refresher.revalidate(key, lambda: self._load(endpoint, options))
+        if record is not None and key is not None:
+            record.cache = "miss" if entry is None else "stale" if stale else "hit"
+        if entry is not None:
+            js = self._decode_cached(entry, record)
+            if _callback:
+                _callback(js)
+                return None
+            return js
+
         if _callback:
+            # Tornado is only needed here, so it isn't imported up front
+            import tornado.ioloop
 
-            def __callback(response):
-                result = json.loads(response.body)
-                _callback(result)
-                self._end_request_handler()
+            io_loop = tornado.ioloop.IOLoop.instance()
+            # a loop started here runs until this request ends
+            owned = not is_loop_running(io_loop)
 
-            AsyncHTTPClient().fetch(url, __callback, method="GET", validate_cert=True)
-            self._should_stop_ioloop_on_finish = True
-            if is_loop_running(tornado.ioloop.IOLoop.instance()):
-                self._should_stop_ioloop_on_finish = False
-            else:
-                tornado.ioloop.IOLoop.instance().start()
+            def __callback(future):
+                # failures are handed to the callback in place of a result
+                error = future.exception()
+                try:
+                    _callback(future.result() if error is None else error)
+                finally:
+                    if owned:
+                        io_loop.stop()
+
+            # the blocking request runs on a worker thread, through the same
+            # transport, retries and checks as any other call
+            io_loop.add_future(
+                io_loop.run_in_executor(None, self._load, endpoint, options, record),
+                __callback,
+            )
+            if owned:
+                io_loop.start()
             return None
+
+        return self._load(endpoint, options, record)
+
+    def _stream_endpoint(self, endpoint, options={}):
+        """
+        Yield the elements of a response's "data" as they are decoded, after
+        the same rate limit, concurrency limit, retries and status checks as
+        any other request. Only opening the response is retried.
+        """
+        record = self._begin(endpoint)
+        url = self._build_url(endpoint, options)
+        try:
+            if self.retry is None:
+                response = self._open_stream(endpoint, url, record=record)
+            else:
+                response = self.retry.run(
+                    endpoint,
+                    lambda connect_timeout, read_timeout: self._open_stream(
+                        endpoint, url, connect_timeout, read_timeout, record
+                    ),
+                    hedge=False,
+                )
+            if not 200 <= response.code < 300:
+                self._decode(response, record)
+            _stream_started(response, record)
+            parser = ArrayItemParser("data")
+            try:
+                for chunk in response.body:
+                    _stream_read(chunk, record)
+                    for item in parser.feed(chunk):
+                        yield item
+            finally:
+                response.body.close()
+            for item in parser.close():
+                yield item
+            self._check_stream(parser)
+        except Exception as e:
+            self._end(record, e)
+            raise
+        finally:
+            self._end(record)
+
+    def _open_stream(
+        self, endpoint, url, connect_timeout=None, read_timeout=None, record=None
+    ):
+        """
+        Like `_attempt`, but return the response as soon as its headers have
+        arrived, with the body as an iterator over its chunks. Error bodies
+        are read in full, to be retried or decoded like any other. The
+        concurrency slot is released once the headers arrive, so a slow
+        reader doesn't hold back other requests.
+        """
+        if record is not None:
+            record.attempts += 1
+        if self.limiter is not None:
+            self.limiter.acquire(self.apikey, endpoint)
+        chunks = self.transport.stream(
+            url, connect_timeout=connect_timeout, read_timeout=read_timeout
+        )
+        if self.concurrency is None:
+            return _open(chunks)
+        self.concurrency.acquire()
+        started, ok = time.time(), False
+        try:
+            ret = _open(chunks)
+            ok = _healthy(ret)
+        finally:
+            self.concurrency.release(time.time() - started, ok)
+        return ret
+
+    def _check_stream(self, parser):
+        """
+        Raise for a streamed response that was an error, or had no data
+        """
+        fields = parser.fields
+        code = fields.get("code")
+        if code == 403:
+            self.remember_credentials(False)
+            raise AuthenticationError(
+                fields.get("message") or "Authentication failed for %s" % self.apikey
+            )
+        if isinstance(code, int) and code >= 400:
+            raise HTTPError(code, fields.get("message"))
+        if not parser.found:
+            raise ValueError(
+                "Response has no data: %s %s"
+                % (fields.get("code", ""), fields.get("message", ""))
+            )
+        self.remember_credentials(True)
+
+    def _fetch(self, endpoint, url, key, ttl, record=None):
+        if self.retry is None:
+            ret = self._attempt(endpoint, url, record=record)
         else:
-            ret = HTTPClient().fetch(url, method="GET", validate_cert=True)
+            ret = self.retry.run(
+                endpoint,
+                lambda connect_timeout, read_timeout, hedge=False: self._attempt(
+                    endpoint, url, connect_timeout, read_timeout, record, hedge
+                ),
+            )
+        js = self._decode(ret, record)
+        self._cache_store(key, ttl, ret)
+        return js
 
-        js = json.loads(ret.body)
+    def _decode(self, response, record=None):
+        """
+        Decode a response body, raising AuthenticationError if the API
+        rejected the credentials and HTTPError for any other error, and
+        remember whether it accepted them
+        """
+        if record is not None:
+            record.status, record.bytes = response.code, len(response.body or b"")
+            for phase, seconds in response.timings.items():
+                setattr(record, phase, seconds)
+            started = time.perf_counter()
+        ok = 200 <= response.code < 300
+        js = (
+            self.codec.loads(response.body)
+            if ok
+            else _error_fields(response, self.codec)
+        )
+        if record is not None:
+            record.decode = time.perf_counter() - started
+        code = js.get("code") if isinstance(js, dict) else None
+        if response.code == 403 or code == 403:
+            self.remember_credentials(False)
+            raise AuthenticationError(
+                js.get("message") or "Authentication failed for %s" % self.apikey
+            )
+        if not ok:
+            raise HTTPError(response.code, js.get("message"))
+        if isinstance(code, int) and code >= 400:
+            raise HTTPError(code, js.get("message"))
+        if response.code == 200:
+            self.remember_credentials(True)
         return js
 
-    def _end_request_handler(self):
+    def credentials_ok(self):
         """
-        Helper, called once an asynchronous request ends
+        Return whether the API accepted this key and secret, or None if no
+        request has told yet. Known for the life of the process.
+        """
+        return _credentials.get((self.apikey, self.secret))
 
-        Stops the IOLoop that was started when the async request was
-        initialized
+    def remember_credentials(self, ok):
+        _credentials[(self.apikey, self.secret)] = ok
 
+    def _decode_cached(self, entry, record=None):
+        if record is None:
+            return self.codec.loads(entry.value)
+        record.bytes = len(entry.value)
+        started = time.perf_counter()
+        js = self.codec.loads(entry.value)
+        record.decode = time.perf_counter() - started
+        return js
+
+    def _begin(self, endpoint):
+        """
+        Start the CallRecord of a call, or return None if the connection
+        isn't instrumented
         """
-        if self._should_stop_ioloop_on_finish:
-            tornado.ioloop.IOLoop.instance().stop()
+        if self.instrument is None:
+            return None
+        record = CallRecord(endpoint)
+        record.token = self.instrument.start(record)
+        return record
+
+    def _construct(self, record, datafunc, res):
+        # build the call's models from the decoded response, timing it
+        if record is None:
+            return datafunc(res)
+        started = time.perf_counter()
+        res = datafunc(res)
+        record.build = time.perf_counter() - started
+        return res
+
+    def _end(self, record, error=None):
+        if record is None or record.total is not None:
+            return
+        record.total = time.perf_counter() - record.started
+        record.error = error
+        self.instrument.finish(record, record.token)
+
+    def _attempt(
+        self,
+        endpoint,
+        url,
+        connect_timeout=None,
+        read_timeout=None,
+        record=None,
+        hedge=False,
+    ):
+        if record is not None:
+            if hedge:
+                record.hedged += 1
+            else:
+                record.attempts += 1
+        if self.limiter is not None:
+            self.limiter.acquire(self.apikey, endpoint)
+        if self.concurrency is None:
+            return self.transport.fetch(url, connect_timeout, read_timeout)
+        self.concurrency.acquire()
+        started, ok = time.time(), False
+        try:
+            ret = self.transport.fetch(url, connect_timeout, read_timeout)
+            ok = _healthy(ret)
+        finally:
+            self.concurrency.release(time.time() - started, ok)
+        return ret
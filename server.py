@@ -1,50 +1,270 @@
+"""
+JSON proxy in front of the Parse.ly API, sharing one client between requests
+
+    PARSELY_APIKEY=mysite.com PARSELY_SECRET=... python server.py [--port 5000]
+
+The secret falls back to parsely/secret.py (see example.secret.py).
+Serves
+
+    /analytics/(posts|authors|sections|tags)?days=&limit=&page=&sort=
+    /referrers/(social|search|internal|other)?days=
+    /shares/(posts|authors)?days=&limit=&page=
+    /search?q=&limit=&page=
+
+Rendered responses are cached for as long as the client's TTLPolicy allows,
+with an ETag for conditional requests, and kept gzipped as well as plain.
+Identical requests arriving together are rendered once.
+
+Invalid arguments are answered with 400. API errors and failed connections
+are answered with 502, or 503 when the API is throttling or overloaded, and
+timeouts with 504.
+"""
+
 from __future__ import absolute_import
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import socket
+
 import tornado.ioloop
 import tornado.web
 
-from parsely import Parsely
-from parsely.secret import secrets
+from parsely.aio import AsyncParsely
+from parsely.cache import MemoryCache, TTLPolicy
+from parsely.coalesce import SingleFlight
+from parsely.errors import AuthenticationError, HTTPError
+from parsely.models import Post, Shares
 
 API_KEY = "samplesite.com"
 
+# query arguments each method accepts, and how to parse them
+ARGUMENTS = {
+    "analytics": {"days": int, "limit": int, "page": int, "sort": str},
+    "referrers": {"days": int},
+    "shares": {"days": int, "limit": int, "page": int},
+    "search": {"q": str, "limit": int, "page": int, "boost": str},
+}
 
-class TestSyncHandler(tornado.web.RequestHandler):
-    def get(self):
-        """
-        Demonstrates synchronous use of the Parsely client library
-        """
-        p = Parsely(API_KEY, secrets[API_KEY])
-        res = p.analytics(aspect="authors")
-        self.write(res)
-        self.finish()
+_POST_FIELDS = (
+    "url",
+    "title",
+    "section",
+    "author",
+    "pub_date",
+    "tags",
+    "hits",
+    "shares",
+    "visitors",
+    "image_url",
+    "thumb_url_medium",
+    "metadata",
+)
 
 
-class TestCallbackHandler(tornado.web.RequestHandler):
-    @tornado.web.asynchronous
-    def get(self):
-        """
-        Demonstrates asynchronous use of the Parsely client via a callback function
+def jsonable(item):
+    """
+    Return a model object as a dict that json can encode
+    """
+    if isinstance(item, Post):
+        data = {name: getattr(item, name) for name in _POST_FIELDS}
+        data["metrics"] = item.metrics
+        return data
+    if isinstance(item, Shares):
+        return {name: getattr(item, name) for name in Shares.__slots__}
+    data = {"name": item.name, "hits": item.hits}
+    if getattr(item, "ref_type", None) is not None:
+        data["ref_type"] = item.ref_type
+    return data
+
+
+def accepts_gzip(accept_encoding):
+    """
+    Return whether an Accept-Encoding header allows a gzipped response
+
+        >>> accepts_gzip("gzip;q=0, deflate")
+        False
+    """
+    qualities = {}
+    for coding in accept_encoding.split(","):
+        name, _, params = coding.partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[name.strip().lower()] = q
+    return qualities.get("gzip", qualities.get("*", 0.0)) > 0
+
+
+class Rendered(object):
+    """
+    A response body, plain and gzipped, and an ETag for each
+    """
+
+    __slots__ = ("body", "gzipped", "etag", "gzipped_etag")
 
-        Caller must be wrapped in @tornado.web.asynchronous
-        Call to client method must include the _callback kwarg
+    def __init__(self, body):
+        self.body = body
+        self.gzipped = gzip.compress(body, 6)
+        digest = hashlib.sha1(body).hexdigest()
+        self.etag = '"%s"' % digest
+        self.gzipped_etag = '"%s-gzip"' % digest
+
+    def __len__(self):
+        # MemoryCache bounds its size by len()
+        return len(self.body) + len(self.gzipped)
+
+
+class Proxy(object):
+    """
+    Renders client calls to JSON and caches the result
+
+    Cache entries live as long as the client's TTLPolicy gives the request
+    they were rendered from.
+    """
+
+    def __init__(self, client, max_entries=4096, max_bytes=64 * 1024 * 1024):
+        self.client = client
+        self.rendered = MemoryCache(max_entries=max_entries, max_bytes=max_bytes)
+        self.flights = SingleFlight()
+
+    async def render(self, method, kwargs):
+        key = "%s?%s" % (method, sorted(kwargs.items()))
+        entry = self.rendered.get(key)
+        if entry is not None:
+            return entry.value
+        return await self.flights.do_async(
+            key, lambda: self._render(key, method, kwargs)
+        )
+
+    async def _render(self, key, method, kwargs):
+        result = await getattr(self.client, method)(**kwargs)
+        if not isinstance(result, list):
+            result = [result]
+        rendered = Rendered(
+            json.dumps({"data": [jsonable(item) for item in result]}).encode("utf-8")
+        )
+        endpoint, options = self.client._describe(method, **kwargs)
+        ttl = self.client.conn.ttl_policy.ttl(endpoint, options)
+        if ttl:
+            self.rendered.set(key, rendered, ttl)
+        return rendered
+
+
+class ProxyHandler(tornado.web.RequestHandler):
+    def initialize(self, proxy, method, argument=None):
+        self.proxy = proxy
+        self.method = method
+        self.argument = argument
+
+    async def get(self, value=None):
+        kwargs = self._arguments(value)
+        try:
+            rendered = await self.proxy.render(self.method, kwargs)
+        except AuthenticationError as e:
+            raise tornado.web.HTTPError(502, "upstream rejected credentials: %s" % e)
+        except HTTPError as e:
+            # pass on that the API is overloaded, so clients back off
+            status = 503 if e.code in (429, 503) else 502
+            raise tornado.web.HTTPError(status, "upstream error: %s" % e)
+        except (TimeoutError, socket.timeout) as e:
+            raise tornado.web.HTTPError(504, "upstream timed out: %s" % e)
+        except OSError as e:
+            raise tornado.web.HTTPError(502, "upstream unreachable: %s" % e)
+
+        gzipped = accepts_gzip(self.request.headers.get("Accept-Encoding", ""))
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        self.set_header("Vary", "Accept-Encoding")
+        self.set_header("Etag", rendered.gzipped_etag if gzipped else rendered.etag)
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+        if gzipped:
+            self.set_header("Content-Encoding", "gzip")
+            self.write(rendered.gzipped)
+        else:
+            self.write(rendered.body)
+
+    def write_error(self, status_code, **kwargs):
+        error = kwargs.get("exc_info", (None, None))[1]
+        message = getattr(error, "log_message", None) or self._reason
+        self.finish({"code": status_code, "message": message})
+
+    def _arguments(self, value=None):
+        """
+        Parse the query arguments into keyword arguments for the client
+        method, answering 400 for any the method would reject
         """
+        allowed = ARGUMENTS[self.method]
+        kwargs = {}
+        for name in self.request.query_arguments:
+            if name not in allowed:
+                raise tornado.web.HTTPError(400, "unknown argument: %s" % name)
+            try:
+                kwargs[name] = allowed[name](self.get_query_argument(name))
+            except ValueError:
+                raise tornado.web.HTTPError(400, "invalid %s" % name)
+        if self.method == "search":
+            if "q" not in kwargs:
+                raise tornado.web.HTTPError(400, "missing argument: q")
+            kwargs["query"] = kwargs.pop("q")
+        if self.argument is not None:
+            kwargs[self.argument] = value
+        try:
+            # checks the arguments without making the request
+            self.proxy.client._describe(self.method, **kwargs)
+        except ValueError as e:
+            raise tornado.web.HTTPError(400, str(e))
+        return kwargs
 
-        def callback(result):
-            self.write(result)
-            self.finish()
 
-        p = Parsely(API_KEY, secrets[API_KEY])
-        p.analytics(aspect="authors", _callback=callback)
+def get_client(root=None):
+    apikey = os.environ.get("PARSELY_APIKEY", API_KEY)
+    secret = os.environ.get("PARSELY_SECRET")
+    if secret is None:
+        from parsely.secret import secrets
+
+        secret = secrets[apikey]
+    return AsyncParsely(
+        apikey,
+        secret,
+        root=root,
+        cache=MemoryCache(),
+        ttl_policy=TTLPolicy(stale=30),
+    )
 
 
-def get_app():
-    application = tornado.web.Application(
-        [(r"/test_sync", TestSyncHandler), (r"/test_callback", TestCallbackHandler)]
+def get_app(client=None, **settings):
+    proxy = Proxy(client if client is not None else get_client())
+    routes = [
+        (r"/analytics/(posts|authors|sections|tags)", "analytics", "aspect"),
+        (r"/referrers/(social|search|internal|other)", "referrers", "ref_type"),
+        (r"/shares/(posts|authors)", "shares", "aspect"),
+        (r"/search", "search", None),
+    ]
+    return tornado.web.Application(
+        [
+            (
+                pattern,
+                ProxyHandler,
+                {"proxy": proxy, "method": method, "argument": argument},
+            )
+            for pattern, method, argument in routes
+        ],
+        **settings
     )
-    return application
 
 
 if __name__ == "__main__":
-    application = get_app()
-    application.listen(5000)
-    tornado.ioloop.IOLoop.instance().start()
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--root", default=None, help="API root, e.g. a mock")
+    args = parser.parse_args()
+    get_app(get_client(root=args.root)).listen(args.port)
+    tornado.ioloop.IOLoop.current().start()